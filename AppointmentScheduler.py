@@ -1,23 +1,190 @@
-from queue import PriorityQueue
+import heapq
+import threading
 import time
+from array import array
+from collections import Counter
+from contextlib import nullcontext
+from itertools import islice
+
+from Patient import grow_slots, slot_value
+
+NOT_QUEUED = -1  # Position of a patient_id with no entry in the heap
 
 
 class AppointmentScheduler:
-    def __init__(self):
-        # Initialize the AppointmentScheduler
-        self.queue = PriorityQueue()  # Priority queue to store patients
+    def __init__(self, thread_safe=False):
+        # Initialize the AppointmentScheduler; pass thread_safe=True if the queue is shared between threads
+        self.heap = []  # Indexed binary heap of (priority_level, timestamp, counter, patient) entries;
+        # entries are replaced rather than changed, so a copy of the list is a consistent snapshot of the queue
+        self.positions = array("l")  # Index of each patient's heap entry by patient_id, or NOT_QUEUED
+        self.level_counts = {}  # Number of queued patients at each priority level
         self.counter = 0  # Initialize a counter to break ties
+        # The Tk main thread is the only caller by default, so locking is opt-in
+        self.lock = threading.RLock() if thread_safe else nullcontext()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, patient):
+        return slot_value(self.positions, patient.patient_id, NOT_QUEUED) != NOT_QUEUED
 
     def add_patient(self, patient):
-        # Add a patient to the priority queue with priority based on their priority level, arrival time, and counter
-        timestamp = time.time()  # Get the current time as a timestamp
-        self.queue.put((patient.priority_level, timestamp, self.counter, patient))
-        self.counter += 1  # Increment the counter for the next patient
+        # Add a patient to the queue with priority based on their priority level, arrival time, and counter
+        with self.lock:
+            if patient in self:
+                self.update_patient(patient)
+                return
+            timestamp = time.time()  # Get the current time as a timestamp
+            self.heap.append((patient.priority_level, timestamp, self.counter, patient))
+            self.counter += 1  # Increment the counter for the next patient
+            grow_slots(self.positions, patient.patient_id, NOT_QUEUED)
+            self.positions[patient.patient_id] = len(self.heap) - 1
+            self.count_level(patient.priority_level, 1)
+            self.sift_up(len(self.heap) - 1)
+
+    def add_patients(self, patients):
+        # Add many patients at once, heapifying a single time instead of sifting each one in
+        with self.lock:
+            timestamp = time.time()
+            start = len(self.heap)
+            entries = []
+            for patient in patients:
+                if patient in self:
+                    if self.positions[patient.patient_id] < start:  # Queued before this batch, not earlier in it
+                        self.update_patient(patient)
+                    continue
+                grow_slots(self.positions, patient.patient_id, NOT_QUEUED)
+                self.positions[patient.patient_id] = start + len(entries)  # Where the entry lands once extended
+                entries.append((patient.priority_level, timestamp, self.counter + len(entries), patient))
+            self.counter += len(entries)
+            for level, count in Counter(entry[0] for entry in entries).items():
+                self.count_level(level, count)
+            self.heap.extend(entries)
+            if len(entries) > start:
+                # Rebuilding is linear, which beats sifting each entry once the batch outweighs the heap
+                heapq.heapify(self.heap)
+                positions = self.positions
+                for index, entry in enumerate(self.heap):
+                    positions[entry[3].patient_id] = index
+            else:
+                for index in range(start, len(self.heap)):
+                    self.sift_up(index)
+
+    def update_patient(self, patient):
+        # Move a queued patient to match its current priority level, keeping its original arrival order
+        with self.lock:
+            index = slot_value(self.positions, patient.patient_id, NOT_QUEUED)
+            if index == NOT_QUEUED:
+                return False
+            entry = self.heap[index]
+            if entry[0] != patient.priority_level:
+                self.count_level(entry[0], -1)
+                self.count_level(patient.priority_level, 1)
+                self.heap[index] = (patient.priority_level,) + entry[1:]
+                self.sift_up(index)
+                self.sift_down(self.positions[patient.patient_id])
+            return True
+
+    def remove_patient(self, patient):
+        # Remove a patient from the queue
+        with self.lock:
+            index = slot_value(self.positions, patient.patient_id, NOT_QUEUED)
+            if index == NOT_QUEUED:
+                return False
+            self.positions[patient.patient_id] = NOT_QUEUED
+            removed = self.heap[index]
+            self.count_level(removed[0], -1)
+            last = self.heap.pop()
+            if index < len(self.heap):
+                self.heap[index] = last
+                self.positions[last[3].patient_id] = index
+                self.sift_up(index)
+                self.sift_down(self.positions[last[3].patient_id])
+            return True
+
+    def count_below(self, priority_level):
+        # Return how many queued patients have a priority level lower than the one given
+        return sum(count for level, count in self.level_counts.items() if level < priority_level)
+
+    def iter_patients(self):
+        # Yield queued patients in priority order without modifying the queue
+        heap = self.heap
+        if not heap:
+            return
+        frontier = [(heap[0][0], heap[0][1], heap[0][2], 0)]
+        while frontier:
+            index = heapq.heappop(frontier)[3]
+            yield heap[index][3]
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    entry = heap[child]
+                    heapq.heappush(frontier, (entry[0], entry[1], entry[2], child))
+
+    def get_patients(self, start, count):
+        # Return count patients in priority order beginning at position start
+        with self.lock:
+            return list(islice(self.iter_patients(), start, start + count))
 
     def get_all_patients(self):
-        # Retrieve and return all patients from the priority queue, sorted by priority, arrival time, and counter
-        patients = []
-        while not self.queue.empty():
-            _, _, _, patient = self.queue.get()
-            patients.append(patient)
-        return patients
+        # Return all patients sorted by priority, arrival time, and counter, leaving the queue intact
+        with self.lock:
+            return list(self.iter_patients())
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        self.add_patient(patient)
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        self.add_patients(patients)
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited
+        self.update_patient(patient)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        self.remove_patient(patient)
+
+    def count_level(self, priority_level, delta):
+        # Keep the per-level patient counts in step with the heap
+        count = self.level_counts.get(priority_level, 0) + delta
+        if count:
+            self.level_counts[priority_level] = count
+        else:
+            self.level_counts.pop(priority_level, None)
+
+    def sift_up(self, index):
+        # Move the entry at index toward the root until the heap property holds
+        heap = self.heap
+        positions = self.positions
+        entry = heap[index]
+        while index > 0:
+            parent = (index - 1) // 2
+            if heap[parent] <= entry:
+                break
+            heap[index] = heap[parent]
+            positions[heap[index][3].patient_id] = index
+            index = parent
+        heap[index] = entry
+        positions[entry[3].patient_id] = index
+
+    def sift_down(self, index):
+        # Move the entry at index toward the leaves until the heap property holds
+        heap = self.heap
+        positions = self.positions
+        size = len(heap)
+        entry = heap[index]
+        while True:
+            child = 2 * index + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[index] = heap[child]
+            positions[heap[index][3].patient_id] = index
+            index = child
+        heap[index] = entry
+        positions[entry[3].patient_id] = index
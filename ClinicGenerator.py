@@ -0,0 +1,45 @@
+import random
+from datetime import date, timedelta
+
+# Syllables combined into names, giving tens of thousands of distinct first and last names
+NAME_STARTS = ["Al", "Bel", "Car", "Dan", "El", "Fran", "Gar", "Hal", "Is", "Jo", "Kat", "Lor", "Mar", "Nor", "Ol",
+               "Pat", "Quin", "Ros", "Sam", "Tor", "Ul", "Val", "Wil", "Xan", "Yor", "Zel"]
+NAME_MIDDLES = ["", "a", "e", "i", "o", "an", "en", "in", "or", "er", "el", "ar"]
+NAME_ENDS = ["", "a", "ie", "y", "on", "son", "ton", "ley", "ford", "man", "ez", "ski", "berg", "ridge", "wood"]
+# Share of households with 1, 2, 3, 4 and 5 members
+HOUSEHOLD_SIZES = [1, 2, 3, 4, 5]
+HOUSEHOLD_WEIGHTS = [30, 30, 20, 15, 5]
+PROVIDERS = ["VSP", "EyeMed", "Davis Vision", "Spectera", "Aetna"]
+
+
+def make_name(rng):
+    return rng.choice(NAME_STARTS) + rng.choice(NAME_MIDDLES) + rng.choice(NAME_ENDS)
+
+
+def make_date(rng, start_year, end_year):
+    # A random MM-DD-YYYY date between the start of start_year and the end of end_year
+    start = date(start_year, 1, 1)
+    day = start + timedelta(days=rng.randrange((date(end_year, 12, 31) - start).days + 1))
+    return day.strftime("%m-%d-%Y")
+
+
+def generate_clinic(size, seed):
+    # Build size patient records grouped into households, as (primary record, insurance, dependent records) tuples
+    rng = random.Random(seed)
+    households = []
+    count = 0
+    while count < size:
+        members = min(rng.choices(HOUSEHOLD_SIZES, HOUSEHOLD_WEIGHTS)[0], size - count)
+        last_name = make_name(rng)
+        address = f"{rng.randrange(1, 9999)} {make_name(rng)} St"
+        phone = f"{rng.randrange(200, 999)}-{rng.randrange(200, 999)}-{rng.randrange(1000, 9999)}"
+        records = []
+        for index in range(members):
+            records.append((make_name(rng), last_name, make_date(rng, 1940 if index == 0 else 1990, 2020), phone,
+                            address, make_date(rng, 2015, 2024) if rng.random() < 0.8 else "N/A",
+                            rng.random() < 0.02, "N/A", rng.random() < 0.25))
+        insurance = (f"{records[0][0]} {last_name}", rng.choice(PROVIDERS), str(rng.randrange(10 ** 8)),
+                     rng.random() < 0.9, rng.random() < 0.5, rng.choice(["0", "10", "20", "30"]))
+        households.append((records[0], insurance, records[1:]))
+        count += members
+    return households
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import gc
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from ClinicService import ClinicService, describe_booking, describe_insurance, describe_patient
+from DispatchSimulator import EXAM_MINUTES
+from Validation import parse_date
+from ClinicGenerator import generate_clinic
+
+RECORD_FIELDS = ("first_name", "last_name", "dob", "phone", "address", "last_exam", "emergent_issue", "prescription",
+                 "conditions")
+INSURANCE_FIELDS = ("primary_name", "provider_name", "policy_number", "vision_coverage", "medical_coverage", "copay")
+# Share of each operation in the load generator's traffic
+LOAD_MIX = {"search": 50, "next_appointments": 20, "list_sorted": 15, "add_family": 15}
+
+
+class ClinicServer:
+    def __init__(self, service, host="127.0.0.1", port=8765, sync_interval=1.0, tick_interval=60.0, workers=0):
+        # JSON Lines front end for a ClinicService: each request line is {"id": ..., "op": ..., "args": {...}} and
+        # gets one response line {"id": ..., "ok": true, "result": ...} or {"id": ..., "ok": false, "error": ...}.
+        # Requests run on the event loop, or on a pool of worker threads when workers is set; the service's
+        # family and commit locks keep concurrent requests apart
+        self.service = service
+        self.workers = ThreadPoolExecutor(max_workers=workers) if workers else None
+        self.host = host
+        self.port = port
+        self.sync_interval = sync_interval
+        self.tick_interval = tick_interval
+        self.server = None
+        self.maintenance = None
+        self.requests = 0
+        self.operations = {
+            "add_family": self.add_family,
+            "add_member": self.add_member,
+            "search": self.search,
+            "edit": self.edit,
+            "delete": self.delete,
+            "family": self.family,
+            "query": self.query,
+            "book_next": self.book_next,
+            "cancel_booking": self.cancel_booking,
+            "bookings": self.bookings,
+            "simulate": self.simulate,
+            "list_sorted": self.list_sorted,
+            "next_appointments": self.next_appointments,
+            "stats": self.stats,
+        }
+
+    async def start(self):
+        # Start listening; with port 0 the system picks a free port, stored back in self.port
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.maintenance = asyncio.create_task(self.maintain())
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        # Stop accepting clients and flush the store
+        if self.maintenance is not None:
+            self.maintenance.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.workers is not None:
+            self.workers.shutdown()
+        self.service.sync()
+
+    async def maintain(self):
+        # Flush batched journal records every second and re-rank newly overdue patients every minute; syncing
+        # runs on a thread, so writing out a compacted snapshot never stalls the event loop
+        last_tick = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await asyncio.get_running_loop().run_in_executor(None, self.service.sync)
+            if time.monotonic() - last_tick >= self.tick_interval:
+                self.service.tick()
+                last_tick = time.monotonic()
+
+    async def handle_client(self, reader, writer):
+        # Answer one client's requests in order until it disconnects
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if self.workers is None:
+                    response = self.respond(line)
+                else:
+                    response = await asyncio.get_running_loop().run_in_executor(self.workers, self.respond, line)
+                self.requests += 1
+                writer.write(response)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, line):
+        # Run one request line and encode its response line
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            operation = self.operations.get(request.get("op"))
+            if operation is None:
+                raise ValueError(f"Unknown operation {request.get('op')!r}.")
+            return (json.dumps({"id": request_id, "ok": True, "result": operation(**request.get("args", {}))})
+                    + "\n").encode()
+        except (ValueError, TypeError, AttributeError) as error:
+            message = str(error)
+        except Exception as error:
+            # A bug rather than a bad request, but the client still gets an answer instead of a dropped line
+            message = f"Internal error: {type(error).__name__}: {error}"
+        return (json.dumps({"id": request_id, "ok": False, "error": message}) + "\n").encode()
+
+    def find(self, key):
+        # Resolve a {"patient_id"} or {"first_name", "last_name", "dob"} key to a patient
+        if "patient_id" in key:
+            return self.service.get_patient(key["patient_id"])
+        return self.service.find_patient(key.get("first_name", ""), key.get("last_name", ""), key.get("dob"))
+
+    def add_family(self, patient, insurance=None):
+        new_patient = self.service.build_patient(patient)
+        insurance_info = self.service.build_insurance(f"{new_patient.first_name} {new_patient.last_name}",
+                                                      insurance or {})
+        self.service.add_family(new_patient, insurance_info)
+        return describe_patient(new_patient)
+
+    def add_member(self, family, patient):
+        family_node = self.service.family_of(self.find(family))
+        if family_node is None:
+            raise ValueError("That patient is not part of a family.")
+        new_patient = self.service.build_patient(patient)
+        self.service.add_member(family_node, new_patient)
+        return describe_patient(new_patient)
+
+    def search(self, query, limit=10):
+        return [describe_patient(patient) for patient in self.service.search(query, limit)]
+
+    def edit(self, patient, changes):
+        return describe_patient(self.service.edit_patient(self.find(patient), **changes))
+
+    def delete(self, patient):
+        return [describe_patient(removed) for removed in self.service.delete_patient(self.find(patient))]
+
+    def family(self, patient):
+        primary, dependents, insurance_info = self.service.family_members(self.find(patient))
+        return {"primary": describe_patient(primary), "dependents": [describe_patient(child) for child in dependents],
+                "insurance": describe_insurance(insurance_info)}
+
+    def query(self, filters, limit=50, group_by=None):
+        # Patients matching filters such as {"conditions": true, "overdue": true, "provider_name": ["VSP"]},
+        # with the number of matches per value of group_by if given
+        matches, patients = self.service.query(limit, **filters)
+        result = {"count": matches, "patients": [describe_patient(patient) for patient in patients]}
+        if group_by is not None:
+            counts = self.service.count_by(group_by, **filters)
+            result["counts"] = {str(value): count for value, count in counts.items()}  # JSON keys are strings
+        return result
+
+    def book_next(self, count=10, length=30, after=None):
+        # Book the front of the appointment queue; after is an ISO date and time such as "2024-05-06T09:00"
+        after = datetime.fromisoformat(after) if after else None
+        return [describe_booking(booking) for booking in self.service.book_next(count, length, after)]
+
+    def cancel_booking(self, booking_id):
+        self.service.cancel_booking(booking_id)
+        return True
+
+    def bookings(self, provider, day):
+        # A provider's bookings on a MM-DD-YYYY day
+        return [describe_booking(booking) for booking in self.service.day_bookings(provider, parse_date(day))]
+
+    def simulate(self, providers, exam_minutes=None, arrivals_per_hour=None, hours=0, seed=None):
+        # Wait times and utilization for each staffing level in providers; the per-level maps have string keys
+        # in JSON, e.g. {"exam_minutes": {"1": [30, 60], "4": 20}, "arrivals_per_hour": {"3": 2.5}}
+        exam_minutes = {int(level): minutes for level, minutes in exam_minutes.items()} if exam_minutes else None
+        arrivals_per_hour = {int(level): rate for level, rate in (arrivals_per_hour or {}).items()}
+        results = self.service.simulate_staffing(providers, exam_minutes or EXAM_MINUTES, arrivals_per_hour,
+                                                 hours * 60, seed)
+        return [result.as_dict() for result in results.values()]
+
+    def list_sorted(self, start=0, count=50):
+        return [describe_patient(patient) for patient in self.service.list_sorted(start, count)]
+
+    def next_appointments(self, count=10, start=0):
+        return [describe_patient(patient) for patient in self.service.next_appointments(count, start)]
+
+    def stats(self):
+        return {"patients": len(self.service), "requests": self.requests}
+
+
+def load_households(service, households):
+    # Register generated households (from ClinicGenerator.generate_clinic) with a service
+    for primary, insurance, dependents in households:
+        family_node = service.add_family(service.build_patient(dict(zip(RECORD_FIELDS, primary))),
+                                         service.build_insurance(insurance[0],
+                                                                 dict(zip(INSURANCE_FIELDS, insurance))))
+        for dependent in dependents:
+            service.add_member(family_node, service.build_patient(dict(zip(RECORD_FIELDS, dependent))))
+
+
+def make_request(rng, households, new_households):
+    # One request of the load mix: searches by a known last name, pages through the lists, or adds a family
+    operation = rng.choices(list(LOAD_MIX), list(LOAD_MIX.values()))[0]
+    if operation == "search":
+        return operation, {"query": rng.choice(households)[0][1], "limit": 10}
+    if operation == "next_appointments":
+        return operation, {"count": 20, "start": rng.randrange(100)}
+    if operation == "list_sorted":
+        return operation, {"start": rng.randrange(1000), "count": 20}
+    primary, insurance, _ = new_households.pop() if new_households else rng.choice(households)
+    return operation, {"patient": dict(zip(RECORD_FIELDS, primary)),
+                       "insurance": dict(zip(INSURANCE_FIELDS[1:], insurance[1:]))}
+
+
+async def run_client(host, port, requests, rng, households, new_households, latencies, errors):
+    # One simulated front-desk terminal sending requests back to back over its own connection
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for request_id in range(requests):
+            operation, args = make_request(rng, households, new_households)
+            start = time.perf_counter()
+            writer.write((json.dumps({"id": request_id, "op": operation, "args": args}) + "\n").encode())
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if not response["ok"]:
+                errors.append(response["error"])
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def run_load(host, port, clients=50, requests=200, seed=2024):
+    # Drive a running server with concurrent clients and report throughput and latency percentiles
+    households = generate_clinic(1000, seed)
+    new_households = generate_clinic(clients * requests, seed + 1)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(host, port, requests, random.Random(seed + client), households,
+                                      new_households, latencies, errors) for client in range(clients)))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(fraction):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 3)
+
+    return {"clients": clients, "requests": len(latencies), "errors": len(errors), "seconds": round(seconds, 3),
+            "requests_per_second": round(len(latencies) / seconds, 1) if seconds else None,
+            "p50_ms": percentile(0.5), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99)}
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Serve the clinic over JSON Lines, or load test a running server.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="run the server")
+    serve.add_argument("--data-dir", help="directory the patient data is kept in (default: memory only)")
+    serve.add_argument("--backend", choices=["journal", "sqlite"], default="journal")
+    serve.add_argument("--seed-patients", type=int, default=0, help="synthetic patients to start with")
+    serve.add_argument("--workers", type=int, default=0, help="threads to run requests on (default: the event loop)")
+    load = commands.add_parser("load", help="run the load generator against a server")
+    load.add_argument("--clients", type=int, default=50, help="concurrent connections")
+    load.add_argument("--requests", type=int, default=200, help="requests sent by each client")
+    load.add_argument("--seed", type=int, default=2024)
+    for command in (serve, load):
+        command.add_argument("--host", default="127.0.0.1")
+        command.add_argument("--port", type=int, default=8765)
+    options = parser.parse_args(arguments)
+
+    if options.command == "serve":
+        service = ClinicService(options.data_dir, options.backend)
+        if options.seed_patients:
+            load_households(service, generate_clinic(options.seed_patients, 2024))
+        gc.freeze()  # The loaded patients live as long as the server, so collections need not rescan them
+        try:
+            asyncio.run(ClinicServer(service, options.host, options.port,
+                                     workers=options.workers).serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.close()
+    else:
+        print(json.dumps(asyncio.run(run_load(options.host, options.port, options.clients, options.requests,
+                                              options.seed)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+import os
+import threading
+from datetime import datetime
+
+from Patient import Patient, PatientLinkedList, compute_priority, ordinal_text
+from InsuranceInformation import InsuranceInformation
+from InsuranceFamilyTree import InsuranceFamilyTree
+from AppointmentScheduler import AppointmentScheduler
+from SortedPatientIndex import SortedPatientIndex
+from PatientSearchIndex import PatientSearchIndex
+from PriorityEngine import PriorityEngine
+from PatientBitmapIndex import PatientBitmapIndex, bit_positions
+from PatientStore import PatientStore
+from SQLiteRepository import SQLitePatientRepository
+from RecallList import recall_households, write_recall_csv
+from SlotCalendar import SlotCalendar
+from DispatchSimulator import EXAM_MINUTES, staffing_sweep
+
+DEFAULT_PROVIDERS = ("Exam Room 1", "Exam Room 2")  # Providers or rooms appointments are booked with
+
+# Validator for each editable text field, taking just the value
+EDIT_VALIDATORS = {
+    "first_name": lambda value: Patient.validate_name(value, "First Name"),
+    "last_name": lambda value: Patient.validate_name(value, "Last Name"),
+    "dob": lambda value: Patient.validate_dob(value, "Date of Birth"),
+    "phone": Patient.validate_phone,
+    "address": Patient.validate_address,
+    "last_exam": lambda value: Patient.validate_date(value, "Last Exam"),
+    "prescription": Patient.validate_prescription,
+}
+
+
+def describe_patient(patient):
+    # A patient as a JSON-friendly dict
+    last_exam_ordinal = patient.last_exam_ordinal
+    return {
+        "patient_id": patient.patient_id,
+        "first_name": patient.first_name,
+        "last_name": patient.last_name,
+        "dob": patient.dob,
+        "phone": patient.phone,
+        "address": patient.address,
+        "last_exam": ordinal_text(last_exam_ordinal) if last_exam_ordinal is not None else patient.last_exam,
+        "emergent_issue": patient.emergent_issue,
+        "prescription": patient.prescription,
+        "conditions": patient.conditions,
+        "priority_level": patient.priority_level,
+    }
+
+
+def describe_insurance(insurance_info):
+    # Insurance information as a JSON-friendly dict, or None
+    if insurance_info is None:
+        return None
+    return {
+        "primary_name": insurance_info.primary_name,
+        "provider_name": insurance_info.provider_name,
+        "policy_number": insurance_info.policy_number,
+        "vision_coverage": insurance_info.vision_coverage,
+        "medical_coverage": insurance_info.medical_coverage,
+        "copay": insurance_info.copay,
+    }
+
+
+def describe_booking(booking):
+    # A booking as a JSON-friendly dict, with its times as ISO strings
+    return {
+        "booking_id": booking.booking_id,
+        "provider": booking.provider,
+        "patient_id": booking.patient_id,
+        "start": booking.start_time.isoformat(timespec="minutes"),
+        "end": booking.end_time.isoformat(timespec="minutes"),
+    }
+
+
+class ClinicService:
+    def __init__(self, data_dir=None, backend="journal", providers=DEFAULT_PROVIDERS):
+        # The patient registry, family tree and appointment queue with every operation the front desk needs, for
+        # the Tk window, the network server and scripts alike; patient data is kept on disk in data_dir, as a
+        # snapshot and journal (backend="journal") or in a SQLite database (backend="sqlite"), or only in
+        # memory when data_dir is None.
+        # Any number of threads may call the service, and one lock guards everything: every change and every read
+        # of the list, tree, indexes and store holds the commit lock, so changes happen one at a time and readers
+        # wait for a change in progress (and it for them). Reads keep that short by copying out only the page
+        # asked for, and slow work (recall export, snapshot writes, staffing simulation) runs outside the lock
+        self.commit_lock = threading.RLock()
+        self.patient_list = PatientLinkedList()
+        self.family_tree = InsuranceFamilyTree()
+        self.appointment_scheduler = AppointmentScheduler()  # Kept in sync with the patient list
+        self.patient_list.add_listener(self.appointment_scheduler)
+        self.sorted_index = SortedPatientIndex()  # Patients by (last_name, first_name) for the list page
+        self.patient_list.add_listener(self.sorted_index)
+        self.search_index = PatientSearchIndex()  # Prefix and typo-tolerant name search for the search pages
+        self.patient_list.add_listener(self.search_index)
+        self.patient_list.add_listener(self.family_tree)  # Renames and deletes reach the family tree too
+        self.priority_engine = PriorityEngine(self.patient_list)  # Re-ranks patients as they become overdue
+        self.patient_list.add_listener(self.priority_engine)
+        self.bitmap_index = PatientBitmapIndex(self.patient_list, self.family_tree)  # Filters by flags and insurance
+        self.patient_list.add_listener(self.bitmap_index)
+        self.family_tree.add_listener(self.bitmap_index)
+        self.calendar = SlotCalendar(providers)  # Appointment slots per provider; deleted patients' are cancelled
+        self.patient_list.add_listener(self.calendar)
+
+        # Load saved patients and families, then journal every change made from here on
+        self.store = None
+        if data_dir is not None:
+            if backend == "sqlite":
+                os.makedirs(data_dir, exist_ok=True)
+                self.store = SQLitePatientRepository(os.path.join(data_dir, "clinic.db"))
+            else:
+                self.store = PatientStore(data_dir)
+            self.store.load(self.patient_list, self.family_tree)
+
+    def __len__(self):
+        return len(self.patient_list)
+
+    @staticmethod
+    def build_patient(fields):
+        # Validate patient fields (strings, plus booleans for emergent_issue and conditions) into a Patient
+        return Patient(fields.get("first_name", ""), fields.get("last_name", ""), fields.get("dob", ""),
+                       fields.get("phone", ""), fields.get("address", ""), fields.get("last_exam") or "N/A",
+                       bool(fields.get("emergent_issue")), fields.get("prescription") or "N/A",
+                       bool(fields.get("conditions")))
+
+    @staticmethod
+    def build_insurance(primary_name, fields):
+        # Validate insurance fields into InsuranceInformation for the named primary member
+        return InsuranceInformation(primary_name, fields.get("provider_name") or "N/A",
+                                    fields.get("policy_number") or "N/A", bool(fields.get("vision_coverage")),
+                                    bool(fields.get("medical_coverage")), str(fields.get("copay") or "N/A"))
+
+    def find_patient(self, first_name, last_name, dob=None):
+        # The patient with this name (and date of birth, if given); raises ValueError if there is none
+        with self.commit_lock:
+            patient = self.patient_list.find_patient(first_name, last_name, dob)
+        if patient is None:
+            raise ValueError(f"No patient named {first_name} {last_name}" + (f" born {dob}." if dob else "."))
+        return patient
+
+    def get_patient(self, patient_id):
+        # The patient with this patient_id; raises ValueError if there is none
+        patient = self.patient_list.get_patient(patient_id)
+        if patient is None:
+            raise ValueError(f"No patient with id {patient_id}.")
+        return patient
+
+    def family_of(self, patient):
+        # The family node a patient belongs to, or None
+        return self.family_tree.family_of(patient)
+
+    def family_members(self, patient):
+        # (primary member, dependents, insurance) of the family a patient belongs to, read together
+        with self.commit_lock:
+            family = self.family_tree.family_of(patient)
+            if family is None:
+                raise ValueError("That patient is not part of a family.")
+            return (family.patient, [child.patient for child in family.children],
+                    self.family_tree.effective_insurance(family.patient))
+
+    def is_registered(self, patient):
+        return patient in self.patient_list
+
+    def add_family(self, patient, insurance_info):
+        # Register a patient as the primary member of a new family with its insurance; returns the family node
+        patient.insurance_info = insurance_info
+        with self.commit_lock:
+            self.patient_list.insert_patient(patient)
+            return self.family_tree.add_family(patient, insurance_info)
+
+    def add_member(self, family, patient):
+        # Register a patient as a dependent in an existing family node
+        with self.commit_lock:
+            if self.family_tree.family_of(family.patient) is not family:
+                raise ValueError("That family has been deleted.")
+            self.patient_list.insert_patient(patient)
+            return self.family_tree.add_family_member(family, patient)
+
+    def edit_patient(self, patient, **changes):
+        # Validate and apply changes to a patient's fields and re-rank it; nothing changes if any field is invalid
+        updates = {}
+        for field, value in changes.items():
+            if field in ("emergent_issue", "conditions"):
+                updates[field] = bool(value)
+            elif field in EDIT_VALIDATORS:
+                EDIT_VALIDATORS[field](value)
+                updates[field] = value
+            else:
+                raise ValueError(f"{field} cannot be edited.")
+        if "last_exam" in updates and Patient.validate_date(updates["last_exam"], "Last Exam") is None:
+            updates["last_exam"] = "N/A"
+        with self.commit_lock:
+            if not self.is_registered(patient):
+                raise ValueError("That patient has been deleted.")
+            updates["priority_level"] = compute_priority(updates.get("last_exam", patient.last_exam_ordinal),
+                                                         updates.get("conditions", patient.conditions),
+                                                         updates.get("emergent_issue", patient.emergent_issue))
+            self.patient_list.update_patient(patient, **updates)
+        return patient
+
+    def delete_patient(self, patient):
+        # Delete a patient and return everyone removed: a primary member takes their whole family with them
+        with self.commit_lock:
+            family = self.family_tree.family_of(patient)
+            if family is not None and family.patient is patient:
+                removed = self.family_tree.remove_family(family)
+                for family_patient in removed:
+                    self.patient_list.unlink_patient(family_patient)
+                return removed
+            # Unlinking also takes a dependent out of their family, since the tree listens to the list
+            return [patient] if self.patient_list.unlink_patient(patient) else []
+
+    def search(self, query, limit=10):
+        # Patients ranked by how well their name matches the query
+        with self.commit_lock:
+            return self.search_index.search(query, limit)
+
+    def query(self, limit=50, **filters):
+        # (number of matches, first limit matching patients by patient_id) for filters on the flags, priority
+        # and insurance fields, e.g. query(conditions=True, overdue=True, provider_name="VSP")
+        with self.commit_lock:
+            matches = self.bitmap_index.match(**filters)
+            patient_ids = bit_positions(matches, limit)
+            return matches.bit_count(), [self.patient_list.get_patient(patient_id) for patient_id in patient_ids]
+
+    def count_by(self, field, **filters):
+        # {value of field: number of patients matching the filters}, e.g. overdue patients per provider
+        with self.commit_lock:
+            return self.bitmap_index.count_by(field, **filters)
+
+    def book(self, provider, patient, start, length=30):
+        # Book a patient with a provider from start (a datetime) for length minutes; raises ValueError on a clash
+        with self.commit_lock:
+            if not self.is_registered(patient):
+                raise ValueError("That patient has been deleted.")
+            return self.calendar.book(provider, patient.patient_id, start, length)
+
+    def book_next(self, count=10, length=30, after=None):
+        # Book up to count patients from the front of the appointment queue, in priority order, into the
+        # earliest free slots from after (default: now); returns the new bookings
+        with self.commit_lock:
+            return self.calendar.fill(self.appointment_scheduler.iter_patients(), length, after or datetime.now(),
+                                      count)
+
+    def cancel_booking(self, booking_id):
+        with self.commit_lock:
+            if self.calendar.cancel(booking_id) is None:
+                raise ValueError(f"No booking {booking_id}.")
+
+    def reschedule_booking(self, booking_id, start, provider=None):
+        with self.commit_lock:
+            return self.calendar.reschedule(booking_id, start, provider)
+
+    def day_bookings(self, provider, day):
+        # A provider's bookings on one day (a date), in time order
+        with self.commit_lock:
+            return self.calendar.day_bookings(provider, day)
+
+    def write_recall_csv(self, target):
+        # Write the recall list (one row per household with someone due, most urgent first) to a CSV path or
+        # open file. The households are read a chunk at a time under the commit lock and written out after it is
+        # released, so other terminals only wait for one chunk at a time, never for the disk
+        recall = recall_households(self.patient_list, self.family_tree, lock=self.commit_lock)
+        return write_recall_csv(recall, target)
+
+    def list_sorted(self, start=0, count=50):
+        # Patients in (last name, first name) order, count of them beginning at position start; only that page
+        # is copied, so the commit lock is held for O(count) however large the clinic is
+        with self.commit_lock:
+            return self.sorted_index.get_patients(start, count)
+
+    def next_appointments(self, count=10, start=0):
+        # The next patients to schedule, in priority order; walking the heap to the end of the page takes
+        # O((start + count) log n) under the commit lock
+        with self.commit_lock:
+            return self.appointment_scheduler.get_patients(start, count)
+
+    def count_below(self, priority_level):
+        # How many patients have a priority level lower than the one given
+        with self.commit_lock:
+            return self.appointment_scheduler.count_below(priority_level)
+
+    def count_to_schedule(self, below_priority=4):
+        # count_below answered by the SQLite backend's priority index
+        with self.commit_lock:
+            return self.store.count_to_schedule(below_priority)
+
+    def fetch_schedule(self, start, count, below_priority=4):
+        # A page of the schedule from the SQLite backend's priority index, as ScheduledPatient rows
+        with self.commit_lock:
+            return self.store.fetch_schedule(start, count, below_priority)
+
+    def simulate_staffing(self, provider_counts, exam_minutes=EXAM_MINUTES, arrivals_per_hour=None, horizon=0,
+                          seed=None):
+        # {providers: DispatchResult} for each staffing level, starting from the current appointment queue with
+        # new patients arriving at arrivals_per_hour for horizon minutes; runs on a copy of the per-level counts,
+        # so no lock is held while it simulates
+        with self.commit_lock:
+            backlog = dict(self.appointment_scheduler.level_counts)
+        return staffing_sweep(provider_counts, exam_minutes, backlog, arrivals_per_hour, horizon, seed)
+
+    def tick(self):
+        # Re-rank the patients who became overdue since the last tick
+        with self.commit_lock:
+            return self.priority_engine.advance()
+
+    def sync(self):
+        # Flush journal records that are still waiting for a batched fsync. A compaction that falls due is
+        # captured under the commit lock, but its snapshot is written to disk after the lock is released
+        if self.store is None:
+            return
+        with self.commit_lock:
+            compaction = self.store.sync(defer_compaction=True)
+        if compaction is not None:
+            self.store.write_snapshot(compaction)
+
+    def close(self):
+        if self.store is not None:
+            with self.commit_lock:
+                self.store.close()
@@ -0,0 +1,198 @@
+import argparse
+import heapq
+import json
+import random
+import time
+from bisect import bisect_right
+from collections import deque
+from itertools import accumulate
+
+from AppointmentScheduler import AppointmentScheduler
+from ClinicGenerator import generate_clinic
+from Patient import Patient, PatientLinkedList
+
+EXAM_MINUTES = {1: (30, 60), 2: (25, 40), 3: (20, 30), 4: (15, 25)}  # (shortest, longest) exam at each level
+ARRIVALS_PER_HOUR = {1: 0.5, 2: 2.0, 3: 3.0, 4: 1.5}  # Default walk-in and call-in rate at each level
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(ordered, percent):
+    # Nearest-rank percentile of an already sorted list, or None if it is empty
+    if not ordered:
+        return None
+    return ordered[max(0, -(-len(ordered) * percent // 100) - 1)]
+
+
+class DispatchResult:
+    def __init__(self, providers, makespan, busy, waits, waiting):
+        # The outcome of one simulated run; times are in minutes from the start of the run
+        self.providers = providers
+        self.makespan = makespan  # When the last exam finished
+        self.busy = busy  # Minutes each provider spent in exams
+        self.waiting = waiting  # Patients still waiting when the run stopped
+        self.served_by_level = {level: len(level_waits) for level, level_waits in waits.items()}
+        self.served = sum(self.served_by_level.values())
+        self.wait_percentiles = {}  # Maps level to {percent: minutes waited}
+        self.mean_waits = {}
+        for level, level_waits in waits.items():
+            level_waits.sort()
+            self.wait_percentiles[level] = {percent: percentile(level_waits, percent) for percent in PERCENTILES}
+            self.mean_waits[level] = sum(level_waits) / len(level_waits) if level_waits else None
+
+    @property
+    def throughput(self):
+        # Patients seen per hour
+        return self.served * 60 / self.makespan if self.makespan else 0.0
+
+    @property
+    def utilization(self):
+        # Share of the providers' time spent in exams
+        return sum(self.busy) / (self.providers * self.makespan) if self.makespan else 0.0
+
+    def as_dict(self):
+        return {"providers": self.providers, "served": self.served, "waiting": self.waiting,
+                "makespan_minutes": round(self.makespan, 3), "throughput_per_hour": round(self.throughput, 3),
+                "utilization": round(self.utilization, 4),
+                "provider_utilization": [round(busy / self.makespan, 4) if self.makespan else 0.0
+                                         for busy in self.busy],
+                "served_by_level": {str(level): count for level, count in self.served_by_level.items()},
+                "wait_minutes": {str(level): {f"p{percent}": None if minutes is None else round(minutes, 3)
+                                              for percent, minutes in percentiles.items()}
+                                 for level, percentiles in self.wait_percentiles.items()}}
+
+
+class DispatchSimulator:
+    def __init__(self, providers, exam_minutes=EXAM_MINUTES, arrivals_per_hour=None, horizon=0, seed=None):
+        # A discrete-event model of providers working through the appointment queue: whenever a provider frees
+        # up, the waiting patient at the best priority level, earliest arrival first, goes in next, which is the
+        # order AppointmentScheduler keeps. exam_minutes maps each priority level to a fixed length or a
+        # (shortest, longest) range drawn uniformly; new patients arrive as a Poisson process at
+        # arrivals_per_hour for horizon minutes. The same seed gives the same arrivals and exam lengths, so
+        # staffing levels can be compared on identical traffic
+        if providers < 1:
+            raise ValueError("The simulation needs at least one provider.")
+        self.providers = providers
+        self.levels = sorted(exam_minutes)
+        self.exam_ranges = {}
+        for level, minutes in exam_minutes.items():
+            shortest, longest = minutes if isinstance(minutes, (tuple, list)) else (minutes, minutes)
+            if not 0 < shortest <= longest:
+                raise ValueError(f"Exam length for priority level {level} must be positive.")
+            self.exam_ranges[level] = (shortest, longest - shortest)
+        self.arrivals_per_hour = dict(arrivals_per_hour or {})
+        for level, rate in self.arrivals_per_hour.items():
+            if level not in self.exam_ranges:
+                raise ValueError(f"No exam length for priority level {level}.")
+            if rate < 0:
+                raise ValueError(f"Arrival rate for priority level {level} cannot be negative.")
+        self.horizon = horizon
+        self.seed = seed
+
+    def poisson_arrivals(self, rng):
+        # Yield (minute, priority level) for each arrival before the horizon, in time order: one stream at the
+        # combined rate, each arrival's level drawn in proportion to the level rates
+        levels = [level for level, rate in self.arrivals_per_hour.items() if rate > 0]
+        bounds = list(accumulate(self.arrivals_per_hour[level] / 60 for level in levels))
+        if not levels:
+            return
+        total = bounds[-1]
+        expovariate = rng.expovariate
+        uniform = rng.random
+        minute = expovariate(total)
+        while minute < self.horizon:
+            yield minute, levels[min(bisect_right(bounds, uniform() * total), len(levels) - 1)]
+            minute += expovariate(total)
+
+    def run(self, backlog=None, arrivals=None, until=None):
+        # Simulate until everyone has been seen, or no exam starts at or after until. backlog maps priority
+        # level to the number of patients already queued at minute 0, e.g. AppointmentScheduler.level_counts;
+        # arrivals is an iterable of (minute, priority level) in time order, by default the Poisson process.
+        # Each patient costs a few deque and heap operations, so millions of events take seconds
+        if arrivals is None:
+            arrivals = self.poisson_arrivals(random.Random(self.seed))
+        # Exam lengths have their own generator, so the arrivals stay the same whatever order patients are seen in
+        exam_rng = random.Random(None if self.seed is None else self.seed + 1)
+        arrivals = iter(arrivals)
+        held = dict.fromkeys(self.levels, 0)  # Backlog still waiting at each level; all of it arrived at minute 0
+        for level, count in (backlog or {}).items():
+            if level not in held:
+                raise ValueError(f"No exam length for priority level {level}.")
+            held[level] += count
+        queues = {level: deque() for level in self.levels}  # Arrival minutes of the patients waiting at each level
+        waits = {level: [] for level in self.levels}
+        queued = sum(held.values())
+        free = [(0.0, provider) for provider in range(self.providers)]  # Heap of (free from, provider)
+        busy = [0.0] * self.providers
+        levels = self.levels
+        exam_ranges = self.exam_ranges
+        uniform = exam_rng.random
+        next_arrival = next(arrivals, None)
+        while True:
+            now, provider = free[0]
+            while next_arrival is not None and next_arrival[0] <= now:
+                queue = queues.get(next_arrival[1])
+                if queue is None:
+                    raise ValueError(f"No exam length for priority level {next_arrival[1]}.")
+                queue.append(next_arrival[0])
+                queued += 1
+                next_arrival = next(arrivals, None)
+            if not queued:
+                if next_arrival is None:
+                    break
+                heapq.heapreplace(free, (next_arrival[0], provider))  # Idle until the next patient walks in
+                continue
+            if until is not None and now >= until:
+                break
+            for level in levels:
+                if held[level]:
+                    held[level] -= 1
+                    arrived = 0.0
+                    break
+                if queues[level]:
+                    arrived = queues[level].popleft()
+                    break
+            queued -= 1
+            waits[level].append(now - arrived)
+            shortest, spread = exam_ranges[level]
+            minutes = shortest + spread * uniform() if spread else shortest
+            busy[provider] += minutes
+            heapq.heapreplace(free, (now + minutes, provider))
+        makespan = max(busy_until for busy_until, _ in free) if any(busy) else 0.0
+        return DispatchResult(self.providers, makespan, busy, waits, queued)
+
+
+def staffing_sweep(provider_counts, exam_minutes=EXAM_MINUTES, backlog=None, arrivals_per_hour=None, horizon=0,
+                   seed=None, until=None):
+    # {providers: DispatchResult} for each staffing level, all on the same arrivals and exam lengths
+    return {providers: DispatchSimulator(providers, exam_minutes, arrivals_per_hour, horizon, seed).run(backlog,
+                                                                                                     until=until)
+            for providers in provider_counts}
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Simulate providers working through a synthetic clinic's "
+                                                 "appointment queue and report waits for each staffing level.")
+    parser.add_argument("--providers", type=int, nargs="+", default=[2, 3, 4], help="staffing levels to compare")
+    parser.add_argument("--size", type=int, default=10000, help="patients in the synthetic clinic's backlog")
+    parser.add_argument("--hours", type=float, default=8 * 250, help="hours of new arrivals to simulate")
+    parser.add_argument("--rate-scale", type=float, default=1.0, help="multiplier on the default arrival rates")
+    parser.add_argument("--seed", type=int, default=2024, help="random seed, so runs see the same traffic")
+    arguments = parser.parse_args(arguments)
+    scheduler = AppointmentScheduler()
+    patient_list = PatientLinkedList()  # Hands out the patient_ids the scheduler keys its heap entries by
+    patient_list.add_listener(scheduler)
+    households = generate_clinic(arguments.size, arguments.seed)
+    patient_list.insert_patients(Patient(*record) for primary, _, dependents in households
+                                 for record in (primary,) + tuple(dependents))
+    rates = {level: rate * arguments.rate_scale for level, rate in ARRIVALS_PER_HOUR.items()}
+    for providers in arguments.providers:
+        start = time.perf_counter()
+        result = DispatchSimulator(providers, EXAM_MINUTES, rates, arguments.hours * 60, arguments.seed).run(
+            scheduler.level_counts)
+        report = result.as_dict()
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,196 @@
+from Patient import grow_slots, slot_value
+
+
 class FamilyTreeNode:
-    def __init__(self, patient=None):
+    __slots__ = ("patient", "children", "family", "position")
+
+    def __init__(self, patient=None, children=None):
         self.patient = patient  # Initialize the patient data for this node
-        self.children = []  # Initialize a list to store child nodes
+        self.children = [] if children is None else children  # Initialize a list to store child nodes
+        self.family = None  # Family node a dependent belongs to; None for family nodes themselves
+        self.position = None  # Index in the parent's children, for constant-time removal
+
+    @property
+    def patient_id(self):
+        # patient_id of the node's patient; a family is known by its primary member's
+        return self.patient.patient_id
 
 
 class InsuranceFamilyTree:
     def __init__(self):
         self.root = FamilyTreeNode()  # Initialize the root node of the family tree
+        self.listeners = []  # Objects notified when families and members are added or removed (e.g. PatientStore)
+        self.nodes = []  # Node of each patient in the tree by patient_id, or None
+        self.size = 0
+        self.name_index = {}  # Maps (first_name, last_name) to the nodes of patients with that name
+        self.name_keys = []  # Name key each node is indexed under, by patient_id
+
+    def __len__(self):
+        # Number of patients in the tree, primary members and dependents alike
+        return self.size
+
+    def add_listener(self, listener):
+        # Register an object with family_added, member_added, insurance_changed, family_removed and
+        # member_removed hooks
+        self.listeners.append(listener)
 
     def add_family(self, primary_patient, insurance_info=None):
         # Add a new family to the family tree with a primary patient and optional insurance information
         new_family_node = FamilyTreeNode(primary_patient)
         primary_patient.insurance_info = insurance_info  # Assign insurance information to the primary patient
-        self.root.children.append(new_family_node)  # Add the new family as a child of the root node
+        self.attach_node(new_family_node, new_family_node, self.root)  # Add the new family under the root node
+        for listener in self.listeners:
+            listener.family_added(new_family_node)
         return new_family_node  # Return the new family node
 
     def add_family_member(self, family_node, new_member):
         # Add a new family member to an existing family node
-        new_member_node = FamilyTreeNode(new_member)
+        new_member_node = FamilyTreeNode(new_member, ())  # Dependents never have children of their own
         new_member.primary_member = family_node.patient  # Set the primary member of the new member
+        # The member's insurance is resolved through the family (see effective_insurance) rather than copied,
+        # so later changes to the primary member's policy reach every dependent
 
-        # Copy insurance information from the primary member to the new member if it exists
-        if family_node.patient.insurance_info:
-            new_member.insurance_info = family_node.patient.insurance_info
-
-        family_node.children.append(new_member_node)  # Add the new member node to the family node
+        self.attach_node(new_member_node, family_node, family_node)  # Add the new member node to the family node
+        for listener in self.listeners:
+            listener.member_added(family_node, new_member_node)
+        return new_member_node  # Return the new member node
 
     def find_member(self, first_name, last_name):
         # Find and return a family member node by their first name and last name
-        for family in self.root.children:
-            if family.patient.first_name == first_name and family.patient.last_name == last_name:
-                return family
-            for member in family.children:
-                if member.patient.first_name == first_name and member.patient.last_name == last_name:
-                    return member
-        return None  # Return None if the member is not found
+        matches = self.name_index.get((first_name, last_name))
+        return matches[0] if matches else None  # Return None if the member is not found
+
+    def node_of(self, patient):
+        # Return the patient's node, or None if the patient is not in a family
+        return self.node_by_id(patient.patient_id)
+
+    def node_by_id(self, patient_id):
+        # Return the node of the patient with this patient_id, or None if they are not in a family
+        return slot_value(self.nodes, patient_id)
+
+    def family_of(self, patient):
+        # Return the family node of the patient's family, or None if the patient is not in a family
+        node = slot_value(self.nodes, patient.patient_id)
+        return (node.family or node) if node else None
+
+    def effective_insurance(self, patient):
+        # Return the insurance that applies to a patient: their family's primary member's, or their own outside
+        # of a family
+        node = slot_value(self.nodes, patient.patient_id)
+        if node is None:
+            return patient.insurance_info
+        return (node.family or node).patient.insurance_info
+
+    def set_family_insurance(self, family_node, insurance_info):
+        # Replace a family's insurance; it lives on the primary member, which every member resolves through
+        family_node.patient.insurance_info = insurance_info
+        for listener in self.listeners:
+            listener.insurance_changed(family_node)
+
+    def covered_patients(self, coverage="vision_coverage"):
+        # Yield every patient whose family insurance has the given coverage, checking each family only once
+        for family_node in self.root.children:
+            insurance_info = family_node.patient.insurance_info
+            if insurance_info is not None and getattr(insurance_info, coverage):
+                yield family_node.patient
+                for member_node in family_node.children:
+                    yield member_node.patient
+
+    def remove_member(self, member_node):
+        # Take a dependent out of their family
+        family_node = member_node.family
+        self.detach_node(member_node, family_node)
+        member_node.patient.primary_member = None
+        for listener in self.listeners:
+            listener.member_removed(family_node, member_node)
+
+    def remove_family(self, family_node):
+        # Take a whole family out of the tree, returning its patients (primary member first) so the caller can
+        # delete them too; the dependents are dropped together, in time linear in the size of the family
+        patients = [family_node.patient]
+        for member_node in family_node.children:
+            self.unindex_node(member_node)
+            member_node.patient.primary_member = None
+            patients.append(member_node.patient)
+        self.detach_node(family_node, self.root)
+        for listener in self.listeners:
+            listener.family_removed(family_node)
+        family_node.children = []
+        return patients
+
+    def remove_patient(self, patient):
+        # Take a patient out of the tree: a primary member takes their family with them, a dependent leaves alone
+        node = slot_value(self.nodes, patient.patient_id)
+        if node is None:
+            return False
+        if node.family is None:
+            self.remove_family(node)
+        else:
+            self.remove_member(node)
+        return True
+
+    def attach_node(self, node, family_node, parent):
+        # Append a node to its parent's children and index it
+        node.position = len(parent.children)
+        parent.children.append(node)
+        patient_id = node.patient.patient_id
+        if patient_id >= len(self.nodes):  # nodes and name_keys always have the same length
+            grow_slots(self.nodes, patient_id)
+            grow_slots(self.name_keys, patient_id)
+        self.nodes[patient_id] = node
+        self.size += 1
+        node.family = family_node if family_node is not node else None
+        self.index_name(node)
+
+    def detach_node(self, node, parent):
+        # Remove a node from its parent's children by moving the last child into its place
+        index = node.position
+        last_node = parent.children.pop()
+        if last_node is not node:
+            parent.children[index] = last_node
+            last_node.position = index
+        self.unindex_node(node)
+
+    def unindex_node(self, node):
+        # Forget a node in every index
+        node.position = None
+        patient_id = node.patient.patient_id
+        self.nodes[patient_id] = None
+        self.size -= 1
+        node.family = None
+        key = self.name_keys[patient_id]
+        self.name_keys[patient_id] = None
+        matches = self.name_index[key]
+        matches.remove(node)
+        if not matches:
+            del self.name_index[key]
+
+    def index_name(self, node):
+        key = (node.patient.first_name, node.patient.last_name)
+        self.name_index.setdefault(key, []).append(node)
+        self.name_keys[node.patient.patient_id] = key
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList; new patients join a family separately
+        pass
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList; new patients join a family separately
+        pass
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited; renames are re-indexed
+        node = slot_value(self.nodes, patient.patient_id)
+        if node is not None and self.name_keys[patient.patient_id] != (patient.first_name, patient.last_name):
+            key = self.name_keys[patient.patient_id]
+            self.name_index[key].remove(node)
+            if not self.name_index[key]:
+                del self.name_index[key]
+            self.index_name(node)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        self.remove_patient(patient)
 
     def print_family_tree(self):
         # Print the entire family tree starting from the root node
@@ -1,21 +1,37 @@
+import gc
 import tkinter as tk
-from datetime import datetime, timedelta
-from tkinter import messagebox
-from Patient import Patient, PatientLinkedList
+from datetime import date
+from tkinter import filedialog, messagebox
+from Patient import Patient, ordinal_text
 from InsuranceInformation import InsuranceInformation
-from InsuranceFamilyTree import InsuranceFamilyTree, FamilyTreeNode
-from AppointmentScheduler import AppointmentScheduler
+from InsuranceFamilyTree import FamilyTreeNode
+from SQLiteRepository import SQLitePatientRepository
+from ClinicService import ClinicService
+from PatientImporter import PatientImport, chunked, read_records, validate_chunk
+from TaskExecutor import TaskExecutor
 
 
 class OptometristApp(tk.Tk):
-    def __init__(self, *args, **kwargs):
-        # Initialize the main application window
+    def __init__(self, *args, data_dir="clinic_data", backend="journal", **kwargs):
+        # Initialize the main application window; patient data is kept on disk in data_dir, either as a
+        # snapshot and journal (backend="journal") or in a SQLite database (backend="sqlite")
         tk.Tk.__init__(self, *args, **kwargs)
         self.geometry("700x650")  # Set the window size
 
-        # Initialize shared resources
-        self.patient_list = PatientLinkedList()
-        self.family_tree = InsuranceFamilyTree()
+        # The service owns the patient list, family tree, indexes and store; the window is one of its clients
+        self.service = ClinicService(data_dir, backend)
+        self.patient_list = self.service.patient_list
+        self.family_tree = self.service.family_tree
+        self.appointment_scheduler = self.service.appointment_scheduler
+        self.sorted_index = self.service.sorted_index
+        self.search_index = self.service.search_index
+        self.priority_engine = self.service.priority_engine
+        self.store = self.service.store
+        gc.freeze()  # The loaded patients live as long as the window, so collections need not rescan them
+        self.tasks = TaskExecutor(self)  # Slow work runs here so the window keeps responding
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(1000, self.sync_store)
+        self.tick_priorities()
 
         # Create a container for all frames
         container = tk.Frame(self)
@@ -36,6 +52,29 @@ class OptometristApp(tk.Tk):
         # Show the initial frame (HomePage)
         self.show_frame(HomePage)
 
+    def sync_store(self):
+        # Flush journal records that are still waiting for a batched fsync on a worker thread, since now and
+        # then it writes out a compacted snapshot; the next sync is scheduled once this one is done
+        self.tasks.submit(lambda task: self.service.sync(), on_done=self.schedule_sync, on_error=self.sync_failed)
+
+    def schedule_sync(self, result=None):
+        self.after(1000, self.sync_store)
+
+    def sync_failed(self, error):
+        messagebox.showerror("Error", f"Could not save patient data: {error}")
+        self.schedule_sync()
+
+    def tick_priorities(self):
+        # Re-rank the patients who became overdue since the last tick, then check again in a minute
+        self.service.tick()
+        self.after(60000, self.tick_priorities)
+
+    def on_close(self):
+        # Stop background work and make sure everything is on disk before the window closes
+        self.tasks.shutdown()
+        self.service.close()
+        self.destroy()
+
     def show_frame(self, cont):
         # Show the specified frame and perform additional actions if needed
         frame = self.frames[cont]
@@ -89,6 +128,101 @@ class HomePage(tk.Frame):
                                              command=lambda: controller.show_frame(ViewAllPatientsPage))
         view_all_patients_button.pack(padx=5, pady=5)
 
+        # Importing validates the file in background processes and adds each chunk as it comes back
+        self.import_button = tk.Button(self, text="Import Patients", font=button_font, bg=button_color,
+                                       command=self.import_patients)
+        self.import_button.pack(padx=5, pady=5)
+        self.cancel_button = tk.Button(self, text="Cancel Import", font=button_font, bg=button_color,
+                                       command=self.cancel_import)
+        self.import_status = tk.Label(self, text="", font=button_font, bg='#DCDCDD')
+        self.import_status.pack(pady=5)
+        self.import_task = None
+        self.patient_import = None
+
+    def import_patients(self):
+        # Ask for a CSV or JSON Lines export and import it without blocking the window
+        path = filedialog.askopenfilename(filetypes=[("Patient exports", "*.csv *.jsonl *.json")])
+        if not path:
+            return
+        self.patient_import = PatientImport(self.linked_list, self.family_tree)
+        self.import_task = self.controller.tasks.map_process(validate_chunk, chunked(read_records(path), 1000),
+                                                             on_result=self.import_chunk,
+                                                             on_done=lambda chunks: self.finish_import(),
+                                                             on_error=self.import_failed)
+        self.import_button.config(state="disabled")
+        self.cancel_button.pack(padx=5, pady=5)
+        self.import_status.config(text="Importing...")
+
+    def import_chunk(self, chunk):
+        # Runs on the main thread for each validated chunk, in file order
+        with self.controller.service.commit_lock:
+            self.patient_import.add_chunk(chunk)
+        result = self.patient_import.result
+        self.import_status.config(text=f"Imported {result.imported} patients, {len(result.errors)} rows skipped...")
+
+    def finish_import(self):
+        result = self.patient_import.finish()
+        self.end_import(f"Imported {result.imported} patients in {result.families} families, "
+                        f"{len(result.errors)} rows skipped.")
+
+    def import_failed(self, error):
+        self.patient_import.finish()
+        self.end_import(f"Import stopped: {error}")
+
+    def cancel_import(self):
+        # Stop validating the rest of the file; chunks already added stay imported
+        if self.import_task is not None:
+            self.import_task.cancel()
+            self.end_import(f"Import cancelled after {self.patient_import.finish().imported} patients.")
+
+    def end_import(self, message):
+        self.import_task = None
+        self.import_button.config(state="normal")
+        self.cancel_button.pack_forget()
+        self.import_status.config(text=message)
+
+
+class PatientSuggestionBox(tk.Frame):
+    def __init__(self, parent, search_index, on_select, limit=8):
+        # Name entry that shows ranked matches from the search index as the user types
+        tk.Frame.__init__(self, parent, background='#DCDCDD')
+        self.search_index = search_index
+        self.on_select = on_select  # Called with the chosen patient
+        self.limit = limit
+        self.results = []
+
+        label = tk.Label(self, text="Quick Search:", font=("Helvetica", 12), bg='#DCDCDD')
+        label.grid(row=0, column=0, padx=5, pady=5)
+        self.entry = tk.Entry(self, font=("Helvetica", 10))
+        self.entry.grid(row=0, column=1, padx=5, pady=5)
+        self.listbox = tk.Listbox(self, height=limit, width=40, font=("Helvetica", 10))
+        self.listbox.grid(row=1, column=0, columnspan=2, padx=5)
+
+        self.entry.bind("<KeyRelease>", self.update_results)
+        self.listbox.bind("<<ListboxSelect>>", self.choose)
+
+    def update_results(self, event=None):
+        # Re-run the search for the text typed so far
+        self.show_results(self.search_index.search(self.entry.get(), self.limit))
+
+    def show_results(self, results):
+        # Replace the suggestions with a new ranked list of patients
+        self.results = results
+        self.listbox.delete(0, tk.END)
+        for patient in results:
+            self.listbox.insert(tk.END, f"{patient.first_name} {patient.last_name}, DOB: {patient.dob}")
+
+    def choose(self, event=None):
+        # Hand the selected suggestion to the page
+        selection = self.listbox.curselection()
+        if selection:
+            self.on_select(self.results[selection[0]])
+
+    def clear(self):
+        # Empty the entry and the suggestions
+        self.entry.delete(0, tk.END)
+        self.show_results([])
+
 
 class SearchFamilyPage(tk.Frame):
     def __init__(self, parent, controller, linked_list, family_tree):
@@ -111,6 +245,10 @@ class SearchFamilyPage(tk.Frame):
         subtitle = tk.Label(self, text="Please enter details", font=("Helvetica", 14), bg='#DCDCDD')
         subtitle.pack()
 
+        # Type-ahead search over patient names
+        self.suggestion_box = PatientSuggestionBox(self, controller.search_index, self.select_suggestion)
+        self.suggestion_box.pack(pady=5)
+
         # Entry Frame
         entry_frame = tk.Frame(self, bg='#DCDCDD')
         entry_frame.pack(pady=10)
@@ -154,12 +292,6 @@ class SearchFamilyPage(tk.Frame):
         self.reset_page()
         self.controller.show_frame(HomePage)
 
-    def is_patient_match(self, patient, first_name, last_name, dob):
-        return (patient and
-                patient.first_name == first_name and
-                patient.last_name == last_name and
-                patient.dob == dob)
-
     def search_patient(self):
         first_name = self.first_name_entry.get()
         last_name = self.last_name_entry.get()
@@ -172,21 +304,25 @@ class SearchFamilyPage(tk.Frame):
         else:
             messagebox.showinfo("Search Result", "No patients found with the provided information.")
 
-    def search_family_member(self, first_name, last_name, dob):
-        for family in self.family_tree.root.children:
-            if self.is_patient_match(family.patient, first_name, last_name, dob):
-                return family
+    def select_suggestion(self, patient):
+        # Show the family of the patient picked from the suggestions
+        found_tree = self.search_family_member(patient.first_name, patient.last_name, patient.dob)
+        if found_tree:
+            self.display_family_info(found_tree)
+        else:
+            messagebox.showinfo("Search Result", "This patient is not part of a family.")
 
-            for child in family.children:
-                if self.is_patient_match(child.patient, first_name, last_name, dob):
-                    return child
-        return None
+    def search_family_member(self, first_name, last_name, dob):
+        # Return the family of the patient with this name and date of birth, or None
+        patient = self.linked_list.find_patient(first_name, last_name, dob)
+        return self.family_tree.family_of(patient) if patient else None
 
     def reset_page(self):
         # Reset input fields
         self.first_name_entry.delete(0, tk.END)
         self.last_name_entry.delete(0, tk.END)
         self.dob_entry.delete(0, tk.END)
+        self.suggestion_box.clear()
 
         # Clear displayed family information
         for widget in self.family_info_frame.winfo_children():
@@ -228,45 +364,39 @@ class SearchFamilyPage(tk.Frame):
         button_font = ("Helvetica", 12)
         button_color = "#C5C3C6"
 
-        # View, Edit, and Delete buttons for the patient
+        # View, Edit, and Delete buttons for the patient, which look the patient up by id when clicked
+        patient_id = patient.patient_id
         view_info_button = tk.Button(self.family_info_frame, text="View Patient Information", font=button_font,
-                                     bg=button_color, command=lambda: self.view_patient_info(patient))
+                                     bg=button_color, command=lambda: self.with_patient(patient_id,
+                                                                                        self.view_patient_info))
         view_info_button.pack(pady=(5, 0))
 
         edit_button = tk.Button(self.family_info_frame, text="Edit Patient", font=button_font, bg=button_color,
-                                command=lambda: self.edit_patient(patient))
+                                command=lambda: self.with_patient(patient_id, self.edit_patient))
         edit_button.pack(pady=(5, 0))
 
         delete_button = tk.Button(self.family_info_frame, text="Delete Patient", font=button_font, bg=button_color,
-                                  command=lambda: self.delete_patient(patient))
+                                  command=lambda: self.with_patient(patient_id, self.delete_patient))
         delete_button.pack(pady=(5, 10))
 
+    def with_patient(self, patient_id, action):
+        # Run a button's action on the patient with this id, if they have not been deleted since
+        try:
+            action(self.controller.service.get_patient(patient_id))
+        except ValueError as ve:
+            messagebox.showerror("Error", str(ve))
+
     def delete_patient(self, patient):
         response = messagebox.askyesno("Confirm Deletion", "Are you sure you want to delete this patient?")
         if response:
             self.perform_deletion(patient)
 
     def perform_deletion(self, patient):
-        # Check if the patient is a primary member
-        for family in self.family_tree.root.children:
-            if family.patient == patient:
-                # Delete all children of the primary member first
-                while family.children:
-                    child_patient = family.children[0].patient
-                    self.linked_list.delete_patient(child_patient.first_name, child_patient.last_name)
-                    family.children.pop(0)  # Remove the child from the tree
-                # Remove the primary member from the tree
-                self.family_tree.root.children.remove(family)
-                break
-            else:
-                # Check if the patient is a child in any family
-                for child in family.children:
-                    if child.patient == patient:
-                        family.children.remove(child)
-                        break
-
-        # Delete patient from linked list
-        self.linked_list.delete_patient(patient.first_name, patient.last_name)
+        # Deleting a primary member deletes their whole family; a dependent is deleted alone
+        family = self.family_tree.family_of(patient)
+        self.controller.service.delete_patient(patient)
+        if family is not None and family.patient is patient:
+            self.reset_page()  # The family shown on the page no longer exists
 
         self.refresh_family_display()
 
@@ -295,15 +425,16 @@ class SearchFamilyPage(tk.Frame):
         create_label(f"Prescription: {patient.prescription}", info_font)
         create_label(f"Medical Conditions: {'Yes' if patient.conditions else 'No'}", info_font)
 
-        # Insurance information
-        if patient.insurance_info:
+        # Insurance information, resolved through the patient's family
+        insurance_info = self.family_tree.effective_insurance(patient)
+        if insurance_info:
             create_label("Insurance Information:", info_font)
-            create_label(f"Primary Member: {patient.insurance_info.primary_name}", info_font)
-            create_label(f"Provider: {patient.insurance_info.provider_name}", info_font)
-            create_label(f"Policy Number: {patient.insurance_info.policy_number}", info_font)
-            create_label(f"Vision Coverage: {'Yes' if patient.insurance_info.vision_coverage else 'No'}", info_font)
-            create_label(f"Medical Coverage: {'Yes' if patient.insurance_info.medical_coverage else 'No'}", info_font)
-            create_label(f"Copay: {patient.insurance_info.copay}", info_font)
+            create_label(f"Primary Member: {insurance_info.primary_name}", info_font)
+            create_label(f"Provider: {insurance_info.provider_name}", info_font)
+            create_label(f"Policy Number: {insurance_info.policy_number}", info_font)
+            create_label(f"Vision Coverage: {'Yes' if insurance_info.vision_coverage else 'No'}", info_font)
+            create_label(f"Medical Coverage: {'Yes' if insurance_info.medical_coverage else 'No'}", info_font)
+            create_label(f"Copay: {insurance_info.copay}", info_font)
         else:
             create_label("No Insurance Information Available", info_font)
 
@@ -349,6 +480,10 @@ class SearchPatientPage(tk.Frame):
         subtitle = tk.Label(self, text="Please enter details", font=("Helvetica", 14), bg='#DCDCDD')
         subtitle.pack()
 
+        # Type-ahead search over patient names
+        self.suggestion_box = PatientSuggestionBox(self, controller.search_index, self.select_suggestion)
+        self.suggestion_box.pack(pady=5)
+
         # Entry Frame
         entry_frame = tk.Frame(self, bg='#DCDCDD')
         entry_frame.pack(pady=10)
@@ -398,6 +533,7 @@ class SearchPatientPage(tk.Frame):
         self.first_name_entry.delete(0, tk.END)
         self.last_name_entry.delete(0, tk.END)
         self.dob_entry.delete(0, tk.END)
+        self.suggestion_box.clear()
 
         # Clear displayed patient information
         for widget in self.patient_info_frame.winfo_children():
@@ -422,14 +558,13 @@ class SearchPatientPage(tk.Frame):
         else:
             messagebox.showinfo("Search Result", "No patient found with the provided information.")
 
+    def select_suggestion(self, patient):
+        # Show the patient picked from the suggestions
+        self.display_patient_info(patient)
+
     def find_patient(self, first_name, last_name, dob):
-        # Search for a patient in the linked list
-        current = self.linked_list.head
-        while current:
-            if current.first_name == first_name and current.last_name == last_name and current.dob == dob:
-                return current
-            current = current.next
-        return None
+        # Look the patient up in the linked list's name index
+        return self.linked_list.find_patient(first_name, last_name, dob)
 
     def display_patient_info(self, patient):
         # Clear previous search results
@@ -458,14 +593,15 @@ class SearchPatientPage(tk.Frame):
             f"Medical Conditions: {'Yes' if patient.conditions else 'No'}"
         ]
 
-        if patient.insurance_info:
+        insurance_info = self.family_tree.effective_insurance(patient)  # Dependents resolve to their family's
+        if insurance_info:
             ins_labels = [
-                f"Primary Member: {patient.insurance_info.primary_name}",
-                f"Provider: {patient.insurance_info.provider_name}",
-                f"Policy Number: {patient.insurance_info.policy_number}",
-                f"Vision Coverage: {'Yes' if patient.insurance_info.vision_coverage else 'No'}",
-                f"Medical Coverage: {'Yes' if patient.insurance_info.medical_coverage else 'No'}",
-                f"Copay: {patient.insurance_info.copay}"
+                f"Primary Member: {insurance_info.primary_name}",
+                f"Provider: {insurance_info.provider_name}",
+                f"Policy Number: {insurance_info.policy_number}",
+                f"Vision Coverage: {'Yes' if insurance_info.vision_coverage else 'No'}",
+                f"Medical Coverage: {'Yes' if insurance_info.medical_coverage else 'No'}",
+                f"Copay: {insurance_info.copay}"
             ]
         else:
             ins_labels = ["No Insurance Information Available"]
@@ -476,13 +612,19 @@ class SearchPatientPage(tk.Frame):
         for i, text in enumerate(ins_labels):
             create_insurance_label(i // 2, i % 2, text)
 
-        # Edit Patient Button
+        # Edit Patient Button, looking the patient up by id when clicked
+        patient_id = patient.patient_id
         edit_button = tk.Button(self.patient_buttons_frame, text="Edit Patient", font=button_font, bg=button_color,
-                                command=lambda: self.edit_patient(patient))
+                                command=lambda: self.edit_patient(patient_id))
         edit_button.pack(pady=(5, 0))
 
-    def edit_patient(self, patient):
+    def edit_patient(self, patient_id):
         # Load the patient data into the EditPatientPage and switch to that page
+        try:
+            patient = self.controller.service.get_patient(patient_id)
+        except ValueError as ve:
+            messagebox.showerror("Error", str(ve))
+            return
         edit_page = self.controller.frames[EditPatientPage]
         edit_page.load_patient(patient)
         self.reset_page()
@@ -496,7 +638,7 @@ class EditPatientPage(tk.Frame):
         self.controller = controller
         self.linked_list = linked_list
         self.family_tree = family_tree
-        self.current_patient = None
+        self.current_patient_id = None  # patient_id of the patient being edited
 
         label_font = ("Helvetica", 12)
         entry_font = ("Helvetica", 12)
@@ -569,7 +711,7 @@ class EditPatientPage(tk.Frame):
 
     def load_patient(self, patient):
         # Load patient data into the form
-        self.current_patient = patient
+        self.current_patient_id = patient.patient_id
         self.first_name_entry.delete(0, tk.END)
         self.first_name_entry.insert(0, patient.first_name)
         self.last_name_entry.delete(0, tk.END)
@@ -595,8 +737,8 @@ class EditPatientPage(tk.Frame):
 
     def format_date(self, date_value):
         # Format a date value as a string
-        if isinstance(date_value, datetime):
-            return date_value.strftime("%m-%d-%Y")
+        if isinstance(date_value, date):
+            return ordinal_text(date_value.toordinal())
         elif date_value is None or date_value == 'None':
             return "None"
         else:
@@ -605,29 +747,11 @@ class EditPatientPage(tk.Frame):
     def submit_changes(self):
         # Update patient information and linked list
         try:
-            self.current_patient.first_name = Patient.validate_name(self.first_name_entry.get(), "First Name")
-            self.current_patient.last_name = Patient.validate_name(self.last_name_entry.get(), "Last Name")
-            self.current_patient.dob = Patient.validate_date(self.dob_entry.get(), "Date of Birth")
-            self.current_patient.phone = Patient.validate_phone(self.phone_number_entry.get())
-            self.current_patient.address = Patient.validate_address(self.address_entry.get())
-            self.current_patient.last_exam = Patient.validate_date(self.last_exam_entry.get(), "Last Exam")
-
-            self.current_patient.emergent_issue = self.emergent_issue.get()
-            self.current_patient.prescription = Patient.validate_prescription(self.prescription_entry.get())
-            self.current_patient.priority_level = self.calculate_priority(self.current_patient.last_exam,
-                                                                          self.current_patient.conditions,
-                                                                          self.current_patient.emergent_issue)
-            if self.current_patient.last_exam is None:
-                self.current_patient.last_exam = "N/A"
-
-            # Prepare the update data, excluding first_name and last_name
-            update_data = self.get_patient_data()
-            del update_data["first_name"]
-            del update_data["last_name"]
-
-            # Update patient in the linked list
-            self.linked_list.edit_patient(first_name=self.current_patient.first_name,
-                                          last_name=self.current_patient.last_name, **update_data)
+            # The service validates every field before changing anything, re-ranks the patient and re-keys it if
+            # the name was changed
+            service = self.controller.service
+            patient = service.get_patient(self.current_patient_id)  # Raises if deleted since it was loaded
+            service.edit_patient(patient, emergent_issue=self.emergent_issue.get(), **self.get_patient_data())
 
             # Notify user
             messagebox.showinfo("Success", "Patient information updated.")
@@ -639,32 +763,6 @@ class EditPatientPage(tk.Frame):
         except ValueError as ve:
             messagebox.showerror("Input Error", str(ve))
 
-    def calculate_priority(self, last_exam, conditions, emergent_issue):
-        # Calculate the priority level based on patient data
-        current_date = datetime.now().date()
-        one_year_ago = current_date - timedelta(days=365)
-
-        # Convert last_exam from string to datetime object
-        if isinstance(last_exam, str):
-            try:
-                last_exam_date = datetime.strptime(last_exam, "%m-%d-%Y").date()
-            except ValueError:
-                # Handle invalid date format
-                last_exam_date = None
-        elif isinstance(last_exam, datetime):
-            last_exam_date = last_exam.date()
-        else:
-            last_exam_date = None
-
-        if emergent_issue:
-            return 1  # Priority 1 for emergent issues
-        elif conditions and (last_exam_date is None or last_exam_date <= one_year_ago):
-            return 2  # Priority 2 for medical conditions with last exam over a year ago or no last exam
-        elif not conditions and (last_exam_date is None or last_exam_date <= one_year_ago):
-            return 3  # Priority 3 for no conditions with last exam over a year ago or no last exam
-        else:
-            return 4  # Priority 4 for all others
-
     def get_patient_data(self):
         # Collect data from all fields
         return {
@@ -679,8 +777,9 @@ class EditPatientPage(tk.Frame):
 
     def reset_form(self):
         # Reset form fields to the patient's original information
-        if self.current_patient:
-            self.load_patient(self.current_patient)
+        patient = self.linked_list.get_patient(self.current_patient_id)
+        if patient:
+            self.load_patient(patient)
 
 
 class AddPatientPage(tk.Frame):
@@ -777,19 +876,14 @@ class AddPatientPage(tk.Frame):
         prescription = self.prescription_entry.get()
         conditions = self.conditions.get()
 
-        insurance_info = self.current_family_tree.patient.insurance_info
-
         try:
-            # Create a new Patient object
+            # Create a new Patient object; the family tree gives it the family's primary member and insurance
             new_patient = Patient(first_name, last_name, dob, phone, address, last_exam, emergent_issue, prescription,
-                                  conditions, insurance_info)
+                                  conditions)
 
-            # Add the new patient to the linked list
-            self.linked_list.insert_patient(new_patient)
-
-            # Check if current_family_tree is a FamilyTreeNode and add the patient
+            # Check if current_family_tree is a FamilyTreeNode and add the patient to it and the linked list
             if isinstance(self.current_family_tree, FamilyTreeNode):
-                self.family_tree.add_family_member(self.current_family_tree, new_patient)
+                self.controller.service.add_member(self.current_family_tree, new_patient)
                 messagebox.showinfo("Success", "New patient added to the family.")
             else:
                 messagebox.showerror("Error", "No family selected for the new patient.")
@@ -937,13 +1031,10 @@ class AddNewFamilyPage(tk.Frame):
 
             # Create a new Patient object
             new_patient = Patient(first_name, last_name, dob, phone, address, last_exam, emergent_issue,
-                                  prescription, conditions, new_insurance)
-
-            # Insert the new patient into the linked list
-            self.linked_list.insert_patient(new_patient)
+                                  prescription, conditions, insurance_info=new_insurance)
 
-            # Create a new family and add it to the family tree
-            new_family_node = self.family_tree.add_family(new_patient, new_insurance)
+            # Insert the new patient into the linked list as the primary member of a new family
+            new_family_node = self.controller.service.add_family(new_patient, new_insurance)
 
             # Display confirmation message
             messagebox.showinfo("Success", "New family created with the patient as the primary member.")
@@ -979,6 +1070,78 @@ class AddNewFamilyPage(tk.Frame):
         self.medical_ins_cov.set(False)
 
 
+class VirtualPatientList(tk.Frame):
+    def __init__(self, parent, row_count, fetch_rows, format_row, row_height=22):
+        # Scrollable list that only creates labels for the rows that fit in the window and reuses them on scroll
+        tk.Frame.__init__(self, parent, background='#DCDCDD')
+        self.row_count = row_count  # Callable returning the total number of rows
+        self.fetch_rows = fetch_rows  # Callable returning the items for (start, count)
+        self.format_row = format_row  # Callable turning an item into the text shown for it
+        self.row_height = row_height
+        self.first_row = 0  # Index of the row shown at the top of the window
+        self.labels = []  # Pool of recycled row labels
+
+        self.scrollbar = tk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.scrollbar.pack(side="right", fill="y")
+        self.row_frame = tk.Frame(self, background='#DCDCDD')
+        self.row_frame.pack(side="left", fill="both", expand=True)
+
+        self.row_frame.bind("<Configure>", self.resize)
+        for widget in (self, self.row_frame):
+            widget.bind("<MouseWheel>", self.on_mouse_wheel)
+            widget.bind("<Button-4>", lambda event: self.scroll_rows(-3))
+            widget.bind("<Button-5>", lambda event: self.scroll_rows(3))
+
+    def visible_rows(self):
+        # Number of rows that fit in the current window height
+        return max(1, self.row_frame.winfo_height() // self.row_height)
+
+    def resize(self, event=None):
+        # Grow or shrink the label pool to match the window height
+        needed = self.visible_rows()
+        while len(self.labels) < needed:
+            label = tk.Label(self.row_frame, anchor="center", background='#DCDCDD')
+            label.bind("<MouseWheel>", self.on_mouse_wheel)
+            label.bind("<Button-4>", lambda event: self.scroll_rows(-3))
+            label.bind("<Button-5>", lambda event: self.scroll_rows(3))
+            label.place(x=0, y=len(self.labels) * self.row_height, relwidth=1, height=self.row_height)
+            self.labels.append(label)
+        while len(self.labels) > needed:
+            self.labels.pop().destroy()
+        self.refresh()
+
+    def refresh(self):
+        # Redraw the visible window, reading only the rows it shows
+        total = self.row_count()
+        visible = len(self.labels)
+        self.first_row = max(0, min(self.first_row, total - visible))
+        rows = self.fetch_rows(self.first_row, visible) if total else []
+        for index, label in enumerate(self.labels):
+            label.configure(text=self.format_row(rows[index]) if index < len(rows) else "")
+        if total:
+            self.scrollbar.set(self.first_row / total, min(1.0, (self.first_row + visible) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll_rows(self, delta):
+        # Move the window by delta rows
+        self.first_row += delta
+        self.refresh()
+
+    def yview(self, *args):
+        # Scrollbar callback handling both dragging ("moveto") and arrow/trough clicks ("scroll")
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * self.row_count())
+        elif args[0] == "scroll":
+            step = len(self.labels) if args[2] == "pages" else 1
+            self.first_row += int(args[1]) * step
+        self.refresh()
+
+    def on_mouse_wheel(self, event):
+        # Scroll three rows per wheel notch
+        self.scroll_rows(-3 if event.delta > 0 else 3)
+
+
 class ScheduleAppointmentPage(tk.Frame):
     def __init__(self, parent, controller, linked_list, family_tree):
         # Initialize the ScheduleAppointmentPage frame
@@ -986,7 +1149,7 @@ class ScheduleAppointmentPage(tk.Frame):
         self.controller = controller
         self.linked_list = linked_list
         self.family_tree = family_tree
-        self.appointment_scheduler = AppointmentScheduler()
+        self.appointment_scheduler = controller.appointment_scheduler
 
         # Title and Subtitle
         title = tk.Label(self, text="Patients to Schedule", font=("Helvetica", 16), bg='#DCDCDD')
@@ -994,34 +1157,81 @@ class ScheduleAppointmentPage(tk.Frame):
         subtitle = tk.Label(self, text="Patients are sorted by priority.", font=("Helvetica", 14), bg='#DCDCDD')
         subtitle.pack()
 
-        # Create a container for the patient list
-        self.patient_list_container = tk.Frame(self, background='#DCDCDD')
+        # Home Button
+        home_button = tk.Button(self, text="Home", command=lambda: controller.show_frame(HomePage))
+        home_button.pack(side="bottom", pady=5)
+
+        # Recall list export, one row per household, written on a worker thread
+        self.export_status = tk.Label(self, text="", bg='#DCDCDD')
+        self.export_status.pack(side="bottom")
+        export_button = tk.Button(self, text="Export Recall List", command=self.export_recall)
+        export_button.pack(side="bottom", pady=5)
+
+        # Book the front of the queue into the earliest free appointment slots
+        book_button = tk.Button(self, text="Book Next 10 Patients", command=self.book_next)
+        book_button.pack(side="bottom", pady=5)
+
+        # Virtualized list of the patients with a priority below 4; with the SQLite backend the rows come from an
+        # indexed query instead of the in-memory scheduler
+        if isinstance(controller.store, SQLitePatientRepository):
+            count_patients, fetch_patients = controller.service.count_to_schedule, controller.service.fetch_schedule
+        else:
+            count_patients, fetch_patients = self.count_patients, self.fetch_patients
+        self.patient_list_container = VirtualPatientList(self, count_patients, fetch_patients, self.format_patient)
         self.patient_list_container.pack(fill="both", expand=True)
 
         # Load and display patients when the page is shown
         self.load_and_display_patients()
 
-        # Home Button
-        home_button = tk.Button(self, text="Home", command=lambda: controller.show_frame(HomePage))
-        home_button.pack(pady=5)
+    def book_next(self):
+        # Book the next ten patients in priority order and list their appointments
+        bookings = self.controller.service.book_next(10)
+        if not bookings:
+            messagebox.showinfo("Appointments", "Nobody was booked: the queue is empty, everyone at the front "
+                                                "already has an appointment, or there is no free slot.")
+            return
+        lines = []
+        for booking in bookings:
+            patient = self.linked_list.get_patient(booking.patient_id)
+            lines.append(f"{booking.start_time:%m-%d-%Y %H:%M} {booking.provider}: "
+                         f"{patient.first_name} {patient.last_name}")
+        messagebox.showinfo("Appointments", "\n".join(lines))
+
+    def export_recall(self):
+        # Ask where to save the recall list and write it without blocking the window
+        path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV files", "*.csv")])
+        if not path:
+            return
+        self.export_status.config(text="Writing recall list...")
+        self.controller.tasks.submit(self.write_recall, path, on_done=self.recall_written,
+                                     on_error=self.recall_failed)
+
+    def write_recall(self, task, path):
+        # Runs on a worker thread
+        return self.controller.service.write_recall_csv(path)
+
+    def recall_written(self, households):
+        self.export_status.config(text=f"Recall list written: {households} households.")
+
+    def recall_failed(self, error):
+        self.export_status.config(text="")
+        messagebox.showerror("Error", f"Could not write the recall list: {error}")
+
+    def count_patients(self):
+        # Patients with a priority below 4 are the ones to schedule
+        return self.controller.service.count_below(4)
+
+    def fetch_patients(self, start, count):
+        # Only the rows in view are copied, so reading them barely holds up other terminals' changes
+        return self.controller.service.next_appointments(count, start)
+
+    @staticmethod
+    def format_patient(patient):
+        return f"{patient.first_name} {patient.last_name}, DOB: {patient.dob}, Priority: {patient.priority_level}"
 
     def load_and_display_patients(self):
-        # Clear existing patient list
-        for widget in self.patient_list_container.winfo_children():
-            widget.destroy()
-
-        # Add patients from the linked list to the priority queue
-        current = self.linked_list.head
-        while current:
-            self.appointment_scheduler.add_patient(current)
-            current = current.next
-
-        # Get and display all patients
-        for patient in self.appointment_scheduler.get_all_patients():
-            if patient.priority_level < 4:
-                patient_info = f"{patient.first_name} {patient.last_name}, DOB: {patient.dob}, " \
-                               f"Priority: {patient.priority_level}"
-                tk.Label(self.patient_list_container, text=patient_info).pack()
+        # The scheduler is kept in sync with the linked list, so only the visible rows are read from it
+        self.patient_list_container.refresh()
 
     def refresh_page(self):
         self.load_and_display_patients()
@@ -1041,35 +1251,27 @@ class ViewAllPatientsPage(tk.Frame):
         subtitle = tk.Label(self, text="Patients are sorted alphabetically.", font=("Helvetica", 14), bg='#DCDCDD')
         subtitle.pack()
 
-        # Create a container for the patient list
-        self.patient_list_container = tk.Frame(self, background='#DCDCDD')
-        self.patient_list_container.pack(fill="both", expand=True)
-
-        # Load and display patients when the page is shown
-        self.load_and_display_patients()
+        self.sorted_index = controller.sorted_index
 
         # Home Button
         home_button = tk.Button(self, text="Home", command=lambda: controller.show_frame(HomePage))
-        home_button.pack(pady=5)
+        home_button.pack(side="bottom", pady=5)
 
-    def load_and_display_patients(self):
-        # Clear existing patient list
-        for widget in self.patient_list_container.winfo_children():
-            widget.destroy()
+        # Virtualized list that reads the rows in view from the service's sorted index
+        self.patient_list_container = VirtualPatientList(self, lambda: len(controller.service),
+                                                         controller.service.list_sorted, self.format_patient)
+        self.patient_list_container.pack(fill="both", expand=True)
 
-        # Extract patients from the linked list and sort them alphabetically
-        patients = []
-        current = self.linked_list.head
-        while current:
-            patients.append(current)
-            current = current.next
+        # Load and display patients when the page is shown
+        self.load_and_display_patients()
 
-        patients.sort(key=lambda patient: (patient.last_name, patient.first_name))
+    @staticmethod
+    def format_patient(patient):
+        return f"{patient.first_name} {patient.last_name}, DOB: {patient.dob}"
 
-        # Display sorted patients
-        for patient in patients:
-            patient_info = f"{patient.first_name} {patient.last_name}, DOB: {patient.dob}"
-            tk.Label(self.patient_list_container, text=patient_info).pack()
+    def load_and_display_patients(self):
+        # The sorted index is kept up to date by the linked list, so only the rows in view are read
+        self.patient_list_container.refresh()
 
     def refresh_page(self):
         self.load_and_display_patients()
@@ -0,0 +1,190 @@
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from Patient import Patient, PatientLinkedList
+from AppointmentScheduler import AppointmentScheduler
+from InsuranceFamilyTree import InsuranceFamilyTree
+from InsuranceInformation import InsuranceInformation
+from PriorityTable import PriorityTable
+from PatientBitmapIndex import PatientBitmapIndex
+from PatientSearchIndex import PatientSearchIndex
+from ClinicGenerator import PROVIDERS, generate_clinic
+
+
+class Timer:
+    def __init__(self):
+        # Collects {operation: {"count", "seconds", "per_op_us"}} for one clinic size
+        self.results = {}
+
+    def measure(self, operation, count, function):
+        # Run function once, recording how long it took for count operations, and return its result
+        start = time.perf_counter()
+        value = function()
+        seconds = time.perf_counter() - start
+        self.results[operation] = {"count": count, "seconds": round(seconds, 6),
+                                   "per_op_us": round(seconds / count * 1e6, 3) if count else None}
+        return value
+
+    def measure_each(self, operation, items, function, group):
+        # Call function on each item separately, recording the total as measure does plus the p50 and p99
+        # latencies, overall and for each value of group(item) such as the length of a typed prefix
+        latencies = {}
+        total = 0.0
+        for item in items:
+            start = time.perf_counter()
+            function(item)
+            seconds = time.perf_counter() - start
+            total += seconds
+            latencies.setdefault(group(item), []).append(seconds)
+        overall = sorted(seconds for group_latencies in latencies.values() for seconds in group_latencies)
+        result = {"count": len(overall), "seconds": round(total, 6),
+                  "per_op_us": round(total / len(overall) * 1e6, 3) if overall else None,
+                  "p50_us": percentile_us(overall, 50), "p99_us": percentile_us(overall, 99), "groups": {}}
+        for key in sorted(latencies):
+            ordered = sorted(latencies[key])
+            result["groups"][str(key)] = {"count": len(ordered), "p50_us": percentile_us(ordered, 50),
+                                          "p99_us": percentile_us(ordered, 99)}
+        self.results[operation] = result
+
+
+def percentile_us(ordered, percent):
+    # Nearest-rank percentile of sorted latencies in seconds, in microseconds
+    if not ordered:
+        return None
+    return round(ordered[max(0, -(-len(ordered) * percent // 100) - 1)] * 1e6, 3)
+
+
+def type_ahead(rng, patients, count):
+    # Every keystroke of count "first last" names as a receptionist types them, a quarter with one typo, so
+    # the search sees each prefix the way the search page sends it
+    keystrokes = []
+    for patient in rng.sample(patients, min(count, len(patients))):
+        first_name, last_name = patient.first_name, patient.last_name
+        if rng.random() < 0.25:
+            index = rng.randrange(len(last_name))
+            last_name = last_name[:index] + rng.choice("aeiouy") + last_name[index + 1:]
+        query = f"{first_name} {last_name}"
+        keystrokes.extend(query[:length] for length in range(1, len(query) + 1))
+    return keystrokes
+
+
+def benchmark_clinic(size, seed, samples, tree_samples):
+    # Time the registry, scheduler, family tree and validators on one synthetic clinic
+    households = generate_clinic(size, seed)
+    rng = random.Random(seed + 1)
+    timer = Timer()
+    records = [record for primary, _, dependents in households for record in (primary,) + tuple(dependents)]
+
+    patients = timer.measure("Patient.__init__", len(records), lambda: [Patient(*record) for record in records])
+
+    patient_list = PatientLinkedList()
+
+    def insert_all():
+        for patient in patients:
+            patient_list.insert_patient(patient)
+
+    timer.measure("PatientLinkedList.insert_patient", len(patients), insert_all)
+
+    scheduler = AppointmentScheduler()
+
+    def schedule_all():
+        for patient in patients:
+            scheduler.add_patient(patient)
+
+    timer.measure("AppointmentScheduler.add_patient", len(patients), schedule_all)
+    timer.measure("AppointmentScheduler.get_all_patients", len(patients), scheduler.get_all_patients)
+
+    table = timer.measure("PriorityTable.add_patients", len(patients), lambda: PriorityTable(patients))
+    timer.measure("PriorityTable.priorities", len(patients), table.priorities)
+
+    family_tree = InsuranceFamilyTree()
+
+    def build_tree():
+        index = 0
+        for _, insurance, dependents in households:
+            family_node = family_tree.add_family(patients[index], InsuranceInformation(*insurance))
+            for offset in range(len(dependents)):
+                family_tree.add_family_member(family_node, patients[index + 1 + offset])
+            index += 1 + len(dependents)
+
+    timer.measure("InsuranceFamilyTree.add_family", len(patients), build_tree)
+
+    bitmap_index = PatientBitmapIndex(patient_list, family_tree)
+    timer.measure("PatientBitmapIndex.add_patients", len(patients), lambda: bitmap_index.add_patients(patients))
+    query_rng = random.Random(seed + 2)  # Its own generator, so the patients sampled below stay the same
+    queries = [{"conditions": True, "overdue": True, "provider_name": query_rng.choice(PROVIDERS),
+                "vision_coverage": query_rng.random() < 0.5} for _ in range(100)]
+    timer.measure("PatientBitmapIndex.count", len(queries), lambda: [bitmap_index.count(**query) for query in queries])
+
+    search_index = PatientSearchIndex()
+    timer.measure("PatientSearchIndex.add_patients", len(patients), lambda: search_index.add_patients(patients))
+    # Its own generator too; per-keystroke latencies are grouped by the length of the prefix typed so far
+    keystrokes = type_ahead(random.Random(seed + 3), patients, samples)
+    timer.measure_each("PatientSearchIndex.search", keystrokes, search_index.search, len)
+
+    targets = rng.sample(patients, min(samples, len(patients)))
+    timer.measure("PatientLinkedList.find_patient", len(targets),
+                  lambda: [patient_list.find_patient(p.first_name, p.last_name, p.dob) for p in targets])
+    tree_targets = targets[:tree_samples]
+    timer.measure("InsuranceFamilyTree.find_member", len(tree_targets),
+                  lambda: [family_tree.find_member(p.first_name, p.last_name) for p in tree_targets])
+    timer.measure("PatientLinkedList.delete_patient", len(targets),
+                  lambda: [patient_list.delete_patient(p.first_name, p.last_name, p.dob) for p in targets])
+    return timer.results
+
+
+def git_commit():
+    # The commit being measured, so result files from different commits can be told apart
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    # Print how each operation's per-op time changed against an earlier result file
+    for size, operations in results.items():
+        for operation, result in operations.items():
+            before = baseline.get("results", {}).get(size, {}).get(operation)
+            if before and before["per_op_us"] and result["per_op_us"]:
+                change = (result["per_op_us"] - before["per_op_us"]) / before["per_op_us"] * 100
+                print(f"{size:>9} {operation:<42} {before['per_op_us']:>12.3f} -> {result['per_op_us']:>12.3f} us "
+                      f"({change:+.1f}%)")
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Time the clinic's data structures on synthetic clinics.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="clinic sizes to generate (default: 1k, 100k and 1M patients)")
+    parser.add_argument("--seed", type=int, default=2024, help="random seed, so runs generate the same clinics")
+    parser.add_argument("--samples", type=int, default=1000, help="patients looked up and deleted per clinic")
+    parser.add_argument("--tree-samples", type=int, default=1000, help="patients looked up in the family tree")
+    parser.add_argument("--output", default="benchmark.json", help="file the JSON results are written to")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    options = parser.parse_args(arguments)
+
+    results = {}
+    for size in options.sizes:
+        results[str(size)] = benchmark_clinic(size, options.seed, options.samples, options.tree_samples)
+        for operation, result in results[str(size)].items():
+            latency = f" p50 {result['p50_us']:.3f} us p99 {result['p99_us']:.3f} us" if "p50_us" in result else ""
+            print(f"{size:>9} {operation:<42} {result['count']:>9} ops {result['seconds']:>10.3f} s "
+                  f"{result['per_op_us']:>12.3f} us/op{latency}")
+
+    report = {"commit": git_commit(), "python": sys.version.split()[0], "platform": platform.platform(),
+              "seed": options.seed, "results": results}
+    with open(options.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    if options.compare:
+        with open(options.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
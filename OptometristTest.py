@@ -1,7 +1,33 @@
+import asyncio
+import io
+import json
+import os
+import pickle
+import threading
+import tempfile
 import unittest
-from datetime import datetime
-from Patient import Patient
+from datetime import date, datetime
+from Patient import REUSE_AFTER, Patient, PatientIds, PatientLinkedList, compute_priority
 from InsuranceInformation import InsuranceInformation
+from AppointmentScheduler import AppointmentScheduler
+from SortedPatientIndex import SortedPatientIndex
+from PriorityEngine import PriorityEngine
+from PriorityTable import PriorityTable
+import PatientBitmapIndex
+from PatientSearchIndex import PatientSearchIndex
+from PatientStore import PatientStore
+from SQLiteRepository import SQLitePatientRepository
+from PatientImporter import import_patients
+from OptometristBenchmark import benchmark_clinic
+from ClinicGenerator import generate_clinic
+from InsuranceFamilyTree import InsuranceFamilyTree
+from RecallList import recall_households, write_recall_csv
+from SlotCalendar import SlotCalendar
+from DispatchSimulator import DispatchSimulator, staffing_sweep
+from TaskExecutor import TaskExecutor
+from ClinicService import ClinicService, describe_patient
+from ClinicServer import ClinicServer, load_households, run_load
+from Validation import DATE_CACHE_SIZE, first_errors, parse_ordinal, validate_many
 
 
 class TestPatient(unittest.TestCase):
@@ -150,5 +176,1102 @@ class TestPatient(unittest.TestCase):
             InsuranceInformation.validate_optional_int("")
 
 
+def make_patient(first_name="John", last_name="Smith", dob="01-01-1990", last_exam="N/A", emergent_issue=False,
+                 conditions=False):
+    # Helper to build a valid patient for the data structure tests
+    return Patient(first_name, last_name, dob, "515-515-5115", "111 1st St", last_exam, emergent_issue, "N/A",
+                   conditions)
+
+
+def registered(*patients):
+    # Helper to give patients their patient_ids, which PatientLinkedList hands out on insert
+    PatientLinkedList().insert_patients(patients)
+    return patients
+
+
+class TestValidation(unittest.TestCase):
+    def test_character_checks_match_the_original_rules(self):
+        # Unicode letters and the allowed punctuation pass; anything else keeps the original message
+        self.assertEqual("José O'Neil-Ruiz", Patient.validate_name("José O'Neil-Ruiz", "First Name"))
+        self.assertEqual("OD -225 / OS -050", Patient.validate_prescription("OD -225 / OS -050"))
+        with self.assertRaisesRegex(ValueError, "First Name contains invalid characters."):
+            Patient.validate_name("J0hn", "First Name")
+        with self.assertRaisesRegex(ValueError, "Prescription contains invalid characters."):
+            Patient.validate_prescription("-2.25")
+        with self.assertRaisesRegex(ValueError, "Policy Number contains invalid characters."):
+            InsuranceInformation.validate_optional_string("AB/12", "Policy Number")
+
+    def test_validate_many_returns_an_error_vector_per_field(self):
+        # Each field gets one entry per record: None when it passed, the validator's message when it failed
+        records = [
+            {"first_name": "Ann", "dob": "01-01-1990", "phone": "555-555-5555"},
+            {"first_name": "", "dob": "01-01-1990", "phone": "5555555555"},
+            {"first_name": "Bo", "dob": "13-45-1990", "phone": "555-555-5555"},
+        ]
+        errors = validate_many(records)
+        self.assertEqual([None, "First Name must be a non-empty string.", None], errors["first_name"])
+        self.assertEqual([None, None, "Date of Birth must be a valid date string (MM-DD-YYYY) or 'N/A'."],
+                         errors["dob"])
+        self.assertEqual([None, "Phone number must be in the format 555-555-5555.", None], errors["phone"])
+        self.assertEqual([None, "First Name must be a non-empty string.",
+                          "Date of Birth must be a valid date string (MM-DD-YYYY) or 'N/A'."],
+                         first_errors(errors, len(records)))
+
+    def test_dates_share_one_canonical_ordinal(self):
+        # Strings, dates and datetimes for the same day all become the same day ordinal, read back unchanged
+        patient = Patient("Ann", "Lee", "1-2-1990", "555-555-5555", "1 Main St", "03-02-2024", False, "N/A", False)
+        self.assertEqual(date(1990, 1, 2).toordinal(), patient.dob_ordinal)
+        self.assertEqual("01-02-1990", patient.dob)
+        self.assertEqual(date(2024, 3, 2), patient.last_exam)
+        patient.last_exam = datetime(2024, 3, 2, 9, 30)
+        self.assertEqual(date(2024, 3, 2).toordinal(), patient.last_exam_ordinal)
+        patient.last_exam = "N/A"
+        self.assertIsNone(patient.last_exam_ordinal)
+        self.assertEqual(DATE_CACHE_SIZE, parse_ordinal.cache_info().maxsize)
+
+
+class TestPatientLinkedList(unittest.TestCase):
+    def test_compact_patient_keeps_its_attributes(self):
+        # Test that the slotted patient still reads and writes its fields as plain attributes
+        patient = make_patient(last_exam="06-01-2023", conditions=True)
+        self.assertFalse(hasattr(patient, "__dict__"))
+        self.assertEqual(("01-01-1990", date(2023, 6, 1)), (patient.dob, patient.last_exam))
+        self.assertEqual((False, True), (patient.emergent_issue, patient.conditions))
+        patient.emergent_issue, patient.priority_level = True, 1
+        patient.dob, patient.last_exam = date(1985, 3, 4), "N/A"
+        self.assertEqual((True, True, 1), (patient.emergent_issue, patient.conditions, patient.priority_level))
+        self.assertEqual(("03-04-1985", "N/A"), (patient.dob, patient.last_exam))
+        self.assertIs(make_patient().last_name, make_patient().last_name)
+
+    def test_insert_and_find(self):
+        # Test that inserted patients keep list order and can be found by name and date of birth
+        patients = PatientLinkedList()
+        first = make_patient("John", "Smith", "01-01-1990")
+        second = make_patient("Jane", "Doe")
+        homonym = make_patient("John", "Smith", "02-02-1980")
+        for patient in (first, second, homonym):
+            patients.insert_patient(patient)
+
+        self.assertEqual([first, second, homonym], list(patients))
+        self.assertIs(homonym, patients.tail)
+        self.assertEqual(3, len(patients))
+        self.assertIs(first, patients.find_patient("John", "Smith"))
+        self.assertIs(homonym, patients.find_patient("John", "Smith", "02-02-1980"))
+        self.assertIs(homonym, patients.find_patient("John", "Smith", "2-2-1980"))
+        self.assertIs(homonym, patients.find_patient("John", "Smith", date(1980, 2, 2)))
+        self.assertIsNone(patients.find_patient("John", "Smith", "03-03-1980"))
+        self.assertIsNone(patients.find_patient("Jim", "Smith"))
+
+    def test_delete_patient(self):
+        # Test deleting the head, middle and tail patients keeps the links consistent
+        patients = PatientLinkedList()
+        trio = [make_patient(name, "Smith") for name in ("Ann", "Bob", "Cal")]
+        for patient in trio:
+            patients.insert_patient(patient)
+
+        self.assertTrue(patients.delete_patient("Bob", "Smith"))
+        self.assertEqual([trio[0], trio[2]], list(patients))
+        self.assertTrue(patients.delete_patient("Cal", "Smith"))
+        self.assertIs(trio[0], patients.tail)
+        self.assertTrue(patients.delete_patient("Ann", "Smith"))
+        self.assertIsNone(patients.head)
+        self.assertIsNone(patients.tail)
+        self.assertFalse(patients.delete_patient("Ann", "Smith"))
+
+    def test_edit_patient_renames(self):
+        # Test that editing a patient's name moves it to the new key in the index
+        patients = PatientLinkedList()
+        patient = make_patient("John", "Smith")
+        patients.insert_patient(patient)
+
+        self.assertTrue(patients.edit_patient("John", "Smith", phone="555-555-5555"))
+        patients.update_patient(patient, first_name="Jon")
+        self.assertIsNone(patients.find_patient("John", "Smith"))
+        self.assertIs(patient, patients.find_patient("Jon", "Smith"))
+        self.assertEqual("555-555-5555", patient.phone)
+
+    def test_patient_ids(self):
+        # Test that patients are found and deleted by id, and that a deleted patient added back gets a new id
+        patients = PatientLinkedList()
+        scheduler = AppointmentScheduler()
+        patients.add_listener(scheduler)
+        trio = [make_patient(name, "Smith") for name in ("Ann", "Bob", "Cal")]
+        for patient in trio:
+            patients.insert_patient(patient)
+        ids = [patient.patient_id for patient in trio]
+
+        self.assertEqual(3, len(set(ids)))
+        self.assertIs(trio[1], patients.get_patient(ids[1]))
+        self.assertTrue(patients.delete_patient_id(ids[1]))
+        self.assertIsNone(trio[1].patient_id)
+        self.assertIsNone(patients.get_patient(ids[1]))
+        self.assertFalse(patients.delete_patient_id(ids[1]))
+        self.assertNotIn(trio[1], scheduler)
+        patients.insert_patient(trio[1])
+        self.assertNotEqual(ids[1], trio[1].patient_id)
+        self.assertIs(trio[1], patients.get_patient(trio[1].patient_id))
+        self.assertIn(trio[1], scheduler)
+
+        # A new patient and a pickled one (e.g. built by an import worker) only get an id once inserted
+        copy = pickle.loads(pickle.dumps(trio[0]))
+        self.assertEqual(("Ann", "01-01-1990"), (copy.first_name, copy.dob))
+        self.assertEqual((None, None), (copy.patient_id, copy.next))
+        self.assertIsNone(make_patient("Dee", "Smith").patient_id)
+        patients.insert_patient(copy)
+        self.assertNotIn(copy.patient_id, ids + [trio[1].patient_id])
+
+    def test_deleted_ids_are_reused_oldest_first(self):
+        # Test that freed ids are only handed out again once enough of them are waiting
+        patient_ids = PatientIds()
+        freed = [patient_ids.allocate() for _ in range(REUSE_AFTER + 1)]
+        for patient_id in freed:
+            patient_ids.release(patient_id)
+        self.assertEqual([freed[0], REUSE_AFTER + 1], [patient_ids.allocate(), patient_ids.allocate()])
+
+
+class TestAppointmentScheduler(unittest.TestCase):
+    def test_order_is_kept_without_draining(self):
+        # Test that the scheduler returns patients by priority and arrival without emptying the queue
+        scheduler = AppointmentScheduler()
+        routine, emergent, conditions = registered(make_patient("Ann", "Routine"),
+                                                   make_patient("Bob", "Emergent", emergent_issue=True),
+                                                   make_patient("Cal", "Conditions", conditions=True))
+        for patient in (routine, emergent, conditions):
+            scheduler.add_patient(patient)
+
+        self.assertEqual([emergent, conditions, routine], scheduler.get_all_patients())
+        self.assertEqual([emergent, conditions, routine], scheduler.get_all_patients())
+        self.assertEqual([conditions], scheduler.get_patients(1, 1))
+
+    def test_add_patients_in_bulk(self):
+        # Test that a bulk load orders patients the same way as adding them one at a time
+        patients = registered(make_patient("Ann", "Smith"), make_patient("Bob", "Smith", emergent_issue=True),
+                              make_patient("Cal", "Smith", conditions=True), make_patient("Dee", "Smith"))
+        one_at_a_time = AppointmentScheduler(thread_safe=True)
+        for patient in patients:
+            one_at_a_time.add_patient(patient)
+        bulk = AppointmentScheduler()
+        bulk.add_patients(patients[:1])
+        bulk.add_patients(patients[1:])
+
+        self.assertEqual(one_at_a_time.get_all_patients(), bulk.get_all_patients())
+        self.assertTrue(bulk.remove_patient(patients[2]))
+        self.assertEqual([patients[1], patients[0], patients[3]], bulk.get_all_patients())
+
+    def test_add_patients_skips_repeats_in_a_batch(self):
+        # Test that a patient listed twice in one batch, or already queued, gets a single heap entry
+        ann, bob = registered(make_patient("Ann", "Smith"), make_patient("Bob", "Smith"))
+        scheduler = AppointmentScheduler()
+        scheduler.add_patients([ann, ann])
+        scheduler.add_patients([bob, ann, bob])
+        self.assertEqual((2, {3: 2}), (len(scheduler), scheduler.level_counts))
+        self.assertTrue(scheduler.remove_patient(ann))
+        self.assertEqual([bob], [entry[3] for entry in scheduler.heap])
+
+    def test_follows_linked_list_changes(self):
+        # Test that a scheduler registered on the linked list tracks inserts, edits and deletes
+        patients = PatientLinkedList()
+        scheduler = AppointmentScheduler()
+        patients.add_listener(scheduler)
+        first = make_patient("Ann", "Smith")
+        second = make_patient("Bob", "Smith")
+        patients.insert_patient(first)
+        patients.insert_patient(second)
+
+        patients.update_patient(second, priority_level=1)
+        self.assertEqual([second, first], scheduler.get_all_patients())
+        self.assertEqual(1, scheduler.count_below(2))
+
+        patients.delete_patient("Bob", "Smith")
+        self.assertEqual([first], scheduler.get_all_patients())
+        self.assertEqual(0, scheduler.count_below(2))
+
+
+class TestPriorityEngine(unittest.TestCase):
+    def setUp(self):
+        # Three patients examined on different days, queued by a scheduler that follows the list
+        self.patients = PatientLinkedList()
+        self.scheduler = AppointmentScheduler()
+        self.patients.add_listener(self.scheduler)
+        self.engine = PriorityEngine(self.patients, today=date(2024, 1, 1))
+        self.patients.add_listener(self.engine)
+        for first_name, last_exam, conditions in (("Ann", "06-01-2023", True), ("Bob", "03-01-2023", False),
+                                                  ("Cal", "N/A", False)):
+            patient = make_patient(first_name, last_exam=last_exam, conditions=conditions)
+            patient.priority_level = compute_priority(patient.last_exam, conditions, False, date(2024, 1, 1))
+            self.patients.insert_patient(patient)
+
+    def test_compute_priority_reads_exam_dates(self):
+        # Test that an exam within the last year counts, whether it is a date or a string
+        self.assertEqual(4, compute_priority(date(2023, 6, 1), False, False, date(2024, 1, 1)))
+        self.assertEqual(4, compute_priority("06-01-2023", True, False, date(2024, 1, 1)))
+        self.assertEqual(2, compute_priority("06-01-2023", True, False, date(2024, 6, 1)))
+        self.assertEqual(3, compute_priority("N/A", False, False, date(2024, 1, 1)))
+        self.assertEqual(1, compute_priority("06-01-2023", False, True, date(2024, 1, 1)))
+
+    def test_advance_reranks_only_overdue_patients(self):
+        # Test that each tick re-ranks the patients whose year ran out and the queue follows
+        self.assertEqual(["Cal", "Ann", "Bob"], [patient.first_name for patient in self.scheduler.get_all_patients()])
+        self.assertEqual(2, len(self.engine))
+        self.assertEqual([], self.engine.advance(date(2024, 2, 1)))
+        self.assertEqual(date(2024, 2, 29), self.engine.next_change())
+        self.assertEqual(["Bob"], [patient.first_name for patient in self.engine.advance(date(2024, 3, 1))])
+        self.assertEqual(["Bob", "Cal", "Ann"], [patient.first_name for patient in self.scheduler.get_all_patients()])
+        self.assertEqual(["Ann"], [patient.first_name for patient in self.engine.advance(date(2025, 1, 1))])
+        self.assertEqual(["Ann", "Bob", "Cal"], [patient.first_name for patient in self.scheduler.get_all_patients()])
+        self.assertEqual(0, len(self.engine))
+
+    def test_edits_move_the_event(self):
+        # Test that a new exam date replaces the old event and deleted patients are never re-ranked
+        bob = self.patients.find_patient("Bob", "Smith")
+        self.patients.update_patient(bob, last_exam="12-01-2023")
+        self.patients.delete_patient("Ann", "Smith")
+        self.assertEqual([], self.engine.advance(date(2024, 8, 1)))
+        self.assertEqual(["Bob"], [patient.first_name for patient in self.engine.advance(date(2024, 12, 1))])
+
+
+class TestPriorityTable(unittest.TestCase):
+    def test_matches_compute_priority(self):
+        # Test that the batch pass agrees with compute_priority row by row and follows list changes
+        patients = PatientLinkedList()
+        table = PriorityTable()
+        patients.add_listener(table)
+        patients.insert_patients([make_patient(f"P{chr(65 + index)}", last_exam=last_exam, emergent_issue=emergent,
+                                               conditions=conditions)
+                                  for index, (last_exam, emergent, conditions) in enumerate(
+                                      [("N/A", False, False), ("06-01-2023", False, True), ("06-01-2023", True, False),
+                                       ("01-01-2020", False, True), ("12-01-2023", False, False)])])
+        patients.delete_patient("PA", "Smith")
+        patients.update_patient(patients.find_patient("PE", "Smith"), conditions=True)
+
+        today = date(2024, 7, 1)
+        counts, rows = table.priorities(today)
+        self.assertEqual({1: 1, 2: 2, 3: 0, 4: 1}, counts)
+        for level, level_rows in rows.items():
+            for patient in table.patients_at(level_rows):
+                self.assertEqual(level, compute_priority(patient.last_exam, patient.conditions,
+                                                         patient.emergent_issue, today))
+        self.assertEqual(["PE"], [patient.first_name for patient in table.patients_at(rows[4])])
+
+
+class TestPatientBitmapIndex(unittest.TestCase):
+    def setUp(self):
+        # A generated clinic with its families and insurance, indexed as it is built
+        self.patients = PatientLinkedList()
+        self.family_tree = InsuranceFamilyTree()
+        self.index = PatientBitmapIndex.PatientBitmapIndex(self.patients, self.family_tree)
+        self.patients.add_listener(self.family_tree)
+        self.patients.add_listener(self.index)
+        self.family_tree.add_listener(self.index)
+        self.families = []
+        for primary, insurance, dependents in generate_clinic(300, 7):
+            family_patients = [Patient(*record) for record in (primary,) + tuple(dependents)]
+            self.patients.insert_patients(family_patients)
+            family = self.family_tree.add_family(family_patients[0], InsuranceInformation(*insurance))
+            for dependent in family_patients[1:]:
+                self.family_tree.add_family_member(family, dependent)
+            self.families.append(family)
+
+    def walk(self, provider_name, vision_coverage):
+        # The overdue patients with conditions and the given insurance, found by walking the list
+        return [patient for patient in self.patients
+                if patient.conditions and patient.priority_level in (2, 3)
+                and self.family_tree.effective_insurance(patient).provider_name == provider_name
+                and self.family_tree.effective_insurance(patient).vision_coverage == vision_coverage]
+
+    def test_filters_match_a_walk_over_the_list(self):
+        # Test conjunctive filters and value lists against the attributes, with and without NumPy
+        expected = self.walk("VSP", False)
+        filters = {"conditions": True, "overdue": True, "provider_name": "VSP", "vision_coverage": False}
+        self.assertEqual(len(expected), self.index.count(**filters))
+        numpy = PatientBitmapIndex.numpy
+        try:
+            for PatientBitmapIndex.numpy in {numpy, None}:
+                self.assertEqual(expected, self.index.patients(**filters))
+                self.assertEqual(expected[:2], self.index.patients(2, **filters))
+        finally:
+            PatientBitmapIndex.numpy = numpy
+        self.assertEqual(len(self.patients), self.index.count(priority_level=(1, 2, 3, 4)))
+        self.assertEqual(self.index.count(priority_level=[2, 3]), self.index.count(overdue=True))
+        self.assertEqual(len(self.patients), sum(self.index.count_by("provider_name").values()))
+        with self.assertRaises(ValueError):
+            self.index.count(first_name="Ann")
+
+    def test_edits_insurance_changes_and_deletes_move_bits(self):
+        # Test that every change reaching the list or the tree is reflected in the bitmaps
+        family = self.families[0]
+        members = [family.patient] + [child.patient for child in family.children]
+        self.family_tree.set_family_insurance(family, InsuranceInformation("x", "Acme", "1", False, True, "0"))
+        self.assertEqual(members, self.index.patients(provider_name="Acme", medical_coverage=True))
+        self.patients.update_patient(members[0], emergent_issue=True, priority_level=1)
+        self.assertEqual([members[0]], self.index.patients(provider_name="Acme", emergent_issue=True))
+        self.patients.unlink_patient(members[0])
+        self.assertEqual(len(self.patients), len(self.index))
+        self.assertEqual(0, self.index.count(provider_name="Acme"))  # The dependents left with the family
+        self.assertEqual(self.walk("VSP", True), self.index.patients(conditions=True, overdue=True,
+                                                                     provider_name="VSP", vision_coverage=True))
+
+
+class TestRecallList(unittest.TestCase):
+    def test_households_stream_in_priority_order(self):
+        # Test that each household with someone due is recalled once, at its most urgent level, through its
+        # primary member
+        patients = PatientLinkedList()
+        family_tree = InsuranceFamilyTree()
+        patients.add_listener(family_tree)
+        levels = {"Ann": 4, "Bob": 2, "Cal": 1, "Dee": 4, "Eve": 3, "Fay": 4}
+        people = {name: make_patient(name, "Smith" if name < "Cal" else "Jones") for name in levels}
+        for name, patient in people.items():
+            patient.priority_level = levels[name]
+            patients.insert_patient(patient)
+        smiths = family_tree.add_family(people["Ann"])
+        family_tree.add_family_member(smiths, people["Bob"])
+        jones = family_tree.add_family(people["Cal"])
+        family_tree.add_family_member(jones, people["Dee"])
+        family_tree.add_family(people["Fay"])  # Nobody due
+
+        recall = recall_households(patients, family_tree)
+        self.assertEqual((1, people["Cal"], [people["Cal"]]), next(recall))
+        self.assertEqual([(2, people["Ann"], [people["Bob"]]), (3, people["Eve"], [people["Eve"]])], list(recall))
+        chunked = recall_households(patients, family_tree, lock=threading.Lock(), chunk_size=2)
+        self.assertEqual(list(recall_households(patients, family_tree)), list(chunked))
+        output = io.StringIO()
+        self.assertEqual(3, write_recall_csv(recall_households(patients, family_tree), output))
+        self.assertEqual("2,Ann Smith,515-515-5115,111 1st St,1,Bob Smith (2)", output.getvalue().splitlines()[2])
+
+
+class TestSlotCalendar(unittest.TestCase):
+    def setUp(self):
+        # Two providers, open 8:00 to 17:00 on weekdays; May 6, 2024 is a Monday
+        self.calendar = SlotCalendar(["Dr. A", "Dr. B"])
+        self.monday = datetime(2024, 5, 6, 8, 0)
+
+    def at(self, hour, minute=0, day=6):
+        return datetime(2024, 5, day, hour, minute)
+
+    def test_booking_detects_conflicts(self):
+        # Test provider and patient clashes, back-to-back bookings, opening hours and rescheduling
+        first = self.calendar.book("Dr. A", 1, self.at(9), 30)
+        self.calendar.book("Dr. A", 2, self.at(9, 30), 30)
+        self.assertEqual([first], self.calendar.conflicts("Dr. A", self.at(8, 45), 30))
+        self.assertEqual([first], self.calendar.conflicts("Dr. B", self.at(9, 15), 30, patient_id=1))
+        for provider, patient_id, start in (("Dr. A", 3, self.at(9, 15)), ("Dr. B", 1, self.at(9)),
+                                            ("Dr. A", 3, self.at(16, 45)), ("Dr. A", 3, self.at(9, day=4))):
+            with self.assertRaises(ValueError):
+                self.calendar.book(provider, patient_id, start, 30)
+        with self.assertRaises(ValueError):
+            self.calendar.reschedule(first.booking_id, self.at(9, 15))
+        self.assertEqual(self.at(9), self.calendar.bookings[first.booking_id].start_time)
+        moved = self.calendar.reschedule(first.booking_id, self.at(10), "Dr. B")
+        self.assertEqual((first.booking_id, "Dr. B", self.at(10, 30)), (moved.booking_id, moved.provider,
+                                                                         moved.end_time))
+        self.assertEqual(1, len(self.calendar.day_bookings("Dr. A", date(2024, 5, 6))))
+        self.assertIs(moved, self.calendar.cancel(moved.booking_id))
+        self.assertIsNone(self.calendar.cancel(moved.booking_id))
+
+    def test_earliest_free_slot(self):
+        # Test that the search skips bookings, closing time and the weekend
+        self.calendar.book("Dr. A", 1, self.at(8), 60)
+        self.calendar.book("Dr. B", 2, self.at(8), 30)
+        self.calendar.book("Dr. B", 3, self.at(9), 30)
+        self.assertEqual(("Dr. B", self.at(8, 30)), self.calendar.earliest_free(30, self.monday))
+        self.assertEqual(("Dr. A", self.at(9)), self.calendar.earliest_free(45, self.monday))
+        self.assertEqual(("Dr. A", self.at(8, day=13)), self.calendar.earliest_free(30, self.at(16, 40, day=10)))
+        self.assertIsNone(self.calendar.earliest_free(10 * 60, self.monday))
+
+    def test_lengths_must_be_positive(self):
+        # Test that an empty or negative appointment is refused before anything is booked
+        for length in (0, -30):
+            for attempt in (lambda: self.calendar.book("Dr. A", 1, self.at(9), length),
+                            lambda: self.calendar.earliest_free(length, self.monday),
+                            lambda: self.calendar.fill([make_patient()], length, self.monday)):
+                with self.assertRaisesRegex(ValueError, "Appointment length must be positive."):
+                    attempt()
+        self.assertEqual(0, len(self.calendar))
+
+    def test_service_books_the_queue_in_priority_order(self):
+        # Test that the front of the appointment queue gets the earliest slots, once, and deletes free them
+        service = ClinicService(providers=("Dr. A",))
+        patients = [make_patient(name, emergent_issue=name == "Cal") for name in ("Ann", "Bob", "Cal")]
+        for patient in patients:
+            service.add_family(patient, None)
+        bookings = service.book_next(2, 30, self.monday)
+        self.assertEqual([(patients[2].patient_id, self.at(8)), (patients[0].patient_id, self.at(8, 30))],
+                         [(booking.patient_id, booking.start_time) for booking in bookings])
+        self.assertEqual([patients[1].patient_id], [booking.patient_id for booking in service.book_next(5, 30,
+                                                                                                       self.monday)])
+        service.delete_patient(patients[2])
+        self.assertEqual(2, len(service.calendar))
+
+
+class TestDispatchSimulator(unittest.TestCase):
+    def test_dispatch_follows_priority_order(self):
+        # Test waits, makespan and utilization on a backlog worked by two providers with fixed exam lengths
+        result = DispatchSimulator(2, {1: 10, 2: 20}).run({1: 1, 2: 3})
+        self.assertEqual({1: 1, 2: 3}, result.served_by_level)
+        self.assertEqual({50: 0.0, 90: 0.0, 99: 0.0}, result.wait_percentiles[1])
+        self.assertEqual({50: 10.0, 90: 20.0, 99: 20.0}, result.wait_percentiles[2])
+        self.assertEqual((40.0, [30.0, 40.0]), (result.makespan, result.busy))
+        self.assertAlmostEqual(70 / 80, result.utilization)
+        self.assertAlmostEqual(6.0, result.throughput)
+
+    def test_arrivals_jump_the_queue_and_idle_providers_wait(self):
+        # Test that an urgent arrival goes ahead of the backlog and a provider idles until the next arrival
+        simulator = DispatchSimulator(1, {1: 10, 2: 10})
+        result = simulator.run({2: 2}, arrivals=[(5.0, 1), (100.0, 2)])
+        self.assertEqual(5.0, result.wait_percentiles[1][50])
+        self.assertEqual({50: 0.0, 90: 20.0, 99: 20.0}, result.wait_percentiles[2])
+        self.assertEqual((110.0, 40.0), (result.makespan, result.busy[0]))
+        self.assertEqual(1, simulator.run({2: 3}, until=15).waiting)
+        with self.assertRaises(ValueError):
+            simulator.run({3: 1})
+
+    def test_staffing_sweep_uses_the_same_traffic(self):
+        # Test that a seeded sweep is reproducible and that more providers see the backlog sooner
+        rates = {1: 1.0, 2: 4.0, 3: 6.0}
+        results = staffing_sweep([2, 4], backlog={2: 200, 3: 500}, arrivals_per_hour=rates, horizon=8 * 60, seed=3)
+        again = staffing_sweep([2], backlog={2: 200, 3: 500}, arrivals_per_hour=rates, horizon=8 * 60, seed=3)
+        self.assertEqual(results[2].as_dict(), again[2].as_dict())
+        self.assertEqual(results[2].served, results[4].served)
+        self.assertLess(results[4].makespan, results[2].makespan)
+        self.assertLess(results[4].wait_percentiles[3][90], results[2].wait_percentiles[3][90])
+
+
+class TestSortedPatientIndex(unittest.TestCase):
+    def test_stays_sorted_through_changes(self):
+        # Test that the index keeps (last_name, first_name) order across inserts, renames and deletes
+        patients = PatientLinkedList()
+        index = SortedPatientIndex()
+        patients.add_listener(index)
+        for first_name, last_name in (("Cal", "Young"), ("Ann", "Adams"), ("Bob", "Young"), ("Dee", "Moss")):
+            patients.insert_patient(make_patient(first_name, last_name))
+
+        def names():
+            return [(patient.first_name, patient.last_name) for patient in index]
+
+        self.assertEqual([("Ann", "Adams"), ("Dee", "Moss"), ("Bob", "Young"), ("Cal", "Young")], names())
+        patients.update_patient(patients.find_patient("Cal", "Young"), last_name="Baker")
+        self.assertEqual([("Ann", "Adams"), ("Cal", "Baker"), ("Dee", "Moss"), ("Bob", "Young")], names())
+        patients.delete_patient("Dee", "Moss")
+        self.assertEqual([("Cal", "Baker"), ("Bob", "Young")], [(p.first_name, p.last_name)
+                                                                 for p in index.get_patients(1, 2)])
+        self.assertEqual(2, index.position_of("Young"))
+
+
+class TestPatientSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.patients = PatientLinkedList()
+        self.index = PatientSearchIndex()
+        self.patients.add_listener(self.index)
+        for first_name, last_name in (("Katherine", "Johnson"), ("Catherine", "Johnston"), ("John", "Smith"),
+                                      ("Jon", "Smithers"), ("Mary Ann", "O'Neil")):
+            self.patients.insert_patient(make_patient(first_name, last_name))
+
+    def names(self, query):
+        return [f"{patient.first_name} {patient.last_name}" for patient in self.index.search(query)]
+
+    def test_prefix_search(self):
+        # Test that partial names match in either name order
+        self.assertEqual(["John Smith", "Jon Smithers"], self.names("smi"))
+        self.assertEqual(["John Smith"], self.names("john s")[:1])
+        self.assertEqual(["Mary Ann O'Neil"], self.names("o'neil mary"))
+
+    def test_typo_tolerant_search(self):
+        # Test that misspelled names still find the patient, closest match first
+        self.assertEqual("Katherine Johnson", self.names("katherin jonson")[0])
+        self.assertEqual("Catherine Johnston", self.names("catherine johnstn")[0])
+        self.assertEqual([], self.names("zzz"))
+
+    def test_repeated_typo_search_sees_new_patients(self):
+        # Test that the words remembered between keystrokes do not hide patients added or deleted since
+        self.assertEqual(["Katherine Johnson"], self.names("katherin jonson"))
+        self.patients.insert_patient(make_patient("Kathrine", "Johnson"))
+        self.assertEqual({"Katherine Johnson", "Kathrine Johnson"}, set(self.names("katherin jonson")))
+        self.patients.delete_patient("Katherine", "Johnson")
+        self.assertEqual(["Kathrine Johnson"], self.names("katherin jonson"))
+
+    def test_follows_renames_and_deletes(self):
+        # Test that the index follows edits made through the linked list
+        patient = self.patients.find_patient("John", "Smith")
+        self.patients.update_patient(patient, last_name="Smyth")
+        self.assertNotIn("John Smith", self.names("smith"))
+        self.assertEqual("John Smyth", self.names("john smyth")[0])
+        self.patients.delete_patient("John", "Smyth")
+        self.assertNotIn("John Smyth", self.names("john smyth"))
+
+
+class TestInsuranceFamilyTree(unittest.TestCase):
+    def setUp(self):
+        # Two families of three, with the tree following the patient list like the app does
+        self.patients = PatientLinkedList()
+        self.family_tree = InsuranceFamilyTree()
+        self.patients.add_listener(self.family_tree)
+        self.families = []
+        for last_name in ("Smith", "Jones"):
+            primary = make_patient("Ann", last_name)
+            self.patients.insert_patient(primary)
+            family = self.family_tree.add_family(primary, InsuranceInformation(f"Ann {last_name}", "Acme", "P1",
+                                                                               True, False, "20"))
+            for first_name in ("Bob", "Cal"):
+                member = make_patient(first_name, last_name)
+                self.patients.insert_patient(member)
+                self.family_tree.add_family_member(family, member)
+            self.families.append(family)
+
+    def test_find_member_and_family(self):
+        # Test that members and their families are found through the indexes and follow renames
+        bob = self.patients.find_patient("Bob", "Jones")
+        self.assertIs(bob, self.family_tree.find_member("Bob", "Jones").patient)
+        self.assertIs(self.families[1], self.family_tree.family_of(bob))
+        self.assertIs(self.families[1], self.family_tree.family_of(self.families[1].patient))
+        self.patients.update_patient(bob, first_name="Rob")
+        self.assertIsNone(self.family_tree.find_member("Bob", "Jones"))
+        self.assertIs(bob, self.family_tree.find_member("Rob", "Jones").patient)
+
+    def test_remove_member(self):
+        # Test that deleting a dependent takes them out of their family and drops the shared insurance
+        bob = self.patients.find_patient("Bob", "Smith")
+        self.patients.unlink_patient(bob)
+        self.assertEqual(["Cal"], [member.patient.first_name for member in self.families[0].children])
+        self.assertIsNone(self.family_tree.family_of(bob))
+        self.assertIsNone(bob.insurance_info)
+        self.assertEqual(5, len(self.family_tree))
+
+    def test_insurance_resolves_through_family(self):
+        # Test that dependents see a replaced policy and lose it when they leave the family
+        bob = self.patients.find_patient("Bob", "Smith")
+        self.assertEqual("Acme", self.family_tree.effective_insurance(bob).provider_name)
+        self.family_tree.set_family_insurance(self.families[0], InsuranceInformation("Ann Smith", "Beta", "P2", False,
+                                                                                     True, "10"))
+        self.assertEqual("Beta", self.family_tree.effective_insurance(bob).provider_name)
+        self.assertEqual("Beta", bob.get_insurance_info().provider_name)
+        self.assertEqual({"Jones"}, {patient.last_name for patient in self.family_tree.covered_patients()})
+        self.assertEqual(3, len(list(self.family_tree.covered_patients("medical_coverage"))))
+        self.family_tree.remove_member(self.family_tree.node_of(bob))
+        self.assertIsNone(self.family_tree.effective_insurance(bob))
+
+    def test_insurance_assigned_to_the_primary_member_reaches_dependents(self):
+        # Test that insurance set straight on the primary member is what the family resolves to
+        bob = self.patients.find_patient("Bob", "Smith")
+        self.families[0].patient.insurance_info = InsuranceInformation("Ann Smith", "Beta", "P2", True, True, "5")
+        self.assertEqual("Beta", self.family_tree.effective_insurance(bob).provider_name)
+        self.assertEqual("Beta", self.family_tree.effective_insurance(self.families[0].patient).provider_name)
+
+    def test_remove_family(self):
+        # Test that removing a family returns all of its patients and leaves the other family intact
+        removed = self.family_tree.remove_family(self.families[0])
+        self.assertEqual(["Ann", "Bob", "Cal"], [patient.first_name for patient in removed])
+        self.assertEqual([self.families[1]], self.family_tree.root.children)
+        self.assertIsNone(self.family_tree.find_member("Cal", "Smith"))
+        self.assertIs(self.families[1], self.family_tree.find_member("Ann", "Jones"))
+        self.assertEqual(3, len(self.family_tree))
+
+
+class TestPatientStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_store(self, **options):
+        # Load a fresh patient list and family tree from the store directory
+        patients = PatientLinkedList()
+        family_tree = InsuranceFamilyTree()
+        patients.add_listener(family_tree)
+        store = PatientStore(self.directory.name, **options)
+        store.load(patients, family_tree)
+        return store, patients, family_tree
+
+    def fill(self, patients, family_tree):
+        # Create a family of three, edit one member and delete another
+        primary = make_patient("Ann", "Smith")
+        insurance = InsuranceInformation("Ann Smith", "Acme", "P123", True, False, "20")
+        patients.insert_patient(primary)
+        family = family_tree.add_family(primary, insurance)
+        for first_name in ("Bob", "Cal"):
+            member = make_patient(first_name, "Smith")
+            patients.insert_patient(member)
+            family_tree.add_family_member(family, member)
+        patients.update_patient(patients.find_patient("Bob", "Smith"), phone="555-555-5555", priority_level=1)
+        patients.delete_patient("Cal", "Smith")
+        family_tree.set_family_insurance(family, InsuranceInformation("Ann Smith", "Beta", "P456", True, True, "10"))
+
+    def check(self, patients, family_tree):
+        # Verify the state written by fill survived a restart
+        self.assertEqual(["Ann", "Bob"], [patient.first_name for patient in patients])
+        family = family_tree.root.children[0]
+        self.assertIs(patients.find_patient("Ann", "Smith"), family.patient)
+        self.assertEqual("Beta", family.patient.insurance_info.provider_name)
+        self.assertEqual(["Bob"], [member.patient.first_name for member in family.children])
+        bob = patients.find_patient("Bob", "Smith")
+        self.assertIs(family.patient.insurance_info, family_tree.effective_insurance(bob))
+        self.assertEqual(("555-555-5555", 1), (bob.phone, bob.priority_level))
+        self.assertIs(family.patient, bob.primary_member)
+
+    def test_journal_replay(self):
+        # Test that changes are recovered from the journal alone
+        store, patients, family_tree = self.open_store()
+        self.fill(patients, family_tree)
+        store.close()
+
+        store, patients, family_tree = self.open_store()
+        self.check(patients, family_tree)
+        store.close()
+
+    def test_snapshot_and_journal_tail(self):
+        # Test that compaction writes a snapshot and later changes replay on top of it
+        store, patients, family_tree = self.open_store(compact_every=3)
+        self.fill(patients, family_tree)
+        store.sync()
+        self.assertEqual(0, store.journal_records)
+        patients.insert_patient(make_patient("Dee", "Jones"))
+        store.close()
+
+        store, patients, family_tree = self.open_store()
+        self.assertGreater(store.generation, 0)
+        self.assertIsNotNone(patients.find_patient("Dee", "Jones"))
+        patients.delete_patient("Dee", "Jones")
+        self.check(patients, family_tree)
+        store.close()
+
+    def test_torn_record_is_cut_off_before_appending(self):
+        # Test that a partial record left by a crash is dropped, so changes made after the restart are replayed
+        store, patients, family_tree = self.open_store()
+        for first_name in ("Ann", "Bob"):
+            patients.insert_patient(make_patient(first_name))
+        store.close()
+        with open(store.journal_path(store.generation), "a") as journal_file:
+            journal_file.write('{"op":"ins')
+
+        store, patients, family_tree = self.open_store()
+        patients.insert_patient(make_patient("Cal"))
+        store.close()
+
+        store, patients, family_tree = self.open_store()
+        self.assertEqual(["Ann", "Bob", "Cal"], [patient.first_name for patient in patients])
+        store.close()
+
+    def test_deferred_compaction(self):
+        # Test that changes journaled while a deferred snapshot is pending survive whether or not the snapshot
+        # is written before the process stops
+        store, patients, family_tree = self.open_store(compact_every=3)
+        self.fill(patients, family_tree)
+        compaction = store.sync(defer_compaction=True)
+        self.assertEqual(1, compaction["generation"])
+        patients.insert_patient(make_patient("Dee", "Jones"))
+        store.close()
+
+        for write_snapshot in (False, True):
+            if write_snapshot:
+                store.write_snapshot(compaction)
+            store, patients, family_tree = self.open_store()
+            self.assertEqual(["Ann", "Bob", "Dee"], [patient.first_name for patient in patients])
+            self.assertEqual(["Bob"], [member.patient.first_name for member in family_tree.root.children[0].children])
+            store.close()
+        self.assertEqual(["journal.1.log", "snapshot.json"], sorted(os.listdir(self.directory.name)))
+
+    def test_compaction_due_mid_delete(self):
+        # Test that a compaction falling due on a member's detach record waits for the delete record, so the
+        # store still reloads
+        store, patients, family_tree = self.open_store(sync_every=1, compact_every=8)
+        self.fill(patients, family_tree)
+        store.close()
+
+        store, patients, family_tree = self.open_store()
+        self.check(patients, family_tree)
+        store.close()
+
+    def test_replay_skips_patients_already_gone(self):
+        # Test that journal records for a patient missing from the snapshot are ignored
+        store, patients, family_tree = self.open_store()
+        self.fill(patients, family_tree)
+        store.write({"op": "delete", "id": 2})
+        store.write({"op": "detach", "id": 2})
+        store.close()
+
+        store, patients, family_tree = self.open_store()
+        self.check(patients, family_tree)
+        store.close()
+
+
+class TestSQLitePatientRepository(TestPatientStore):
+    def open_store(self, **options):
+        # Same scenarios as TestPatientStore, backed by a SQLite file
+        patients = PatientLinkedList()
+        family_tree = InsuranceFamilyTree()
+        patients.add_listener(family_tree)
+        store = SQLitePatientRepository(self.directory.name + "/clinic.db")
+        store.load(patients, family_tree)
+        return store, patients, family_tree
+
+    def test_snapshot_and_journal_tail(self):
+        # SQLite has no snapshots of its own to compact
+        pass
+
+    def test_replay_skips_patients_already_gone(self):
+        # SQLite has no journal to replay
+        pass
+
+    def test_torn_record_is_cut_off_before_appending(self):
+        # SQLite rolls back a torn transaction itself
+        pass
+
+    def test_deferred_compaction(self):
+        # Nor any compaction to defer
+        pass
+
+    def test_indexed_queries(self):
+        # Test that the schedule and lookups are answered by queries without loading patients
+        store, patients, family_tree = self.open_store()
+        self.fill(patients, family_tree)
+        patients.insert_patient(make_patient("Dee", "Jones", emergent_issue=True))
+
+        self.assertEqual(3, store.count_to_schedule(4))
+        self.assertEqual(["Bob", "Dee", "Ann"], [row.first_name for row in store.fetch_schedule(0, 10)])
+        self.assertEqual(["Dee"], [row.first_name for row in store.fetch_schedule(1, 1)])
+        ann_id = store.find_patient_id("Ann", "Smith", "01-01-1990")
+        self.assertEqual(ann_id, store.find_patient_id("Ann", "Smith", "1-1-1990"))
+        self.assertEqual(2, len(store.family_member_ids(ann_id)))
+        store.close()
+
+
+class TestPatientImporter(unittest.TestCase):
+    HEADER = "family_id,relationship,first_name,last_name,dob,phone,address,last_exam,emergent_issue,prescription," \
+             "conditions,provider_name,policy_number,vision_coverage,medical_coverage,copay\n"
+    ROWS = [
+        "F2,dependent,Bob,Smith,02-02-2010,515-515-5115,111 1st St,N/A,no,N/A,no,,,,,\n",
+        "F2,primary,Ann,Smith,01-01-1980,515-515-5115,111 1st St,01-01-2020,no,N/A,yes,Acme,P1,yes,no,20\n",
+        "F3,primary,Cal,Jones,13-01-1980,515-515-5115,9 Elm St,N/A,no,N/A,no,Acme,P2,yes,no,20\n",
+        "F4,dependent,Dee,Moss,01-01-2000,515-515-5115,4 Oak St,N/A,no,N/A,no,,,,,\n",
+    ]
+
+    def write_export(self, directory, name, lines):
+        path = f"{directory}/{name}"
+        with open(path, "w") as export:
+            export.writelines(lines)
+        return path
+
+    def test_csv_import(self):
+        # Test that valid rows are linked into families and invalid ones, including a dependent whose family never
+        # gets a primary member, are reported without stopping and left out of the list
+        for chunk_size in (1, 2):
+            with tempfile.TemporaryDirectory() as directory:
+                path = self.write_export(directory, "export.csv", [self.HEADER] + self.ROWS)
+                patients, family_tree = PatientLinkedList(), InsuranceFamilyTree()
+                result = import_patients(path, patients, family_tree, chunk_size=chunk_size)
+
+            self.assertEqual(2, result.imported)
+            self.assertEqual(["Ann", "Bob"], [patient.first_name for patient in patients])
+            self.assertEqual([4, 5], [line for line, _ in result.errors])
+            self.assertIn("Dee Moss was not imported", result.errors[1][1])
+            family = family_tree.root.children[0]
+            self.assertEqual("Acme", family.patient.insurance_info.provider_name)
+            self.assertEqual(["Bob"], [member.patient.first_name for member in family.children])
+
+    def test_jsonl_import(self):
+        # Test that JSON Lines exports go through the same validation
+        lines = [json.dumps({"family_id": 1, "first_name": "Ann", "last_name": "Smith", "dob": "01-01-1980",
+                             "phone": "515-515-5115", "address": "111 1st St", "copay": 0}) + "\n",
+                 json.dumps({"family_id": 1, "relationship": "dependent", "first_name": "Bob", "last_name": "Smith",
+                             "dob": "02-02-2010", "phone": "5155155115", "address": "111 1st St"}) + "\n"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.write_export(directory, "export.jsonl", lines)
+            patients, family_tree = PatientLinkedList(), InsuranceFamilyTree()
+            result = import_patients(path, patients, family_tree)
+
+        self.assertEqual(1, result.imported)
+        self.assertEqual(0, family_tree.root.children[0].patient.insurance_info.copay)
+        self.assertEqual([(2, "Phone number must be in the format 555-555-5555.")], result.errors)
+
+
+class FakeRoot:
+    def __init__(self):
+        # Stands in for the Tk window: after() only records the callback, and run() plays them back
+        self.callbacks = []
+
+    def after(self, delay, callback):
+        self.callbacks.append(callback)
+
+    def run(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+class TestTaskExecutor(unittest.TestCase):
+    def setUp(self):
+        self.root = FakeRoot()
+        self.executor = TaskExecutor(self.root, threads=2, processes=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_results_and_progress_come_back_through_polling(self):
+        # Test that progress arrives before the result, both delivered by poll() rather than the worker thread
+        def count_to(task, limit):
+            for number in range(limit):
+                task.report(number)
+            return limit
+
+        events = []
+        on_done = lambda result: events.append(("done", result))
+        self.executor.submit(count_to, 3, on_progress=events.append, on_done=on_done)
+        self.executor.submit(lambda task: 1 / 0, on_error=lambda error: events.append(type(error)))
+        self.assertEqual([], events)
+        self.root.run()
+        self.assertEqual([0, 1, 2, ("done", 3), ZeroDivisionError], events)
+        self.assertEqual(0, len(self.executor))
+
+    def test_map_process_delivers_results_in_order_until_cancelled(self):
+        # Test that process results come back in item order and a cancelled task stops calling back
+        results = []
+        self.executor.map_process(abs, range(0, -20, -1), on_result=results.append,
+                                  on_done=lambda count: results.append(("done", count)))
+        self.root.run()
+        self.assertEqual(list(range(20)) + [("done", 20)], results)
+
+        cancelled = []
+        task = self.executor.map_process(abs, range(1000), on_result=cancelled.append, on_done=cancelled.append)
+        task.cancel()
+        self.root.run()
+        self.assertEqual([], cancelled)
+
+    def test_a_raising_callback_does_not_stop_polling(self):
+        # Test that the other tasks are still delivered after a callback raises
+        release = threading.Event()
+        events = []
+
+        def fail(result):
+            release.set()
+            raise RuntimeError("callback failed")
+
+        self.executor.submit(lambda task: None, on_done=fail)
+        self.executor.submit(lambda task: release.wait(5), on_done=events.append)
+        with self.assertRaises(RuntimeError):
+            self.root.run()
+        self.root.run()
+        self.assertEqual([True], events)
+        self.assertFalse(self.executor.polling)
+
+
+class TestClinicService(unittest.TestCase):
+    def setUp(self):
+        # An in-memory service with one family of two
+        self.service = ClinicService()
+        self.primary = make_patient("Ann", last_exam="01-01-2015")
+        self.family = self.service.add_family(self.primary, InsuranceInformation("Ann Smith", "VSP", "1", True,
+                                                                                 False, "10"))
+        self.dependent = make_patient("Bob", dob="02-02-2010")
+        self.service.add_member(self.family, self.dependent)
+
+    def test_edit_validates_everything_before_changing_anything(self):
+        # Test that a bad field leaves the patient untouched and a good edit re-ranks and re-keys it
+        with self.assertRaises(ValueError):
+            self.service.edit_patient(self.dependent, first_name="Robert", phone="555")
+        self.assertEqual("Bob", self.dependent.first_name)
+        self.service.edit_patient(self.dependent, first_name="Robert", emergent_issue=True, last_exam="")
+        self.assertIs(self.dependent, self.service.find_patient("Robert", "Smith"))
+        self.assertEqual("N/A", self.dependent.last_exam)
+        self.assertEqual([self.dependent, self.primary], self.service.next_appointments(5))
+
+    def test_deleting_the_primary_member_removes_the_family(self):
+        # Test that a dependent is deleted alone but the primary member takes the family along
+        self.assertEqual([self.dependent], self.service.delete_patient(self.dependent))
+        self.assertEqual([], self.family.children)
+        self.service.add_member(self.family, self.dependent)
+        self.assertEqual([self.primary, self.dependent], self.service.delete_patient(self.primary))
+        self.assertEqual(0, len(self.service))
+        with self.assertRaises(ValueError):
+            self.service.find_patient("Ann", "Smith")
+
+    def test_recall_csv_is_written_outside_the_commit_lock(self):
+        # Test that the rows are written once the commit lock is free, so other terminals can carry on meanwhile
+        service = self.service
+        lock_free = []
+
+        def try_lock():
+            lock_free.append(service.commit_lock.acquire(blocking=False))
+            if lock_free[-1]:
+                service.commit_lock.release()
+
+        class Output(io.StringIO):
+            def write(self, text):
+                thread = threading.Thread(target=try_lock)
+                thread.start()
+                thread.join()
+                return super().write(text)
+
+        self.assertEqual(1, service.write_recall_csv(Output()))
+        self.assertTrue(lock_free)
+        self.assertTrue(all(lock_free))
+
+    def test_patients_are_looked_up_by_id(self):
+        # Test that the service and its descriptions refer to patients by patient_id
+        patient_id = self.dependent.patient_id
+        self.assertIs(self.dependent, self.service.get_patient(patient_id))
+        self.assertEqual(patient_id, describe_patient(self.dependent)["patient_id"])
+        self.service.delete_patient(self.dependent)
+        with self.assertRaises(ValueError):
+            self.service.get_patient(patient_id)
+
+
+class TestClinicConcurrency(unittest.TestCase):
+    def test_pages_are_copies(self):
+        # Test that a page read from the service keeps what it saw after later changes
+        service = ClinicService()
+        ann = make_patient("Ann", last_exam="01-01-2015")
+        service.add_family(ann, None)
+        page, schedule = service.list_sorted(), service.next_appointments()
+        self.assertEqual(1, service.count_below(4))
+        service.delete_patient(ann)
+        self.assertEqual(([ann], [ann]), (page, schedule))
+        self.assertEqual(([], [], 0), (service.list_sorted(), service.next_appointments(), service.count_below(4)))
+
+    def test_sqlite_schedule_reads_wait_for_the_commit_lock(self):
+        # Test that the schedule page's SQLite queries go through the service and its one lock
+        with tempfile.TemporaryDirectory() as directory:
+            service = ClinicService(directory, "sqlite")
+            service.add_family(make_patient("Ann", last_exam="01-01-2015"), None)
+            pages = []
+            with service.commit_lock:
+                reader = threading.Thread(target=lambda: pages.append(service.fetch_schedule(0, 10)))
+                reader.start()
+                reader.join(0.2)
+                self.assertEqual([], pages)
+            reader.join()
+            self.assertEqual((1, ["Ann"]), (service.count_to_schedule(), [row.first_name for row in pages[0]]))
+            service.close()
+
+    def test_threads_editing_different_families(self):
+        # Test that terminals adding, editing and deleting in their own families, while another pages through
+        # the lists, leave the list links, tree and indexes consistent
+        service = ClinicService()
+        families = [service.add_family(make_patient(f"Head{chr(65 + index)}"), None) for index in range(8)]
+        stop = threading.Event()
+        start = threading.Barrier(8)
+        pages = []
+
+        def terminal(family, letter):
+            start.wait()
+            members = []
+            for number in range(60):
+                member = make_patient(f"Kid{letter}{chr(65 + number % 26)}", last_name=f"Fam{letter}",
+                                      dob=f"01-{number % 28 + 1:02d}-2010")
+                service.add_member(family, member)
+                members.append(member)
+                service.edit_patient(member, emergent_issue=number % 3 == 0)
+            for member in members[::2]:
+                service.delete_patient(member)
+
+        def reader():
+            while not stop.is_set():
+                pages.append(len(service.next_appointments(20)) + len(service.list_sorted(0, 20)))
+
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        threads = [threading.Thread(target=terminal, args=(family, chr(65 + index)))
+                   for index, family in enumerate(families)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stop.set()
+        reader_thread.join()
+
+        patients = service.patient_list
+        forward, current, previous = 0, patients.head, None
+        while current:
+            self.assertIs(previous, current.prev)
+            forward, previous, current = forward + 1, current, current.next
+        self.assertIs(previous, patients.tail)
+        self.assertEqual((8 + 8 * 30, 8 + 8 * 30), (forward, len(patients)))
+        self.assertEqual([30] * 8, [len(family.children) for family in families])
+        self.assertEqual(len(patients), len(service.appointment_scheduler))
+        self.assertEqual(len(patients), len(service.sorted_index))
+        self.assertTrue(pages)
+
+
+class TestClinicServer(unittest.TestCase):
+    def test_requests_and_load_over_json_lines(self):
+        # Test a few requests on one connection, then concurrent clients from the load generator
+        async def scenario():
+            service = ClinicService()
+            load_households(service, generate_clinic(1000, 2024))
+            server = ClinicServer(service, port=0)
+            await server.start()
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+
+            async def call(op, **args):
+                writer.write((json.dumps({"id": op, "op": op, "args": args}) + "\n").encode())
+                return json.loads(await reader.readline())
+
+            added = await call("add_family", patient={"first_name": "Zed", "last_name": "Quill", "dob": "01-01-1980",
+                                                      "phone": "555-555-5555", "address": "1 Main St"},
+                               insurance={"provider_name": "VSP"})
+            family = await call("family", patient={"first_name": "Zed", "last_name": "Quill"})
+            missing = await call("delete", patient={"first_name": "Nobody", "last_name": "Here"})
+            query = await call("query", filters={"provider_name": ["VSP"], "overdue": True}, limit=3,
+                               group_by="priority_level")
+            simulated = await call("simulate", providers=[1, 3], exam_minutes={"1": 30, "2": 30, "3": 20, "4": 15},
+                                   arrivals_per_hour={"3": 2.0}, hours=8, seed=1)
+            writer.close()
+            stats = await run_load("127.0.0.1", server.port, clients=5, requests=20)
+            await server.close()
+            return added, family, missing, query, simulated, stats
+
+        added, family, missing, query, simulated, stats = asyncio.run(scenario())
+        self.assertTrue(added["ok"])
+        self.assertEqual(3, added["result"]["priority_level"])
+        self.assertEqual("VSP", family["result"]["insurance"]["provider_name"])
+        self.assertEqual({"id": "delete", "ok": False, "error": "No patient named Nobody Here."}, missing)
+        self.assertEqual(3, len(query["result"]["patients"]))
+        self.assertEqual(query["result"]["count"], sum(query["result"]["counts"].values()))
+        one, three = simulated["result"]
+        self.assertEqual((1, 3, one["served"]), (one["providers"], three["providers"], three["served"]))
+        self.assertGreater(one["makespan_minutes"], three["makespan_minutes"])
+        self.assertEqual((100, 0), (stats["requests"], stats["errors"]))
+
+    def test_sqlite_backend_on_worker_threads(self):
+        # Test that worker threads can write to the SQLite repository and that an unexpected error still gets
+        # an error response
+        async def scenario(directory):
+            service = ClinicService(directory, "sqlite")
+            server = ClinicServer(service, port=0, workers=3)
+            server.operations["stats"] = lambda: 1 / 0
+            await server.start()
+            stats = await run_load("127.0.0.1", server.port, clients=3, requests=20)
+            broken = json.loads(await asyncio.get_running_loop().run_in_executor(
+                server.workers, server.respond, b'{"id": 1, "op": "stats"}'))
+            await server.close()
+            service.close()
+            reopened = ClinicService(directory, "sqlite")
+            reopened.close()
+            return stats, broken, len(reopened)
+
+        with tempfile.TemporaryDirectory() as directory:
+            stats, broken, reloaded = asyncio.run(scenario(directory))
+        self.assertEqual((60, 0), (stats["requests"], stats["errors"]))
+        self.assertEqual({"id": 1, "ok": False, "error": "Internal error: ZeroDivisionError: division by zero"},
+                         broken)
+        self.assertGreater(reloaded, 0)
+
+
+class TestOptometristBenchmark(unittest.TestCase):
+    def test_generate_clinic_is_reproducible(self):
+        # Test that a seed always generates the same clinic of the requested size
+        households = generate_clinic(500, 7)
+        self.assertEqual(households, generate_clinic(500, 7))
+        self.assertEqual(500, sum(1 + len(dependents) for _, _, dependents in households))
+
+    def test_benchmark_clinic_times_every_operation(self):
+        # Test that a small clinic runs end to end and reports each timed operation
+        results = benchmark_clinic(300, 7, samples=20, tree_samples=5)
+        self.assertEqual(300, results["Patient.__init__"]["count"])
+        self.assertEqual(5, results["InsuranceFamilyTree.find_member"]["count"])
+        self.assertIn("AppointmentScheduler.get_all_patients", results)
+        search = results["PatientSearchIndex.search"]
+        self.assertEqual(search["count"], sum(group["count"] for group in search["groups"].values()))
+        self.assertEqual(20, search["groups"]["1"]["count"])
+        self.assertLessEqual(search["p50_us"], search["p99_us"])
+
+
 if __name__ == '__main__':
     unittest.main()
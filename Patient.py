@@ -1,80 +1,273 @@
-from datetime import datetime, timedelta
-import re
+from collections import deque
+from datetime import date, datetime, timedelta
+from itertools import count
+import sys
+
+import Validation
+
+OVERDUE_AFTER = timedelta(days=365)  # A patient is due for an exam this long after their last one
+OVERDUE_DAYS = OVERDUE_AFTER.days
+EMERGENT_FLAG = 1  # Bits of Patient._flags; the priority level is kept in the bits above them
+CONDITIONS_FLAG = 2
+PRIORITY_SHIFT = 2
+REUSE_AFTER = 1024  # Deleted patient_ids wait until this many are free before any is handed out again
+shared_ordinals = {}  # One int object per distinct date ordinal, shared by every patient with that date
+
+
+class PatientIds:
+    def __init__(self):
+        # Hands out the integer patient_id every listed patient is known by; ids of deleted patients go on a free list
+        # and are reused oldest first, so arrays indexed by patient_id stay about as long as the largest the
+        # clinic has been, while an id held by a stale page or client stays unused for a good while
+        self.counter = count()
+        self.released = deque()
+
+    def allocate(self):
+        # deque.popleft and next() on a counter are atomic, so threads may create patients concurrently
+        if len(self.released) > REUSE_AFTER:
+            return self.released.popleft()
+        return next(self.counter)
+
+    def release(self, patient_id):
+        self.released.append(patient_id)
+
+
+patient_ids = PatientIds()
+
+
+def grow_slots(slots, patient_id, empty=None):
+    # Pad a list or array indexed by patient_id so that patient_id is a valid index
+    if patient_id >= len(slots):
+        slots.extend([empty] * (patient_id + 1 - len(slots)))
+
+
+def slot_value(slots, patient_id, empty=None):
+    # slots[patient_id], or empty for a patient without an id or past the end of slots
+    if patient_id is None or not 0 <= patient_id < len(slots):
+        return empty
+    return slots[patient_id]
+
+
+def intern_text(value):
+    # Share one copy of strings that repeat across patients (names, household phones and addresses)
+    return sys.intern(value) if type(value) is str else value
+
+
+def date_ordinal(value):
+    # Canonical form of a date: a shared day ordinal for dates and MM-DD-YYYY strings; anything else
+    # (None, "N/A", free text) is kept as it is
+    if isinstance(value, str):
+        if not value or value == "N/A":
+            return value
+        try:
+            ordinal = Validation.parse_ordinal(value)
+        except ValueError:
+            return value
+        return shared_ordinals.setdefault(ordinal, ordinal)
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        ordinal = value.toordinal()
+        return shared_ordinals.setdefault(ordinal, ordinal)
+    return value
+
+
+def ordinal_text(ordinal):
+    # The MM-DD-YYYY string for a day ordinal
+    return Validation.format_ordinal(ordinal)
+
+
+def exam_ordinal(last_exam):
+    # Turn a last exam value (day ordinal, date, datetime, MM-DD-YYYY string, "N/A" or None) into a day
+    # ordinal, or None
+    ordinal = date_ordinal(last_exam)
+    return ordinal if type(ordinal) is int else None
+
+
+def compute_priority(last_exam, conditions, emergent_issue, today=None):
+    # Priority level for the given patient data as of today (default: the current date)
+    today = today or datetime.now().date()
+    last_exam_ordinal = exam_ordinal(last_exam)
+    overdue = last_exam_ordinal is None or last_exam_ordinal <= today.toordinal() - OVERDUE_DAYS
+    if emergent_issue:
+        return 1  # Priority 1 for emergent issues
+    elif conditions and overdue:
+        return 2  # Priority 2 for medical conditions with last exam over a year ago or no last exam
+    elif not conditions and overdue:
+        return 3  # Priority 3 for no conditions with last exam over a year ago or no last exam
+    else:
+        return 4  # Priority 4 for all others
+
+
+def overdue_on(last_exam, emergent_issue):
+    # The day ordinal a patient's priority next changes by itself, when their last exam turns a year old,
+    # or None
+    last_exam_ordinal = exam_ordinal(last_exam)
+    if emergent_issue or last_exam_ordinal is None:
+        return None
+    return last_exam_ordinal + OVERDUE_DAYS
 
 
 class Patient:
+    # Slots instead of a per-instance __dict__, with dates kept as shared day ordinals and the yes/no fields
+    # and priority level packed into one small int; all of them still read and write as plain attributes
+    __slots__ = ("first_name", "last_name", "_dob", "phone", "address", "_last_exam", "prescription", "_flags",
+                 "primary_member", "insurance_info", "next", "prev", "patient_id")
+
     def __init__(self, first_name, last_name, dob, phone, address, last_exam=None, emergent_issue=None,
                  prescription=None, conditions=None, primary_member=None, insurance_info=None):
         # Constructor initializes patient data
-        self.first_name = self.validate_name(first_name, "First Name")
-        self.last_name = self.validate_name(last_name, "Last Name")
+        self._flags = 0
+        self.first_name = intern_text(self.validate_name(first_name, "First Name"))
+        self.last_name = intern_text(self.validate_name(last_name, "Last Name"))
         self.dob = self.validate_dob(dob, "Date of Birth")
-        self.phone = self.validate_phone(phone)
-        self.address = self.validate_address(address)
+        self.phone = intern_text(self.validate_phone(phone))
+        self.address = intern_text(self.validate_address(address))
         self.last_exam = self.validate_date(last_exam, "Last Exam")
         self.prescription = self.validate_prescription(prescription)
         self.emergent_issue = emergent_issue
-        self.prescription = prescription
+        self.prescription = intern_text(prescription)
         self.conditions = conditions
         self.primary_member = primary_member
         self.insurance_info = insurance_info
         self.next = None
+        self.prev = None
         self.priority_level = self.calculate_priority()
+        self.patient_id = None  # Given out by PatientLinkedList on insert, so rejected input uses no id
 
     @staticmethod
     def validate_name(name, field_name):
         # Static method to validate and clean a name field
-        if not name.strip():
-            raise ValueError(f"{field_name} must be a non-empty string.")
-        if not all(char.isalpha() or char in " '-" for char in name):
-            raise ValueError(f"{field_name} contains invalid characters.")
-        return name
+        return Validation.validate_name(name, field_name)
 
     @staticmethod
     def validate_date(date_str, field_name):
         # Static method to validate and parse a date field
-        if not date_str or date_str.strip().upper() == "N/A":
-            return None
-        try:
-            return datetime.strptime(date_str, "%m-%d-%Y").date()
-        except ValueError:
-            raise ValueError(f"{field_name} must be a valid date string (MM-DD-YYYY) or 'N/A'.")
+        return Validation.validate_date(date_str, field_name)
 
     @staticmethod
     def validate_phone(phone):
         # Static method to validate and clean a phone number
-        phone_pattern = re.compile(r"^\d{3}-\d{3}-\d{4}$")
-        if not phone_pattern.match(phone):
-            raise ValueError("Phone number must be in the format 555-555-5555.")
-        return phone
+        return Validation.validate_phone(phone)
 
     @staticmethod
     def validate_dob(date_str, field_name):
         # Static method to validate and clean a date of birth field
-        try:
-            datetime.strptime(date_str, "%m-%d-%Y").date()
-            return date_str
-        except ValueError:
-            raise ValueError(f"{field_name} must be a valid date string (MM-DD-YYYY) or 'N/A'.")
+        return Validation.validate_dob(date_str, field_name)
 
     @staticmethod
     def validate_address(address):
         # Static method to validate and clean an address field
-        if not address.strip():
-            raise ValueError("Address must be a non-empty string.")
-        return address
+        return Validation.validate_address(address)
 
     @staticmethod
     def validate_prescription(value):
         # Static method to validate and clean a prescription field
-        if value == "N/A":
-            return None
-        if not value.strip():  # Check for an empty string
-            raise ValueError("Prescription must be entered or 'N/A'.")
-        if not all(char.isalnum() or char in " '-/" for char in value):
-            raise ValueError("Prescription contains invalid characters.")
-        else:
-            return value
+        return Validation.validate_prescription(value)
+
+    @classmethod
+    def from_record(cls, first_name, last_name, dob, phone, address, last_exam, emergent_issue, prescription,
+                    conditions, priority_level):
+        # Rebuild a stored patient without re-running the validators on data that already passed them
+        patient = cls.__new__(cls)
+        patient._flags = 0
+        patient.first_name = intern_text(first_name)
+        patient.last_name = intern_text(last_name)
+        patient.dob = dob
+        patient.phone = intern_text(phone)
+        patient.address = intern_text(address)
+        patient.last_exam = last_exam
+        patient.emergent_issue = emergent_issue
+        patient.prescription = intern_text(prescription)
+        patient.conditions = conditions
+        patient.primary_member = None
+        patient.insurance_info = None
+        patient.next = None
+        patient.prev = None
+        patient.priority_level = priority_level
+        patient.patient_id = None
+        return patient
+
+    def capture(self):
+        # The stored fields exactly as the slots hold them, a tuple cheap enough to take for every patient while
+        # a lock is held; record_of turns it into the fields from_record takes
+        return (self.first_name, self.last_name, self._dob, self.phone, self.address, self._last_exam,
+                self.prescription, self._flags)
+
+    @staticmethod
+    def record_of(captured):
+        # The fields of a captured patient in from_record order, with dates as MM-DD-YYYY strings
+        first_name, last_name, dob, phone, address, last_exam, prescription, flags = captured
+        return [first_name, last_name, ordinal_text(dob) if type(dob) is int else dob, phone, address,
+                ordinal_text(last_exam) if type(last_exam) is int else last_exam, bool(flags & EMERGENT_FLAG),
+                prescription, bool(flags & CONDITIONS_FLAG), flags >> PRIORITY_SHIFT]
+
+    def __getstate__(self):
+        # Pickle without the list links and the patient_id, which only mean something in this process
+        return {name: getattr(self, name) for name in self.__slots__
+                if name not in ("next", "prev", "patient_id") and hasattr(self, name)}
+
+    def __setstate__(self, state):
+        # A patient unpickled from another process (e.g. an import worker) gets an id of its own once inserted
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.next = None
+        self.prev = None
+        self.patient_id = None
+
+    @property
+    def dob(self):
+        # Date of birth as an MM-DD-YYYY string
+        return ordinal_text(self._dob) if type(self._dob) is int else self._dob
+
+    @dob.setter
+    def dob(self, value):
+        self._dob = date_ordinal(value)
+
+    @property
+    def last_exam(self):
+        # Last exam as a date, or "N/A"/None when there has not been one
+        if type(self._last_exam) is int:
+            return date.fromordinal(self._last_exam)
+        return self._last_exam
+
+    @last_exam.setter
+    def last_exam(self, value):
+        self._last_exam = date_ordinal(value)
+
+    @property
+    def dob_ordinal(self):
+        # Date of birth as a day ordinal, or None if it is not a valid date
+        return self._dob if type(self._dob) is int else None
+
+    @property
+    def last_exam_ordinal(self):
+        # Last exam as a day ordinal, or None when there has not been one
+        return self._last_exam if type(self._last_exam) is int else None
+
+    @property
+    def emergent_issue(self):
+        return bool(self._flags & EMERGENT_FLAG)
+
+    @emergent_issue.setter
+    def emergent_issue(self, value):
+        self._flags = self._flags | EMERGENT_FLAG if value else self._flags & ~EMERGENT_FLAG
+
+    @property
+    def conditions(self):
+        return bool(self._flags & CONDITIONS_FLAG)
+
+    @conditions.setter
+    def conditions(self, value):
+        self._flags = self._flags | CONDITIONS_FLAG if value else self._flags & ~CONDITIONS_FLAG
+
+    @property
+    def priority_level(self):
+        return self._flags >> PRIORITY_SHIFT
+
+    @priority_level.setter
+    def priority_level(self, value):
+        self._flags = self._flags & (EMERGENT_FLAG | CONDITIONS_FLAG) | value << PRIORITY_SHIFT
 
     def get_insurance_info(self):
         # Method to retrieve insurance information associated with the patient
@@ -86,82 +279,171 @@ class Patient:
             return None
 
     def calculate_priority(self):
-        current_date = datetime.now().date()
-        one_year_ago = current_date - timedelta(days=365)
-
-        # Convert last_exam from string to datetime object
-        if isinstance(self.last_exam, str):
-            try:
-                last_exam_date = datetime.strptime(self.last_exam, "%m-%d-%Y").date()
-            except ValueError:
-                # Handle invalid date format
-                last_exam_date = None
-        elif isinstance(self.last_exam, datetime):
-            last_exam_date = self.last_exam.date()
-        else:
-            last_exam_date = None
-
-        if self.emergent_issue:
-            return 1  # Priority 1 for emergent issues
-        elif self.conditions and (last_exam_date is None or last_exam_date <= one_year_ago):
-            if last_exam_date is None:
-                self.last_exam = "N/A"
-            return 2  # Priority 2 for medical conditions with last exam over a year ago or no last exam
-        elif not self.conditions and (last_exam_date is None or last_exam_date <= one_year_ago):
-            if last_exam_date is None:
-                self.last_exam = "N/A"
-            return 3  # Priority 3 for no conditions with last exam over a year ago or no last exam
-        else:
-            return 4  # Priority 4 for all others
+        priority_level = compute_priority(self._last_exam, self.conditions, self.emergent_issue)
+        if priority_level in (2, 3) and self.last_exam_ordinal is None:
+            self.last_exam = "N/A"
+        return priority_level
 
 
 class PatientLinkedList:
     def __init__(self):
         self.head = None
+        self.tail = None  # Tail pointer so inserts do not walk the list
+        self.size = 0
+        self.name_index = {}  # Maps (first_name, last_name) to the patients with that name, in list order
+        self.patients = []  # Patient for each patient_id in the list, or None
+        self.patient_keys = []  # Name key each patient is indexed under, by patient_id
+        self.listeners = []  # Objects notified of inserts, edits and deletes (e.g. AppointmentScheduler)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, patient):
+        return slot_value(self.patients, patient.patient_id) is patient
+
+    def __iter__(self):
+        # Walk the list from head to tail
+        current = self.head
+        while current:
+            yield current
+            current = current.next
+
+    def add_listener(self, listener):
+        # Register an object with patient_inserted, patient_updated and patient_deleted hooks
+        self.listeners.append(listener)
 
     def insert_patient(self, new_patient):
-        # Method to insert a new patient into the linked list
+        # Method to insert a new patient at the tail of the linked list
+        new_patient.next = None
+        new_patient.prev = self.tail
         if not self.head:
             self.head = new_patient
         else:
-            current = self.head
-            while current.next:
-                current = current.next
-            current.next = new_patient
+            self.tail.next = new_patient
+        self.tail = new_patient
+        self.size += 1
+        self.index_patient(new_patient)
+        for listener in self.listeners:
+            listener.patient_inserted(new_patient)
 
-    def find_patient(self, first_name, last_name):
-        # Method to find a patient by first and last name
-        current = self.head
-        while current:
-            if current.first_name == first_name and current.last_name == last_name:
-                return current
-            current = current.next
+    def insert_patients(self, new_patients):
+        # Insert many patients at the tail, letting listeners index the whole batch at once
+        new_patients = list(new_patients)
+        for new_patient in new_patients:
+            new_patient.next = None
+            new_patient.prev = self.tail
+            if not self.head:
+                self.head = new_patient
+            else:
+                self.tail.next = new_patient
+            self.tail = new_patient
+            self.index_patient(new_patient)
+        self.size += len(new_patients)
+        for listener in self.listeners:
+            listener.patients_inserted(new_patients)
+
+    def find_patient(self, first_name, last_name, dob=None):
+        # Method to find a patient by first and last name, optionally narrowed by date of birth
+        matches = self.name_index.get((first_name, last_name))
+        if not matches:
+            return None
+        if dob is None:
+            return matches[0]
+        dob = date_ordinal(dob)  # So "1-2-1990", "01-02-1990" and date(1990, 1, 2) all find the same patient
+        for patient in matches:
+            if patient._dob == dob:
+                return patient
         return None
 
-    def delete_patient(self, first_name, last_name):
+    def get_patient(self, patient_id):
+        # The patient with this patient_id, or None
+        return slot_value(self.patients, patient_id)
+
+    def id_limit(self):
+        # Every patient in the list has a patient_id below this
+        return len(self.patients)
+
+    def delete_patient_id(self, patient_id):
+        # Delete the patient with this patient_id
+        patient = self.get_patient(patient_id)
+        if patient is None:
+            return False
+        return self.unlink_patient(patient)
+
+    def delete_patient(self, first_name, last_name, dob=None):
         # Method to delete a patient by first and last name
-        current = self.head
-        previous = None
-        while current:
-            if current.first_name == first_name and current.last_name == last_name:
-                if previous:
-                    previous.next = current.next
-                else:
-                    self.head = current.next
-                return True
-            previous = current
-            current = current.next
-        return False
+        patient = self.find_patient(first_name, last_name, dob)
+        if not patient:
+            return False
+        return self.unlink_patient(patient)
 
     def edit_patient(self, first_name, last_name, **updates):
         # Method to edit patient information by first and last name
         patient = self.find_patient(first_name, last_name)
         if patient:
-            for attribute, new_value in updates.items():
-                setattr(patient, attribute, new_value)
+            self.update_patient(patient, **updates)
             return True
         return False
 
+    def update_patient(self, patient, **updates):
+        # Apply updates to a patient already in the list and re-key it if its name changed
+        for attribute, new_value in updates.items():
+            setattr(patient, attribute, new_value)
+        self.reindex_patient(patient)
+        for listener in self.listeners:
+            listener.patient_updated(patient)
+
+    def unlink_patient(self, patient):
+        # Remove a patient node from the list in constant time
+        if patient not in self:
+            return False
+        if patient.prev:
+            patient.prev.next = patient.next
+        else:
+            self.head = patient.next
+        if patient.next:
+            patient.next.prev = patient.prev
+        else:
+            self.tail = patient.prev
+        patient.next = None
+        patient.prev = None
+        self.size -= 1
+        self.unindex_patient(patient)
+        for listener in self.listeners:
+            listener.patient_deleted(patient)
+        patient_ids.release(patient.patient_id)  # After the listeners, which still look the patient up by id
+        patient.patient_id = None
+        return True
+
+    def index_patient(self, patient):
+        # Add a patient to the name index
+        if patient.patient_id is None:
+            patient.patient_id = patient_ids.allocate()  # New, or deleted earlier and added back
+        key = (patient.first_name, patient.last_name)
+        self.name_index.setdefault(key, []).append(patient)
+        patient_id = patient.patient_id
+        if patient_id >= len(self.patients):  # Both arrays always have the same length
+            grow_slots(self.patients, patient_id)
+            grow_slots(self.patient_keys, patient_id)
+        self.patients[patient_id] = patient
+        self.patient_keys[patient_id] = key
+
+    def unindex_patient(self, patient):
+        # Remove a patient from the name index
+        key = self.patient_keys[patient.patient_id]
+        self.patients[patient.patient_id] = None
+        self.patient_keys[patient.patient_id] = None
+        matches = self.name_index[key]
+        matches.remove(patient)
+        if not matches:
+            del self.name_index[key]
+
+    def reindex_patient(self, patient):
+        # Move a patient to its new name key after its name was edited
+        if self.patient_keys[patient.patient_id] != (patient.first_name, patient.last_name):
+            self.unindex_patient(patient)
+            self.index_patient(patient)
+
     def print_list(self):
         # Method to print the list of patients with their information
         current = self.head
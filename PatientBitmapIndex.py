@@ -0,0 +1,244 @@
+import re
+
+from Patient import slot_value
+
+try:
+    import numpy
+except ImportError:  # Without NumPy the set bits are found one nonzero byte at a time instead
+    numpy = None
+
+# Fields with a bitmap per value; the insurance fields are read from the family's insurance
+FIELDS = ("emergent_issue", "conditions", "priority_level", "provider_name", "vision_coverage", "medical_coverage")
+# Filters answered from another field's bitmaps: due for a routine exam means ranked 2 or 3
+DERIVED = {"overdue": ("priority_level", {True: (2, 3), False: (1, 4)})}
+UNSET = object()  # Old value of each field for a patient that was not indexed yet
+NOT_INDEXED = (UNSET,) * len(FIELDS)
+NONZERO_BYTE = re.compile(rb"[^\x00]")
+BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]  # Set bits of each byte
+
+
+class Bitmap:
+    __slots__ = ("bits", "number")
+
+    def __init__(self):
+        # One bit per patient_id, set in place in a bytearray; queries combine the bitmaps as Python ints, which
+        # AND and OR a million bits in a few microseconds, converted again only after a change
+        self.bits = bytearray()
+        self.number = 0
+
+    def add(self, patient_id):
+        index = patient_id >> 3
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index + 1 - len(self.bits)))
+        self.bits[index] |= 1 << (patient_id & 7)
+        self.number = None
+
+    def add_many(self, patient_ids):
+        # Set many bits, growing the bytearray once
+        if patient_ids:
+            last = max(patient_ids) >> 3
+            if last >= len(self.bits):
+                self.bits.extend(bytes(last + 1 - len(self.bits)))
+            bits = self.bits
+            for patient_id in patient_ids:
+                bits[patient_id >> 3] |= 1 << (patient_id & 7)
+            self.number = None
+
+    def discard(self, patient_id):
+        self.bits[patient_id >> 3] &= ~(1 << (patient_id & 7))
+        self.number = None
+
+    def to_int(self):
+        if self.number is None:
+            self.number = int.from_bytes(self.bits, "little")
+        return self.number
+
+
+def bit_positions(number, limit=None):
+    # The positions of the set bits of a non-negative int, lowest first
+    data = number.to_bytes((number.bit_length() + 7) // 8, "little")
+    if numpy is not None:
+        positions = numpy.flatnonzero(numpy.unpackbits(numpy.frombuffer(data, numpy.uint8), bitorder="little"))
+        return positions[:limit].tolist()
+    positions = []
+    for match in NONZERO_BYTE.finditer(data):
+        start = match.start() * 8
+        positions += [start + bit for bit in BYTE_BITS[data[match.start()]]]
+        if limit is not None and len(positions) >= limit:
+            return positions[:limit]
+    return positions
+
+
+class PatientBitmapIndex:
+    def __init__(self, patient_list, family_tree):
+        # Bitmaps over patient_ids for the yes/no and few-valued fields, so a filter such as
+        # query(conditions=True, overdue=True, provider_name="VSP", vision_coverage=False) is a handful of
+        # bitwise ANDs instead of a walk over every patient; attach with patient_list.add_listener(index) and
+        # family_tree.add_listener(index), since a dependent's insurance fields come from their family
+        self.patient_list = patient_list
+        self.family_tree = family_tree
+        self.members = Bitmap()  # Every indexed patient
+        self.bitmaps = {field: {} for field in FIELDS}  # Maps field to {value: Bitmap}
+        self.values = []  # Indexed field values of each patient by patient_id, or None
+        self.combinations = {}  # The distinct tuples of field values, of which there are only a few hundred
+
+    def __len__(self):
+        return self.members.to_int().bit_count()
+
+    def field_values(self, patient):
+        # The patient's value for each field, as a tuple shared by every patient with the same values
+        insurance_info = self.family_tree.effective_insurance(patient)
+        if insurance_info is None:
+            values = (patient.emergent_issue, patient.conditions, patient.priority_level, None, False, False)
+        else:
+            values = (patient.emergent_issue, patient.conditions, patient.priority_level,
+                      insurance_info.provider_name, bool(insurance_info.vision_coverage),
+                      bool(insurance_info.medical_coverage))
+        return self.combinations.setdefault(values, values)
+
+    def add_patient(self, patient):
+        # Set the patient's bit in the bitmap of each of its values, or move it if it was indexed already
+        patient_id = patient.patient_id
+        old_values = slot_value(self.values, patient_id)
+        new_values = self.field_values(patient)
+        if old_values is new_values:
+            return
+        if old_values is None:
+            if patient_id >= len(self.values):
+                self.values.extend([None] * (patient_id + 1 - len(self.values)))
+            self.members.add(patient_id)
+            old_values = NOT_INDEXED
+        for field, old_value, new_value in zip(FIELDS, old_values, new_values):
+            if old_value == new_value:
+                continue
+            bitmaps = self.bitmaps[field]
+            if old_value is not UNSET:
+                bitmaps[old_value].discard(patient_id)
+            bitmap = bitmaps.get(new_value)
+            if bitmap is None:
+                bitmap = bitmaps[new_value] = Bitmap()
+            bitmap.add(patient_id)
+        self.values[patient_id] = new_values
+
+    def add_patients(self, patients):
+        # Index a batch of patients, grouping the new ones by their tuple of values so each bitmap is filled once
+        groups = {}  # Maps a tuple of values to the new patient_ids that have it
+        values = self.values
+        for patient in patients:
+            patient_id = patient.patient_id
+            if patient_id >= len(values):
+                values.extend([None] * (patient_id + 1 - len(values)))
+            elif values[patient_id] is not None:
+                self.add_patient(patient)
+                continue
+            values[patient_id] = combination = self.field_values(patient)
+            groups.setdefault(combination, []).append(patient_id)
+        by_value = {}  # Maps (field, value) to the new patient_ids that have it
+        for combination, patient_ids in groups.items():
+            self.members.add_many(patient_ids)
+            for field_value in zip(FIELDS, combination):
+                by_value.setdefault(field_value, []).extend(patient_ids)
+        for (field, value), patient_ids in by_value.items():
+            bitmap = self.bitmaps[field].get(value)
+            if bitmap is None:
+                bitmap = self.bitmaps[field][value] = Bitmap()
+            bitmap.add_many(patient_ids)
+
+    def remove_patient(self, patient):
+        # Clear the patient's bits
+        patient_id = patient.patient_id
+        old_values = slot_value(self.values, patient_id)
+        if old_values is None:
+            return False
+        for field, old_value in zip(FIELDS, old_values):
+            self.bitmaps[field][old_value].discard(patient_id)
+        self.members.discard(patient_id)
+        self.values[patient_id] = None
+        return True
+
+    def refresh_patient(self, patient):
+        # Re-read a patient whose family or insurance changed, if it is indexed
+        if slot_value(self.values, patient.patient_id) is not None:
+            self.add_patient(patient)
+
+    def match(self, **filters):
+        # The patients matching every filter, as an int with bit patient_id set for each; a filter value may be
+        # a single value or a tuple, list or set of values any of which matches
+        if not filters:
+            return self.members.to_int()
+        result = None
+        for field, wanted in filters.items():
+            if field in DERIVED:
+                field, meanings = DERIVED[field]
+                wanted = meanings[bool(wanted)]
+            bitmaps = self.bitmaps.get(field)
+            if bitmaps is None:
+                raise ValueError(f"Cannot filter on {field}.")
+            if not isinstance(wanted, (tuple, list, set, frozenset)):
+                wanted = (wanted,)
+            matches = 0
+            for value in wanted:
+                bitmap = bitmaps.get(value)
+                if bitmap is not None:
+                    matches |= bitmap.to_int()
+            result = matches if result is None else result & matches
+        return result
+
+    def count(self, **filters):
+        # How many patients match the filters
+        return self.match(**filters).bit_count()
+
+    def count_by(self, field, **filters):
+        # {value: number of matching patients} for each value of a field, e.g. matches per provider
+        if field not in self.bitmaps:
+            raise ValueError(f"Cannot group by {field}.")
+        matches = self.match(**filters)
+        counts = {value: (matches & bitmap.to_int()).bit_count() for value, bitmap in self.bitmaps[field].items()}
+        return {value: count for value, count in counts.items() if count}
+
+    def patient_ids(self, limit=None, **filters):
+        # The patient_ids matching the filters in increasing order, at most limit of them
+        return bit_positions(self.match(**filters), limit)
+
+    def patients(self, limit=None, **filters):
+        # The patients matching the filters, in patient_id order
+        return [self.patient_list.get_patient(patient_id) for patient_id in self.patient_ids(limit, **filters)]
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        self.add_patient(patient)
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        self.add_patients(patients)
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited or re-ranked
+        self.add_patient(patient)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        self.remove_patient(patient)
+
+    def family_added(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family is added
+        self.refresh_patient(family_node.patient)
+
+    def member_added(self, family_node, member_node):
+        # Listener hook called by InsuranceFamilyTree when a member joins a family
+        self.refresh_patient(member_node.patient)
+
+    def insurance_changed(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family's insurance is replaced
+        self.refresh_patient(family_node.patient)
+        for member_node in family_node.children:
+            self.refresh_patient(member_node.patient)
+
+    def family_removed(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family is taken out of the tree; members still in
+        # the list fall back to their own insurance
+        self.insurance_changed(family_node)
+
+    def member_removed(self, family_node, member_node):
+        # Listener hook called by InsuranceFamilyTree when a dependent leaves their family
+        self.refresh_patient(member_node.patient)
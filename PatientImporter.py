@@ -0,0 +1,213 @@
+import csv
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import Validation
+from Patient import Patient
+from InsuranceInformation import InsuranceInformation
+
+TRUE_VALUES = {"true", "yes", "y", "1"}
+FALSE_VALUES = {"false", "no", "n", "0", ""}
+
+
+class ImportResult:
+    def __init__(self):
+        # Totals and per-row problems collected while importing
+        self.imported = 0
+        self.families = 0
+        self.errors = []  # (line number, message) pairs for the rows that were skipped
+
+    def add_error(self, line_number, message):
+        self.errors.append((line_number, message))
+
+
+def parse_bool(value):
+    # Read a yes/no column; JSON booleans pass straight through
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"'{value}' is not a yes/no value.")
+
+
+def read_records(path):
+    # Yield (line number, record) pairs from a CSV file with a header row or a JSON Lines file, one row at a time
+    with open(path, newline="") as source:
+        if path.endswith((".jsonl", ".json")):
+            for line_number, line in enumerate(source, 1):
+                if line.strip():
+                    yield line_number, line
+        else:
+            reader = csv.DictReader(source)
+            for record in reader:
+                yield reader.line_num, record
+
+
+PATIENT_FIELDS = ("first_name", "last_name", "dob", "phone", "address", "last_exam", "prescription")
+INSURANCE_FIELDS = ("provider_name", "policy_number", "copay")
+
+
+def read_row(record):
+    # Pull one row's fields into (family id, is primary, flags, {field: text}), raising for a bad family id or
+    # yes/no column; the text fields are checked a whole chunk at a time by validate_chunk
+    if isinstance(record, str):
+        record = json.loads(record)
+    family_id = str(record.get("family_id", "")).strip()
+    if not family_id:
+        raise ValueError("Family ID must be entered.")
+    is_primary = str(record.get("relationship", "primary")).strip().lower() == "primary"
+    flags = (parse_bool(record.get("emergent_issue", False)), parse_bool(record.get("conditions", False)),
+             parse_bool(record.get("vision_coverage", False)), parse_bool(record.get("medical_coverage", False)))
+    fields = {"first_name": record.get("first_name", ""), "last_name": record.get("last_name", ""),
+              "dob": record.get("dob", ""), "phone": record.get("phone", ""), "address": record.get("address", ""),
+              "last_exam": record.get("last_exam") or "N/A", "prescription": record.get("prescription") or "N/A"}
+    if is_primary:
+        fields["provider_name"] = record.get("provider_name") or "N/A"
+        fields["policy_number"] = record.get("policy_number") or "N/A"
+        fields["copay"] = str(record.get("copay", "")).strip() or "N/A"
+    return family_id, is_primary, flags, fields
+
+
+def build_record(row):
+    # Turn a row that passed validation into (family id, is primary, Patient, InsuranceInformation or None)
+    # without running the validators again
+    family_id, is_primary, (emergent_issue, conditions, vision_coverage, medical_coverage), fields = row
+    first_name = fields["first_name"]
+    last_name = fields["last_name"]
+    patient = Patient.from_record(first_name, last_name, fields["dob"], fields["phone"], fields["address"],
+                                  Validation.validate_date(fields["last_exam"], "Last Exam"), emergent_issue,
+                                  fields["prescription"], conditions, 0)
+    patient.priority_level = patient.calculate_priority()  # Also turns a missing last exam into "N/A"
+    insurance = None
+    if is_primary:
+        copay = fields["copay"]
+        insurance = InsuranceInformation.from_record(f"{first_name} {last_name}",
+                                                     not_applicable(fields["provider_name"]),
+                                                     not_applicable(fields["policy_number"]), vision_coverage,
+                                                     medical_coverage, int(copay) if copay != "N/A" else None)
+    return family_id, is_primary, patient, insurance
+
+
+def not_applicable(value):
+    # None for an optional field entered as "N/A", as the optional-field validators return it
+    return None if value == "N/A" else value
+
+
+def validate_chunk(chunk):
+    # Validate a chunk of rows, returning (line number, built record or None, error message or None) for each.
+    # Each text field is checked down the whole chunk with Validation.validate_many, and only the rows that
+    # passed are built into patients.
+    results = []
+    rows = []  # (index in results, row) for the rows whose family id and yes/no columns were readable
+    for line_number, record in chunk:
+        try:
+            rows.append((len(results), read_row(record)))
+            results.append((line_number, None, None))
+        except (ValueError, TypeError, AttributeError) as error:
+            results.append((line_number, None, str(error)))
+    errors = Validation.first_errors(Validation.validate_many([row[3] for _, row in rows], PATIENT_FIELDS), len(rows))
+    primaries = [position for position, (_, row) in enumerate(rows) if row[1] and errors[position] is None]
+    insurance_errors = Validation.validate_many([rows[position][1][3] for position in primaries], INSURANCE_FIELDS)
+    for position, error in zip(primaries, Validation.first_errors(insurance_errors, len(primaries))):
+        errors[position] = error
+    for (index, row), error in zip(rows, errors):
+        line_number = results[index][0]
+        results[index] = (line_number, None, error) if error else (line_number, build_record(row), None)
+    return results
+
+
+def chunked(records, chunk_size):
+    # Group an iterator of rows into lists of chunk_size rows
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def validated_chunks(records, chunk_size, workers):
+    # Yield validated chunks in file order, in this process or across a pool with a bounded number in flight
+    if not workers:
+        for chunk in chunked(records, chunk_size):
+            yield validate_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk in chunked(records, chunk_size):
+            in_flight.append(pool.submit(validate_chunk, chunk))
+            if len(in_flight) >= workers * 2:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class PatientImport:
+    def __init__(self, patient_list, family_tree):
+        # Adds validated chunks to the patient list and family tree one at a time, so a caller can apply them
+        # as they arrive (e.g. on the Tk main thread while a worker validates the rest of the file)
+        self.patient_list = patient_list
+        self.family_tree = family_tree
+        self.result = ImportResult()
+        self.family_nodes = {}  # Maps family id to the family node created for it
+        self.waiting = {}  # (line number, dependent) pairs seen before their primary member, by family id; they
+        # are only inserted once the family exists
+        self.primaries = set()  # Family ids whose primary member has been accepted
+
+    def add_chunk(self, chunk):
+        # Insert the valid rows of one chunk from validated_chunks and record the rest as errors; a dependent
+        # whose primary member has not been seen yet waits outside the list until the family exists
+        result = self.result
+        primaries = []
+        dependents = []  # (family id, dependent) pairs whose family has its primary member by the end of the chunk
+        held = []  # (line number, family id, dependent) for the other dependents
+        for line_number, built, error in chunk:
+            if error:
+                result.add_error(line_number, error)
+                continue
+            family_id, is_primary, patient, _ = built
+            if not is_primary:
+                held.append((line_number, family_id, patient))
+            elif family_id in self.primaries:
+                result.add_error(line_number, f"Family {family_id} already has a primary member.")
+            else:
+                self.primaries.add(family_id)
+                primaries.append(built)
+                dependents += [(family_id, dependent) for _, dependent in self.waiting.pop(family_id, ())]
+        for line_number, family_id, patient in held:
+            if family_id in self.primaries:
+                dependents.append((family_id, patient))
+            else:
+                self.waiting.setdefault(family_id, []).append((line_number, patient))
+        self.patient_list.insert_patients([built[2] for built in primaries] + [patient for _, patient in dependents])
+        result.imported += len(primaries) + len(dependents)
+
+        for family_id, _, patient, insurance in primaries:
+            self.family_nodes[family_id] = self.family_tree.add_family(patient, insurance)
+            result.families += 1
+        for family_id, dependent in dependents:
+            self.family_tree.add_family_member(self.family_nodes[family_id], dependent)
+
+    def finish(self):
+        # Report the dependents whose family never got a primary member, which were never inserted, and return
+        # the totals
+        for family_id, dependents in self.waiting.items():
+            for line_number, dependent in dependents:
+                self.result.add_error(line_number, f"{dependent.first_name} {dependent.last_name} was not "
+                                                   f"imported: family {family_id} has no primary member.")
+        self.waiting = {}
+        return self.result
+
+
+def import_patients(path, patient_list, family_tree, workers=0, chunk_size=1000):
+    # Stream a CSV or JSON Lines export into the patient list and family tree, skipping and reporting bad rows.
+    # Rows need a family_id; the row with relationship "primary" founds the family and carries its insurance.
+    patient_import = PatientImport(patient_list, family_tree)
+    for chunk in validated_chunks(read_records(path), chunk_size, workers):
+        patient_import.add_chunk(chunk)
+    return patient_import.finish()
@@ -0,0 +1,298 @@
+import heapq
+from bisect import bisect_left, insort
+from collections import Counter
+
+from Patient import grow_slots, slot_value
+
+WORD_CACHE_SIZE = 1024  # Query words kept matched; type-ahead repeats the leading words on every keystroke
+FILTER_CACHE_SIZE = 64  # Query words whose matching patients are kept as a set
+
+
+def normalize_name(text):
+    # Lowercase and collapse whitespace so "  SMITH  john" and "smith john" index the same way
+    return " ".join(text.lower().split())
+
+
+def trigrams(text, pad_end=True):
+    # Split text into overlapping three-character grams, padded so word starts (and ends) count too
+    padded = f"  {text} " if pad_end else f"  {text}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def allowed_edits(text):
+    # Short words tolerate no typos, medium words one, long words two
+    return 0 if len(text) < 3 else 1 if len(text) < 6 else 2
+
+
+def bounded_edit_distance(a, b, limit):
+    # Levenshtein distance between a and b, or limit + 1 as soon as it is known to exceed limit;
+    # only the diagonal band of width 2 * limit + 1 can stay within the limit, so nothing else is computed
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if a == b:
+        return 0
+    # A shared start or end never costs an edit, so only the differing middle goes through the table
+    start = 0
+    shortest = min(len(a), len(b))
+    while start < shortest and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    if not a or not b:
+        return len(a) + len(b)
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [over] * (len(b) + 1)
+        current[0] = row_min = i if i <= limit else over
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = previous[j - 1] + (char_a != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+
+class PatientSearchIndex:
+    def __init__(self):
+        # Prefix and typo-tolerant name search over the patients in the linked list
+        self.terms = []  # Sorted (term, sequence) pairs; each patient is indexed as "first last" and "last first"
+        self.patients = {}  # Maps sequence to patient
+        self.sequences = []  # Sequence number of each patient by patient_id, or None
+        self.names = {}  # Maps sequence to the normalized (full name, reversed name)
+        self.tokens = {}  # Maps each name word to the set of sequences using it
+        self.vocabulary = []  # Sorted distinct name words
+        self.grams = {}  # Maps trigram to the set of name words containing it
+        self.word_matches = {}  # Maps (query word, is_prefix) to match_word's result until the vocabulary changes
+        self.word_patients = {}  # Maps (query word, is_prefix) to the sequences it matches until any patient changes
+        self.sequence = 0
+
+    def __len__(self):
+        return len(self.patients)
+
+    def add_patient(self, patient):
+        # Index a patient's name for prefix and fuzzy matching
+        self.add_patients((patient,))
+
+    def add_patients(self, patients):
+        # Index many patients, sorting the new prefix terms into place in one pass instead of one insert each
+        new_terms = []
+        for patient in patients:
+            new_terms += self.index_names(patient)
+        if len(new_terms) * 8 < len(self.terms):
+            for term in new_terms:
+                insort(self.terms, term)
+        else:
+            self.terms += new_terms
+            self.terms.sort()
+
+    def index_names(self, patient):
+        # Record a patient's names and words, returning the prefix terms still to be placed
+        sequence = self.sequence
+        self.sequence += 1
+        first_name = normalize_name(patient.first_name)
+        last_name = normalize_name(patient.last_name)
+        full_name = f"{first_name} {last_name}"
+        reversed_name = f"{last_name} {first_name}"
+        self.patients[sequence] = patient
+        self.word_patients.clear()
+        grow_slots(self.sequences, patient.patient_id)
+        self.sequences[patient.patient_id] = sequence
+        self.names[sequence] = (full_name, reversed_name)
+        for token in full_name.split():
+            users = self.tokens.get(token)
+            if users is None:
+                users = self.tokens[token] = set()
+                insort(self.vocabulary, token)
+                self.word_matches.clear()
+                for gram in trigrams(token):
+                    self.grams.setdefault(gram, set()).add(token)
+            users.add(sequence)
+        return [(full_name, sequence), (reversed_name, sequence)]
+
+    def remove_patient(self, patient):
+        # Drop a patient from every index
+        sequence = slot_value(self.sequences, patient.patient_id)
+        if sequence is None:
+            return False
+        self.sequences[patient.patient_id] = None
+        self.word_patients.clear()
+        full_name, reversed_name = self.names.pop(sequence)
+        del self.patients[sequence]
+        for term in (full_name, reversed_name):
+            del self.terms[bisect_left(self.terms, (term, sequence))]
+        for token in full_name.split():
+            users = self.tokens[token]
+            users.discard(sequence)
+            if not users:
+                del self.tokens[token]
+                del self.vocabulary[bisect_left(self.vocabulary, token)]
+                self.word_matches.clear()
+                for gram in trigrams(token):
+                    words = self.grams[gram]
+                    words.discard(token)
+                    if not words:
+                        del self.grams[gram]
+        return True
+
+    def prefix_matches(self, query, limit):
+        # Sequences whose "first last" or "last first" name starts with query, in name order
+        found = []
+        index = bisect_left(self.terms, (query,))
+        while index < len(self.terms) and len(found) < limit:
+            term, sequence = self.terms[index]
+            if not term.startswith(query):
+                break
+            if sequence not in found:
+                found.append(sequence)
+            index += 1
+        return found
+
+    def cached_match_word(self, word, is_prefix):
+        # match_word, remembered until a name word is added or removed
+        key = (word, is_prefix)
+        matches = self.word_matches.get(key)
+        if matches is None:
+            if len(self.word_matches) >= WORD_CACHE_SIZE:
+                self.word_matches.clear()
+            matches = self.word_matches[key] = self.match_word(word, is_prefix)
+        return matches
+
+    def matching_patients(self, word, is_prefix):
+        # The set of sequences with a name word matching word, remembered until a patient is added or removed
+        key = (word, is_prefix)
+        patients = self.word_patients.get(key)
+        if patients is None:
+            if len(self.word_patients) >= FILTER_CACHE_SIZE:
+                self.word_patients.clear()
+            matches = self.cached_match_word(word, is_prefix)
+            patients = self.word_patients[key] = set().union(*map(self.tokens.__getitem__, matches))
+        return patients
+
+    def match_word(self, word, is_prefix, max_words=500, max_checks=32):
+        # Map name words to their edit distance from word; a prefix word only has to match their start
+        matches = {}
+        if is_prefix:
+            index = bisect_left(self.vocabulary, word)
+            while index < len(self.vocabulary) and len(matches) < max_words:
+                token = self.vocabulary[index]
+                if not token.startswith(word):
+                    break
+                matches[token] = 0
+                index += 1
+        elif word in self.tokens:
+            matches[word] = 0
+
+        max_edits = allowed_edits(word)
+        if max_edits:
+            # Words within k edits share all but about 3k of the query's grams, so only the words sharing the
+            # most grams are worth an edit-distance check
+            grams = trigrams(word, pad_end=not is_prefix)
+            counts = Counter()
+            for gram in grams:
+                counts.update(self.grams.get(gram, ()))
+            threshold = max(1, len(grams) - 3 * max_edits)
+            candidates = heapq.nlargest(max_checks + len(matches), counts, key=counts.get)
+            candidates = [token for token in candidates if counts[token] >= threshold and token not in matches]
+            for token in candidates[:max_checks]:
+                distance = bounded_edit_distance(word, token[:len(word)] if is_prefix else token, max_edits)
+                if distance <= max_edits:
+                    matches[token] = distance
+        return matches
+
+    def fuzzy_matches(self, query, limit, exclude, max_candidates=200, max_filter=20000):
+        # Sequences whose name words match every query word within a few edits, ranked by total distance; at
+        # most max_candidates patients are checked, so a keystroke stays under about a millisecond
+        words = query.split()
+        word_matches = [self.cached_match_word(word, index == len(words) - 1) for index, word in enumerate(words)]
+        if not all(word_matches):
+            return []
+
+        # Walk the patients of the most selective query word, closest words first, and check the other words
+        # against their names; matches can only total at least the distance of the word being walked, so the
+        # walk stops once limit matches are known to rank ahead of anything still to come. The patients of any
+        # other word matching at most max_filter of them are gathered into a set first, so set intersections
+        # drop the non-matches before the candidate budget is spent on them
+        sizes = [sum(map(len, map(self.tokens.__getitem__, matches))) for matches in word_matches]
+        pivot = min(range(len(words)), key=sizes.__getitem__)
+        others = word_matches[:pivot] + word_matches[pivot + 1:]
+        filters = [self.matching_patients(word, index == len(words) - 1) for index, word in enumerate(words)
+                   if index != pivot and sizes[index] <= max_filter]
+        ranked = []
+        totals = {}  # Number of matches found at each total distance
+        checked = set(exclude)  # A patient with two matching words is reached twice
+        budget = max_candidates
+        for token in sorted(word_matches[pivot], key=word_matches[pivot].get):
+            base = word_matches[pivot][token]
+            if sum(count for total, count in totals.items() if total <= base) >= limit:
+                break
+            candidates = self.tokens[token]
+            for patients in filters:
+                candidates = candidates & patients
+            for sequence in candidates:
+                if sequence in checked:
+                    continue
+                checked.add(sequence)
+                budget -= 1
+                names = self.names[sequence][0].split()
+                total = base
+                for matches in others:
+                    best = None
+                    for name in names:
+                        distance = matches.get(name)
+                        if distance is not None and (best is None or distance < best):
+                            best = distance
+                    if best is None:
+                        break
+                    total += best
+                else:
+                    ranked.append((total, self.names[sequence][0], sequence))
+                    totals[total] = totals.get(total, 0) + 1
+                    if total == base and sum(count for total, count in totals.items() if total <= base) >= limit:
+                        budget = 0
+                if not budget:
+                    break
+            if not budget:
+                break
+        ranked.sort()
+        return [sequence for _, _, sequence in ranked[:limit]]
+
+    def search(self, query, limit=10):
+        # Return up to limit patients: exact prefix matches first, then close misspellings
+        query = normalize_name(query)
+        if not query:
+            return []
+        found = self.prefix_matches(query, limit)
+        if len(found) < limit:
+            found += self.fuzzy_matches(query, limit - len(found), set(found))
+        return [self.patients[sequence] for sequence in found]
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        self.add_patient(patient)
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        self.add_patients(patients)
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited; only renames are re-indexed
+        sequence = slot_value(self.sequences, patient.patient_id)
+        full_name = f"{normalize_name(patient.first_name)} {normalize_name(patient.last_name)}"
+        if sequence is not None and self.names[sequence][0] != full_name:
+            self.remove_patient(patient)
+            self.add_patient(patient)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        self.remove_patient(patient)
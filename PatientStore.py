@@ -0,0 +1,346 @@
+import gc
+import json
+import os
+import time
+from datetime import date
+
+from Patient import Patient, ordinal_text
+from Validation import parse_date
+from InsuranceInformation import InsuranceInformation
+
+
+def encode_date(value):
+    # Store dates as MM-DD-YYYY strings; strings, "N/A" and None are kept as they are
+    if isinstance(value, date):
+        return ordinal_text(value.toordinal())
+    return value
+
+
+def decode_date(value):
+    # Turn a stored MM-DD-YYYY string back into a date, the way Patient.validate_date produces it
+    if not isinstance(value, str) or value == "N/A":
+        return value
+    try:
+        return parse_date(value)
+    except ValueError:
+        return value
+
+
+def encode_patient(patient):
+    # Flatten a patient into a JSON-friendly list
+    return Patient.record_of(patient.capture())
+
+
+def decode_patient(fields):
+    # Rebuild a patient from the list written by encode_patient
+    first_name, last_name, dob, phone, address, last_exam, emergent_issue, prescription, conditions, priority = fields
+    return Patient.from_record(first_name, last_name, dob, phone, address, decode_date(last_exam), emergent_issue,
+                               prescription, conditions, priority)
+
+
+def encode_insurance(insurance_info):
+    # Flatten insurance information into a JSON-friendly list
+    if insurance_info is None:
+        return None
+    return [insurance_info.primary_name, insurance_info.provider_name, insurance_info.policy_number,
+            insurance_info.vision_coverage, insurance_info.medical_coverage, insurance_info.copay]
+
+
+def decode_insurance(fields):
+    # Rebuild insurance information from the list written by encode_insurance
+    return InsuranceInformation.from_record(*fields) if fields is not None else None
+
+
+class PatientStore:
+    def __init__(self, directory, sync_every=100, sync_interval=1.0, compact_every=50000):
+        # Durable storage for the patient list and family tree: a compacted snapshot plus an append-only journal
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.sync_every = sync_every  # fsync after this many journal records...
+        self.sync_interval = sync_interval  # ...or once this many seconds have passed since the last fsync
+        self.compact_every = compact_every  # Minimum journal length before a fresh snapshot is written
+        self.patient_list = None
+        self.family_tree = None
+        self.record_ids = {}  # Maps patient_id to the patient's record id
+        self.patients = {}  # Maps record id to patient
+        self.next_id = 0
+        self.generation = 0  # Journal generation; each compaction starts a new journal file
+        self.compacting = False  # A snapshot is being written out and no other compaction may start
+        self.journal = None
+        self.journal_records = 0
+        self.journal_end = 0  # Byte offset just past the last complete record read back from the journal
+        self.pending = 0  # Records written since the last fsync
+        self.last_sync = time.monotonic()
+
+    def snapshot_path(self):
+        return os.path.join(self.directory, "snapshot.json")
+
+    def journal_path(self, generation):
+        return os.path.join(self.directory, f"journal.{generation}.log")
+
+    def load(self, patient_list, family_tree):
+        # Load the latest snapshot, replay the journals written since, then start recording changes
+        self.patient_list = patient_list
+        self.family_tree = family_tree
+        # Loading creates millions of objects that all stay alive, so cyclic garbage collection passes during
+        # the load would only rescan them over and over; applications can gc.freeze() once they have started
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.load_snapshot()
+            # A crash while a compaction was writing its snapshot leaves the next generation's journal
+            # continuing this one, so every journal from the snapshot on is replayed in turn
+            while True:
+                for record in self.read_journal(self.generation):
+                    self.apply(record)
+                    self.journal_records += 1
+                if not os.path.exists(self.journal_path(self.generation + 1)):
+                    break
+                self.generation += 1
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        # Cut off a torn record left by a crash, or new records would be appended to the fragment and be lost
+        # along with it on the next load
+        path = self.journal_path(self.generation)
+        if os.path.exists(path) and os.path.getsize(path) > self.journal_end:
+            os.truncate(path, self.journal_end)
+        self.journal = open(path, "a")
+        patient_list.add_listener(self)
+        family_tree.add_listener(self)
+
+    def load_snapshot(self):
+        # Bulk load the latest snapshot, if there is one
+        if os.path.exists(self.snapshot_path()):
+            with open(self.snapshot_path()) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            self.generation = snapshot["generation"]
+            self.next_id = snapshot["next_id"]
+            columns = snapshot["patients"]
+            if columns:
+                record_ids, first_names, last_names, dobs, phones, addresses, last_exams, emergent_issues, \
+                    prescriptions, conditions, priority_levels = columns
+                # Snapshots repeat the same few thousand exam dates, so each one is only parsed once
+                exam_dates = {value: decode_date(value) for value in set(last_exams)}
+                patients = list(map(Patient.from_record, first_names, last_names, dobs, phones, addresses,
+                                    [exam_dates[value] for value in last_exams], emergent_issues, prescriptions,
+                                    conditions, priority_levels))
+                self.patient_list.insert_patients(patients)  # Gives each patient its patient_id
+                self.patients = dict(zip(record_ids, patients))
+                self.record_ids = {patient.patient_id: record_id for record_id, patient in self.patients.items()}
+            add_family = self.family_tree.add_family
+            add_family_member = self.family_tree.add_family_member
+            for primary_id, insurance, member_ids in snapshot["families"]:
+                family_node = add_family(self.patients[primary_id], decode_insurance(insurance))
+                for member_id in member_ids:
+                    add_family_member(family_node, self.patients[member_id])
+
+    def read_journal(self, generation):
+        # Yield the records of a journal file, stopping at a torn final line left by a crash; journal_end is
+        # left just past the last complete line
+        self.journal_end = 0
+        path = self.journal_path(generation)
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as journal_file:
+            for line in journal_file:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.journal_end += len(line)
+                yield record
+
+    def apply(self, record):
+        # Replay one journal record against the patient list and family tree
+        op = record["op"]
+        if op != "insert" and not all(record[key] in self.patients for key in ("id", "family") if key in record):
+            return  # The patient was already gone when the snapshot was taken, so there is nothing left to change
+        if op == "insert":
+            patient = decode_patient(record["patient"])
+            self.patient_list.insert_patient(patient)
+            self.register(record["id"], patient)
+            self.next_id = max(self.next_id, record["id"] + 1)
+        elif op == "update":
+            updates = dict(zip(("first_name", "last_name", "dob", "phone", "address", "last_exam", "emergent_issue",
+                                "prescription", "conditions", "priority_level"), record["patient"]))
+            updates["last_exam"] = decode_date(updates["last_exam"])
+            self.patient_list.update_patient(self.patients[record["id"]], **updates)
+        elif op == "delete":
+            patient = self.patients[record["id"]]
+            self.family_tree.remove_patient(patient)
+            self.unregister(record["id"])  # While the patient still has its patient_id
+            self.patient_list.unlink_patient(patient)
+        elif op == "family":
+            primary = self.patients[record["id"]]
+            self.family_tree.add_family(primary, decode_insurance(record["insurance"]))
+        elif op == "member":
+            family_node = self.family_tree.family_of(self.patients[record["family"]])
+            self.family_tree.add_family_member(family_node, self.patients[record["id"]])
+        elif op == "insurance":
+            family_node = self.family_tree.family_of(self.patients[record["id"]])
+            self.family_tree.set_family_insurance(family_node, decode_insurance(record["insurance"]))
+        elif op == "detach":
+            self.family_tree.remove_patient(self.patients[record["id"]])
+
+    def register(self, record_id, patient):
+        self.record_ids[patient.patient_id] = record_id
+        self.patients[record_id] = patient
+
+    def unregister(self, record_id):
+        patient = self.patients.pop(record_id)
+        del self.record_ids[patient.patient_id]
+
+    def write(self, record):
+        # Append a record to the journal, syncing in batches. Never compacts: a single change can write several
+        # records (a detach, then the delete), and a snapshot taken between them would not match the journal
+        self.journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.journal_records += 1
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.flush()
+
+    def flush(self):
+        # fsync the records written since the last flush
+        if self.pending:
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def sync(self, defer_compaction=False):
+        # Flush the journal to disk and compact it if it has grown too long; only call this between changes.
+        # With defer_compaction, a compaction that falls due is only started and returned, for the caller to
+        # finish with write_snapshot once it has released whatever lock keeps changes out
+        if self.journal is None:
+            return None
+        self.flush()
+        # Compacting only once the journal outgrows the snapshot keeps the rewrite cost linear overall
+        if self.compacting or self.journal_records < max(self.compact_every, len(self.patient_list)):
+            return None
+        if defer_compaction:
+            return self.start_compaction()
+        self.compact()
+        return None
+
+    def compact(self):
+        # Write a snapshot of the current state and start an empty journal for the next generation
+        self.write_snapshot(self.start_compaction())
+
+    def start_compaction(self):
+        # Capture the current state as a snapshot of the next generation and switch to that generation's
+        # journal; the snapshot can then be written out by write_snapshot while changes carry on
+        self.compacting = True
+        generation = self.generation + 1
+        record_ids = self.record_ids
+        # Patients are only captured here and turned into text by write_snapshot, outside the lock; the
+        # captured tuples are all kept, so collections while they are made would only rescan them
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            snapshot = {
+                "generation": generation,
+                "next_id": self.next_id,
+                "patients": [(record_ids[patient.patient_id], patient.capture()) for patient in self.patient_list],
+                "families": [[record_ids[family.patient_id], encode_insurance(family.patient.insurance_info),
+                              [record_ids[member.patient_id] for member in family.children]]
+                             for family in self.family_tree.root.children],
+            }
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        if self.journal is not None:
+            self.flush()
+            self.journal.close()
+        self.generation = generation
+        self.journal = open(self.journal_path(generation), "a")
+        self.journal_records = 0
+        self.pending = 0
+        return snapshot
+
+    def write_snapshot(self, snapshot):
+        # Write a snapshot from start_compaction to disk and drop the journals it replaces. Touches no shared
+        # state, so it may run on another thread while changes are journaled
+        try:
+            # Patients are stored column by column, which parses and rebuilds much faster than one list each
+            columns = [list(column) for column in zip(*([record_id] + Patient.record_of(captured)
+                                                        for record_id, captured in snapshot["patients"]))]
+            temporary_path = self.snapshot_path() + ".tmp"
+            with open(temporary_path, "w") as snapshot_file:
+                json.dump(dict(snapshot, patients=columns), snapshot_file, separators=(",", ":"))
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            # The rename is atomic, so a crash leaves either the old snapshot with its journals or the new one
+            os.replace(temporary_path, self.snapshot_path())
+            for generation in range(snapshot["generation"] - 1, -1, -1):
+                if not os.path.exists(self.journal_path(generation)):
+                    break
+                os.remove(self.journal_path(generation))
+        finally:
+            self.compacting = False
+
+    def close(self):
+        # Sync outstanding records and close the journal
+        self.sync()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        record_id = self.next_id
+        self.next_id += 1
+        self.register(record_id, patient)
+        self.write({"op": "insert", "id": record_id, "patient": encode_patient(patient)})
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        first_id = self.next_id
+        self.next_id += len(patients)
+        for offset, patient in enumerate(patients):
+            self.register(first_id + offset, patient)
+        for offset, patient in enumerate(patients):
+            self.write({"op": "insert", "id": first_id + offset, "patient": encode_patient(patient)})
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited
+        self.write({"op": "update", "id": self.record_ids[patient.patient_id], "patient": encode_patient(patient)})
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        record_id = self.record_ids[patient.patient_id]
+        self.unregister(record_id)
+        self.write({"op": "delete", "id": record_id})
+
+    def family_added(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family is added
+        self.write({"op": "family", "id": self.record_ids[family_node.patient_id],
+                    "insurance": encode_insurance(family_node.patient.insurance_info)})
+
+    def member_added(self, family_node, member_node):
+        # Listener hook called by InsuranceFamilyTree when a member joins a family
+        self.write({"op": "member", "id": self.record_ids[member_node.patient_id],
+                    "family": self.record_ids[family_node.patient_id]})
+
+    def insurance_changed(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family's insurance is replaced
+        self.write({"op": "insurance", "id": self.record_ids[family_node.patient_id],
+                    "insurance": encode_insurance(family_node.patient.insurance_info)})
+
+    def family_removed(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family is taken out of the tree
+        self.write_detach(family_node.patient)
+
+    def member_removed(self, family_node, member_node):
+        # Listener hook called by InsuranceFamilyTree when a dependent leaves their family
+        self.write_detach(member_node.patient)
+
+    def write_detach(self, patient):
+        # A patient deleted before the tree heard about it is already journaled, and replaying the delete
+        # takes it out of the tree as well
+        record_id = self.record_ids.get(patient.patient_id)
+        if record_id is not None:
+            self.write({"op": "detach", "id": record_id})
@@ -0,0 +1,95 @@
+import heapq
+from datetime import datetime
+
+from Patient import compute_priority, overdue_on
+
+
+class PriorityEngine:
+    def __init__(self, patient_list, today=None):
+        # Re-rank patients as their last exam turns a year old; attach with patient_list.add_listener(engine)
+        self.patient_list = patient_list
+        self.today = today or datetime.now().date()
+        self.today_ordinal = self.today.toordinal()
+        self.events = []  # Heap of (overdue date ordinal, counter, patient) entries, earliest first
+        self.due = {}  # Maps patient_id to the overdue date ordinal of its live entry; other entries are stale
+        self.counter = 0  # Breaks ties between patients due on the same day
+
+    def __len__(self):
+        return len(self.due)
+
+    def needs_event(self, patient, ordinal):
+        # A patient needs an event if their exam turns a year old later, or already has while they are still
+        # ranked as not due (e.g. the clinic was closed that day, or the level was stored before it turned)
+        return ordinal is not None and (ordinal > self.today_ordinal or patient.priority_level == 4)
+
+    def schedule(self, patient):
+        # Queue the day the patient becomes overdue; returns whether it was queued
+        ordinal = overdue_on(patient.last_exam_ordinal, patient.emergent_issue)
+        if not self.needs_event(patient, ordinal):
+            self.due.pop(patient.patient_id, None)
+            return False
+        if self.due.get(patient.patient_id) != ordinal:
+            self.due[patient.patient_id] = ordinal
+            heapq.heappush(self.events, (ordinal, self.counter, patient))
+            self.counter += 1
+        return True
+
+    def schedule_all(self, patients):
+        # Queue many patients, heapifying once when the batch outweighs the queue
+        entries = []
+        for patient in patients:
+            ordinal = overdue_on(patient.last_exam_ordinal, patient.emergent_issue)
+            if self.needs_event(patient, ordinal):
+                self.due[patient.patient_id] = ordinal
+                entries.append((ordinal, self.counter, patient))
+                self.counter += 1
+        if len(entries) > len(self.events):
+            self.events += entries
+            heapq.heapify(self.events)
+        else:
+            for entry in entries:
+                heapq.heappush(self.events, entry)
+
+    def next_change(self):
+        # The earliest date a queued patient becomes overdue, or None
+        while self.events and self.due.get(self.events[0][2].patient_id) != self.events[0][0]:
+            heapq.heappop(self.events)  # Drop entries left behind by edits and deletes
+        return datetime.fromordinal(self.events[0][0]).date() if self.events else None
+
+    def advance(self, today=None):
+        # Move the clock to today and re-rank only the patients whose year has run out since the last tick;
+        # the new priorities go through the patient list, so the appointment queue and stores follow
+        self.today = today or datetime.now().date()
+        self.today_ordinal = self.today.toordinal()
+        changed = []
+        while self.events and self.events[0][0] <= self.today_ordinal:
+            due, _, patient = heapq.heappop(self.events)
+            if self.due.get(patient.patient_id) != due:
+                continue
+            del self.due[patient.patient_id]
+            priority_level = compute_priority(patient.last_exam_ordinal, patient.conditions, patient.emergent_issue,
+                                              self.today)
+            if priority_level != patient.priority_level:
+                self.patient_list.update_patient(patient, priority_level=priority_level)
+                changed.append(patient)
+        # Stale entries are only dropped as they surface, so rebuild once they make up most of the heap
+        if len(self.events) > 2 * len(self.due) + 64:
+            self.events = [entry for entry in self.events if self.due.get(entry[2].patient_id) == entry[0]]
+            heapq.heapify(self.events)
+        return changed
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        self.schedule(patient)
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        self.schedule_all(patients)
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited; a new exam date moves the event
+        self.schedule(patient)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted; its heap entry goes stale
+        self.due.pop(patient.patient_id, None)
@@ -0,0 +1,131 @@
+from array import array
+from datetime import datetime
+from itertools import compress
+
+from Patient import OVERDUE_DAYS, grow_slots, slot_value
+
+try:
+    import numpy
+except ImportError:  # Without NumPy the levels are computed in one pure Python pass instead
+    numpy = None
+
+LEVELS = (1, 2, 3, 4)
+NO_EXAM = 0  # Exam ordinal stored for patients with no recorded exam, which are always overdue
+NO_ROW = -1  # Row of a patient_id with no row in the table
+# Byte translation tables turning a level column into a 0/1 mask for one level
+LEVEL_MASKS = {level: bytes(int(value == level) for value in range(256)) for level in LEVELS}
+
+
+class PriorityTable:
+    def __init__(self, patients=()):
+        # The fields priority depends on, one compact column each, so a whole clinic is triaged in one pass;
+        # attach with patient_list.add_listener(table) to keep it in step with the list
+        self.emergent = array("b")  # 1 if the patient has an emergent issue
+        self.conditions = array("b")  # 1 if the patient has medical conditions
+        self.exams = array("i")  # Last exam as a date ordinal, or NO_EXAM
+        self.patients = []  # Patient for each row
+        self.rows = array("l")  # Row of each patient by patient_id, or NO_ROW
+        self.add_patients(patients)
+
+    def __len__(self):
+        return len(self.patients)
+
+    @staticmethod
+    def exam_ordinal(patient):
+        return patient.last_exam_ordinal or NO_EXAM
+
+    def add_patient(self, patient):
+        # Append a row for a patient
+        grow_slots(self.rows, patient.patient_id, NO_ROW)
+        self.rows[patient.patient_id] = len(self.patients)
+        self.patients.append(patient)
+        self.emergent.append(1 if patient.emergent_issue else 0)
+        self.conditions.append(1 if patient.conditions else 0)
+        self.exams.append(self.exam_ordinal(patient))
+
+    def add_patients(self, patients):
+        # Append rows for many patients, extending each column once
+        patients = list(patients)
+        start = len(self.patients)
+        if patients:
+            grow_slots(self.rows, max(patient.patient_id for patient in patients), NO_ROW)
+        rows = self.rows
+        for row, patient in enumerate(patients, start):
+            rows[patient.patient_id] = row
+        self.patients += patients
+        self.emergent.extend(array("b", [1 if patient.emergent_issue else 0 for patient in patients]))
+        self.conditions.extend(array("b", [1 if patient.conditions else 0 for patient in patients]))
+        self.exams.extend(array("i", [patient.last_exam_ordinal or NO_EXAM for patient in patients]))
+
+    def update_row(self, patient):
+        # Rewrite a patient's row after an edit
+        row = self.rows[patient.patient_id]
+        self.emergent[row] = 1 if patient.emergent_issue else 0
+        self.conditions[row] = 1 if patient.conditions else 0
+        self.exams[row] = self.exam_ordinal(patient)
+
+    def remove_patient(self, patient):
+        # Drop a patient's row by moving the last row into its place
+        row = slot_value(self.rows, patient.patient_id, NO_ROW)
+        if row == NO_ROW:
+            return False
+        self.rows[patient.patient_id] = NO_ROW
+        last_patient = self.patients.pop()
+        for column in (self.emergent, self.conditions, self.exams):
+            value = column.pop()
+            if last_patient is not patient:
+                column[row] = value
+        if last_patient is not patient:
+            self.patients[row] = last_patient
+            self.rows[last_patient.patient_id] = row
+        return True
+
+    def levels(self, today=None):
+        # Priority level of every row as of today, as an array of bytes
+        cutoff = (today or datetime.now().date()).toordinal() - OVERDUE_DAYS
+        if numpy is not None and self.patients:
+            emergent = numpy.frombuffer(self.emergent, dtype=numpy.int8)
+            conditions = numpy.frombuffer(self.conditions, dtype=numpy.int8)
+            overdue = numpy.frombuffer(self.exams, dtype=numpy.intc) <= cutoff
+            levels = numpy.full(len(self.patients), 4, dtype=numpy.int8)
+            levels[overdue] = 3
+            levels[overdue & (conditions != 0)] = 2
+            levels[emergent != 0] = 1
+            return array("b", levels.tobytes())
+        return array("b", [1 if emergent else 4 if exam > cutoff else 2 if conditions else 3
+                           for emergent, conditions, exam in zip(self.emergent, self.conditions, self.exams)])
+
+    def priorities(self, today=None):
+        # Triage every row as of today: ({level: count}, {level: rows at that level}); the rows are NumPy
+        # integer arrays when NumPy is installed and array("l") otherwise, in row order either way
+        levels = self.levels(today)
+        if numpy is not None:
+            level_column = numpy.frombuffer(levels, dtype=numpy.int8) if levels else numpy.zeros(0, numpy.int8)
+            counts = numpy.bincount(level_column, minlength=5)
+            return ({level: int(counts[level]) for level in LEVELS},
+                    {level: numpy.flatnonzero(level_column == level) for level in LEVELS})
+        raw = levels.tobytes()
+        rows = range(len(raw))
+        return ({level: raw.count(bytes((level,))) for level in LEVELS},
+                {level: array("l", compress(rows, raw.translate(LEVEL_MASKS[level]))) for level in LEVELS})
+
+    def patients_at(self, rows):
+        # The patients in the given rows, e.g. one level's rows from priorities()
+        return [self.patients[row] for row in rows]
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        self.add_patient(patient)
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        self.add_patients(patients)
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited
+        if slot_value(self.rows, patient.patient_id, NO_ROW) != NO_ROW:
+            self.update_row(patient)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        self.remove_patient(patient)
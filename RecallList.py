@@ -0,0 +1,73 @@
+import csv
+from contextlib import nullcontext
+
+DUE_LEVELS = (1, 2, 3)  # Priority levels a recall campaign contacts, most urgent first
+RECALL_CHUNK = 1000  # patient_ids read per hold of the lock
+RECALL_COLUMNS = ("priority_level", "contact", "phone", "address", "due_count", "due_members")
+
+
+def family_members(family_node):
+    # Yield the patients of a family, primary member first
+    yield family_node.patient
+    for member_node in family_node.children:
+        yield member_node.patient
+
+
+def households(patient_list, family_tree, first_id, last_id):
+    # Yield (contact, members) for the households whose contact has a patient_id in range(first_id, last_id):
+    # a family through its primary member, and a patient who is not in a family as a household of one
+    for patient_id in range(first_id, last_id):
+        patient = patient_list.get_patient(patient_id)
+        if patient is None:
+            continue
+        node = family_tree.node_by_id(patient_id)
+        if node is None:
+            yield patient, (patient,)
+        elif node.family is None:
+            yield patient, family_members(node)
+
+
+def recall_households(patient_list, family_tree, levels=DUE_LEVELS, lock=None, chunk_size=RECALL_CHUNK):
+    # Yield (priority level, contact, due members) for each household with someone due, most urgent first.
+    # A household is recalled once, at the level of its most urgent member, with the primary member's phone and
+    # address. Each level is one more pass over the households rather than a sort, so the memory used is the
+    # same however big the clinic is. Households are read chunk_size patient_ids at a time while holding lock
+    # (if given), which is released before the chunk's due households are yielded, so the list and tree may
+    # change between chunks; a household is then seen as it was when its chunk was read
+    lock = lock or nullcontext()
+    for level in levels:
+        first_id = 0
+        while True:
+            with lock:
+                if first_id >= patient_list.id_limit():
+                    break
+                due_households = []
+                for contact, members in households(patient_list, family_tree, first_id, first_id + chunk_size):
+                    due = [patient for patient in members if patient.priority_level in levels]
+                    if due and min(patient.priority_level for patient in due) == level:
+                        due.sort(key=lambda patient: patient.priority_level)
+                        due_households.append((level, contact, due))
+            yield from due_households
+            first_id += chunk_size
+
+
+def recall_rows(recall):
+    # Turn recall households into CSV rows matching RECALL_COLUMNS
+    for level, contact, due in recall:
+        yield (level, f"{contact.first_name} {contact.last_name}", contact.phone, contact.address, len(due),
+               "; ".join(f"{patient.first_name} {patient.last_name} ({patient.priority_level})" for patient in due))
+
+
+def write_recall_csv(recall, target):
+    # Write recall households to a CSV file, given as a path or an open text file, one row at a time; returns the
+    # number of households written
+    if isinstance(target, str):
+        with open(target, "w", newline="") as output:
+            return write_recall_csv(recall, output)
+    writer = csv.writer(target)
+    writer.writerow(RECALL_COLUMNS)
+    count = 0
+    for row in recall_rows(recall):
+        writer.writerow(row)
+        count += 1
+    return count
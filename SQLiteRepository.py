@@ -0,0 +1,213 @@
+import sqlite3
+import time
+from collections import namedtuple
+
+from Patient import Patient
+from PatientStore import encode_date, decode_date, decode_insurance, encode_insurance
+
+# Row returned by the schedule queries; it has the attributes the schedule page displays, without building a Patient
+ScheduledPatient = namedtuple("ScheduledPatient", ["patient_id", "first_name", "last_name", "dob", "priority_level"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS patients (
+    id INTEGER PRIMARY KEY,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    dob TEXT NOT NULL,
+    phone TEXT,
+    address TEXT,
+    last_exam TEXT,
+    emergent_issue INTEGER,
+    prescription TEXT,
+    conditions INTEGER,
+    priority_level INTEGER NOT NULL,
+    family_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS families (
+    id INTEGER PRIMARY KEY,
+    primary_name TEXT,
+    provider_name TEXT,
+    policy_number TEXT,
+    vision_coverage INTEGER,
+    medical_coverage INTEGER,
+    copay INTEGER
+);
+CREATE INDEX IF NOT EXISTS patients_by_name ON patients (last_name, first_name, dob);
+CREATE INDEX IF NOT EXISTS patients_by_family ON patients (family_id);
+CREATE INDEX IF NOT EXISTS patients_by_priority ON patients (priority_level, id);
+"""
+
+# Statements are kept as constants so the connection's statement cache prepares each one only once
+INSERT_PATIENT = "INSERT INTO patients (id, first_name, last_name, dob, phone, address, last_exam, emergent_issue, " \
+                 "prescription, conditions, priority_level) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+UPDATE_PATIENT = "UPDATE patients SET first_name = ?, last_name = ?, dob = ?, phone = ?, address = ?, last_exam = ?, " \
+                 "emergent_issue = ?, prescription = ?, conditions = ?, priority_level = ? WHERE id = ?"
+DELETE_PATIENT = "DELETE FROM patients WHERE id = ?"
+DELETE_FAMILY = "DELETE FROM families WHERE id = ?"
+INSERT_FAMILY = "INSERT OR REPLACE INTO families (id, primary_name, provider_name, policy_number, vision_coverage, " \
+                "medical_coverage, copay) VALUES (?, ?, ?, ?, ?, ?, ?)"
+SET_FAMILY = "UPDATE patients SET family_id = ? WHERE id = ?"
+CLEAR_FAMILY = "UPDATE patients SET family_id = NULL WHERE family_id = ?"
+SELECT_PATIENTS = "SELECT id, first_name, last_name, dob, phone, address, last_exam, emergent_issue, prescription, " \
+                  "conditions, priority_level FROM patients ORDER BY id"
+SELECT_FAMILIES = "SELECT id, primary_name, provider_name, policy_number, vision_coverage, medical_coverage, copay " \
+                  "FROM families ORDER BY id"
+SELECT_MEMBERS = "SELECT id, family_id FROM patients WHERE family_id IS NOT NULL AND family_id != id ORDER BY id"
+COUNT_SCHEDULE = "SELECT COUNT(*) FROM patients WHERE priority_level < ?"
+SELECT_SCHEDULE = "SELECT id, first_name, last_name, dob, priority_level FROM patients WHERE priority_level < ? " \
+                  "ORDER BY priority_level, id LIMIT ? OFFSET ?"
+SELECT_BY_NAME = "SELECT id FROM patients WHERE last_name = ? AND first_name = ? AND dob = ?"
+SELECT_FAMILY_MEMBERS = "SELECT id FROM patients WHERE family_id = ? ORDER BY id"
+
+
+class SQLitePatientRepository:
+    def __init__(self, path, sync_every=100, sync_interval=1.0):
+        # Store the patient list and family tree in a local SQLite file with indexed lookups. The connection is
+        # used from whichever thread makes a change, so callers must take turns: ClinicService only touches the
+        # repository under its commit lock
+        self.connection = sqlite3.connect(path, cached_statements=64, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.sync_every = sync_every  # Commit after this many changes...
+        self.sync_interval = sync_interval  # ...or once this many seconds have passed since the last commit
+        self.patient_list = None
+        self.family_tree = None
+        self.record_ids = {}  # Maps patient_id to its row id
+        self.patients = {}  # Maps row id to patient
+        self.next_id = 1
+        self.pending = 0  # Changes since the last commit
+        self.last_sync = time.monotonic()
+
+    def load(self, patient_list, family_tree):
+        # Build the in-memory structures from the database, then record every later change in it
+        self.patient_list = patient_list
+        self.family_tree = family_tree
+        record_ids = []
+        patients = []
+        for row in self.connection.execute(SELECT_PATIENTS):
+            record_ids.append(row[0])
+            patients.append(Patient.from_record(row[1], row[2], row[3], row[4], row[5], decode_date(row[6]),
+                                                bool(row[7]), row[8], bool(row[9]), row[10]))
+            self.next_id = row[0] + 1
+        patient_list.insert_patients(patients)  # Gives each patient its patient_id
+        for record_id, patient in zip(record_ids, patients):
+            self.register(record_id, patient)
+
+        family_nodes = {}
+        for row in self.connection.execute(SELECT_FAMILIES):
+            insurance = list(row[1:]) if any(value is not None for value in row[1:]) else None
+            family_nodes[row[0]] = family_tree.add_family(self.patients[row[0]], decode_insurance(insurance))
+        for member_id, family_id in self.connection.execute(SELECT_MEMBERS):
+            if family_id in family_nodes:
+                family_tree.add_family_member(family_nodes[family_id], self.patients[member_id])
+
+        patient_list.add_listener(self)
+        family_tree.add_listener(self)
+
+    def register(self, record_id, patient):
+        self.record_ids[patient.patient_id] = record_id
+        self.patients[record_id] = patient
+
+    def execute(self, statement, parameters):
+        # Run a write inside the open transaction, committing in batches
+        self.connection.execute(statement, parameters)
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self, defer_compaction=False):
+        # Commit the open transaction; there is no snapshot to compact, so nothing is ever deferred
+        if self.pending:
+            self.connection.commit()
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        # Commit outstanding changes and close the connection
+        self.sync()
+        self.connection.close()
+
+    @staticmethod
+    def patient_values(patient):
+        return (patient.first_name, patient.last_name, encode_date(patient.dob), patient.phone, patient.address,
+                encode_date(patient.last_exam), patient.emergent_issue, patient.prescription, patient.conditions,
+                patient.priority_level)
+
+    def count_to_schedule(self, below_priority=4):
+        # Number of patients whose priority level is below the given one, answered from the priority index
+        return self.connection.execute(COUNT_SCHEDULE, (below_priority,)).fetchone()[0]
+
+    def fetch_schedule(self, start, count, below_priority=4):
+        # Rows start to start + count of the schedule, in priority then arrival order, as ScheduledPatient tuples
+        rows = self.connection.execute(SELECT_SCHEDULE, (below_priority, count, start))
+        return [ScheduledPatient(*row) for row in rows]
+
+    def find_patient_id(self, first_name, last_name, dob):
+        # Row id of the patient with this name and date of birth, using the name index
+        row = self.connection.execute(SELECT_BY_NAME, (last_name, first_name, encode_date(decode_date(dob)))).fetchone()
+        return row[0] if row else None
+
+    def family_member_ids(self, family_id):
+        # Row ids of the patients in a family, primary member included, using the family index
+        return [row[0] for row in self.connection.execute(SELECT_FAMILY_MEMBERS, (family_id,))]
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        record_id = self.next_id
+        self.next_id += 1
+        self.register(record_id, patient)
+        self.execute(INSERT_PATIENT, (record_id,) + self.patient_values(patient))
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        rows = []
+        for patient in patients:
+            self.register(self.next_id, patient)
+            rows.append((self.next_id,) + self.patient_values(patient))
+            self.next_id += 1
+        self.connection.executemany(INSERT_PATIENT, rows)
+        self.pending += len(rows)
+        self.sync()
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited
+        self.execute(UPDATE_PATIENT, self.patient_values(patient) + (self.record_ids[patient.patient_id],))
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        record_id = self.record_ids.pop(patient.patient_id)
+        del self.patients[record_id]
+        self.execute(DELETE_PATIENT, (record_id,))
+        self.execute(DELETE_FAMILY, (record_id,))
+
+    def family_added(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family is added
+        record_id = self.record_ids[family_node.patient_id]
+        self.write_family(record_id, family_node)
+        self.execute(SET_FAMILY, (record_id, record_id))
+
+    def insurance_changed(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family's insurance is replaced
+        self.write_family(self.record_ids[family_node.patient_id], family_node)
+
+    def write_family(self, record_id, family_node):
+        insurance = encode_insurance(family_node.patient.insurance_info) or [None] * 6
+        self.execute(INSERT_FAMILY, [record_id] + insurance)
+
+    def member_added(self, family_node, member_node):
+        # Listener hook called by InsuranceFamilyTree when a member joins a family
+        self.execute(SET_FAMILY, (self.record_ids[family_node.patient_id], self.record_ids[member_node.patient_id]))
+
+    def family_removed(self, family_node):
+        # Listener hook called by InsuranceFamilyTree when a family is taken out of the tree
+        record_id = self.record_ids.get(family_node.patient_id)
+        if record_id is not None:
+            self.execute(CLEAR_FAMILY, (record_id,))
+            self.execute(DELETE_FAMILY, (record_id,))
+
+    def member_removed(self, family_node, member_node):
+        # Listener hook called by InsuranceFamilyTree when a dependent leaves their family
+        record_id = self.record_ids.get(member_node.patient_id)
+        if record_id is not None:
+            self.execute(SET_FAMILY, (None, record_id))
@@ -0,0 +1,315 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import count
+
+MINUTES_PER_DAY = 24 * 60
+DAY_START = 8 * 60  # Opening time, in minutes after midnight
+DAY_END = 17 * 60  # Closing time; an appointment must end by then
+OPEN_WEEKDAYS = (0, 1, 2, 3, 4)  # Monday to Friday
+SLOT_STEP = 15  # Appointments start on a multiple of this many minutes after opening
+SEARCH_DAYS = 366  # How far ahead a free slot is looked for
+
+
+def to_minutes(moment):
+    # A datetime as whole minutes since the start of day ordinal 0, so times compare and subtract as ints
+    return moment.toordinal() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def from_minutes(minutes):
+    day, minute = divmod(minutes, MINUTES_PER_DAY)
+    return datetime.fromordinal(day) + timedelta(minutes=minute)
+
+
+def check_length(length):
+    # An appointment has to take some time, or it would clash with nothing and fit anywhere
+    if length <= 0:
+        raise ValueError("Appointment length must be positive.")
+
+
+class Booking:
+    __slots__ = ("booking_id", "provider", "patient_id", "start", "end")
+
+    def __init__(self, booking_id, provider, patient_id, start, end):
+        # One appointment: a provider (or room) and a patient from start up to end, both in minutes
+        self.booking_id = booking_id
+        self.provider = provider
+        self.patient_id = patient_id
+        self.start = start
+        self.end = end
+
+    @property
+    def start_time(self):
+        return from_minutes(self.start)
+
+    @property
+    def end_time(self):
+        return from_minutes(self.end)
+
+
+class ProviderSchedule:
+    def __init__(self, calendar):
+        # One provider's bookings sorted by start; they never overlap, so they are sorted by end too and any
+        # overlap with a new interval is found next to where it would be inserted. Bookings with no usable gap
+        # between them (back to back, or only closed hours in between) are also merged into busy runs, so the
+        # free-slot search jumps over a fully booked week in one step instead of one booking at a time
+        self.calendar = calendar
+        self.starts = []
+        self.bookings = []  # In the same order as starts
+        self.run_starts = []  # Start of each busy run: the start of its first booking
+        self.run_ends = []  # End of each busy run: the end of its last booking
+
+    def __len__(self):
+        return len(self.bookings)
+
+    def overlapping(self, start, end):
+        # The bookings overlapping [start, end)
+        index = bisect_right(self.starts, start)
+        if index and self.bookings[index - 1].end > start:
+            index -= 1
+        return self.bookings[index:bisect_left(self.starts, end, index)]
+
+    def between(self, start, end):
+        # The bookings starting in [start, end)
+        return self.bookings[bisect_left(self.starts, start):bisect_left(self.starts, end)]
+
+    def unusable(self, start, end):
+        # Whether no appointment could start in the gap [start, end)
+        opening = self.calendar.opening_at_or_after(start, 1)
+        return opening is None or opening >= end
+
+    def add(self, booking):
+        index = bisect_left(self.starts, booking.start)
+        self.starts.insert(index, booking.start)
+        self.bookings.insert(index, booking)
+        run_starts, run_ends = self.run_starts, self.run_ends
+        run = bisect_right(run_starts, booking.start)
+        if run and run_ends[run - 1] > booking.start:
+            return  # Inside a gap that was unusable already
+        join_left = run > 0 and self.unusable(run_ends[run - 1], booking.start)
+        join_right = run < len(run_starts) and self.unusable(booking.end, run_starts[run])
+        if join_left and join_right:
+            run_ends[run - 1] = run_ends[run]
+            del run_starts[run], run_ends[run]
+        elif join_left:
+            run_ends[run - 1] = booking.end
+        elif join_right:
+            run_starts[run] = booking.start
+        else:
+            run_starts.insert(run, booking.start)
+            run_ends.insert(run, booking.end)
+
+    def remove(self, booking):
+        index = bisect_left(self.starts, booking.start)
+        before = self.bookings[index - 1] if index else None
+        after = self.bookings[index + 1] if index + 1 < len(self.bookings) else None
+        del self.starts[index]
+        del self.bookings[index]
+        run_starts, run_ends = self.run_starts, self.run_ends
+        run = bisect_right(run_starts, booking.start) - 1
+        at_start = run_starts[run] == booking.start
+        at_end = run_ends[run] == booking.end
+        if at_start and at_end:
+            del run_starts[run], run_ends[run]
+        elif at_start:
+            run_starts[run] = after.start
+        elif at_end:
+            run_ends[run] = before.end
+        elif not self.unusable(before.end, after.start):
+            run_starts.insert(run + 1, after.start)
+            run_ends.insert(run + 1, run_ends[run])
+            run_ends[run] = before.end
+
+    def next_free(self, start, length):
+        # The earliest start at or after start where length minutes fit inside opening hours without touching a
+        # booking, stepping over the busy runs in the way; None if there is none in SEARCH_DAYS
+        limit = start + SEARCH_DAYS * MINUTES_PER_DAY
+        calendar = self.calendar
+        run_starts, run_ends = self.run_starts, self.run_ends
+        start = calendar.opening_at_or_after(start, length)
+        while start is not None and start < limit:
+            run = bisect_right(run_starts, start)
+            if run and run_ends[run - 1] > start:
+                start = calendar.opening_at_or_after(run_ends[run - 1], length)
+            elif run < len(run_starts) and run_starts[run] < start + length:
+                start = calendar.opening_at_or_after(run_ends[run], length)
+            else:
+                return start
+        return None
+
+
+class SlotCalendar:
+    def __init__(self, providers=(), day_start=DAY_START, day_end=DAY_END, weekdays=OPEN_WEEKDAYS,
+                 slot_step=SLOT_STEP):
+        # Appointment slots for each provider or exam room, with conflict checks and earliest-free-slot search;
+        # booking, cancelling and rescheduling cost a binary search plus a list insert or delete, so thousands
+        # of slots a day across many providers stay interactive. Attach with patient_list.add_listener(calendar)
+        # so a deleted patient's bookings are cancelled
+        if not weekdays or day_end <= day_start:
+            raise ValueError("The calendar needs opening hours on at least one weekday.")
+        self.day_start = day_start
+        self.day_end = day_end
+        self.weekdays = frozenset(weekdays)
+        self.slot_step = slot_step
+        self.schedules = {}  # Maps provider to its ProviderSchedule
+        self.bookings = {}  # Maps booking_id to Booking
+        self.patient_bookings = {}  # Maps patient_id to the patient's bookings
+        self.booking_ids = count(1)
+        for provider in providers:
+            self.add_provider(provider)
+
+    def __len__(self):
+        return len(self.bookings)
+
+    def add_provider(self, provider):
+        if provider not in self.schedules:
+            self.schedules[provider] = ProviderSchedule(self)
+
+    def schedule_of(self, provider):
+        schedule = self.schedules.get(provider)
+        if schedule is None:
+            raise ValueError(f"Unknown provider {provider}.")
+        return schedule
+
+    def opening_at_or_after(self, start, length):
+        # The first slot boundary at or after start (in minutes) on an open day from which length minutes fit
+        # before closing, or None if length is longer than a day's opening hours
+        if length > self.day_end - self.day_start:
+            return None
+        day, minute = divmod(start, MINUTES_PER_DAY)
+        minute = max(minute, self.day_start)
+        minute += -(minute - self.day_start) % self.slot_step
+        while minute + length > self.day_end or (day - 1) % 7 not in self.weekdays:  # Ordinal 1 is a Monday
+            day += 1
+            minute = self.day_start
+        return day * MINUTES_PER_DAY + minute
+
+    def is_open(self, start, end):
+        # Whether [start, end) lies inside one day's opening hours
+        day, minute = divmod(start, MINUTES_PER_DAY)
+        return ((day - 1) % 7 in self.weekdays and minute >= self.day_start
+                and end <= day * MINUTES_PER_DAY + self.day_end)
+
+    def conflicts(self, provider, start, length, patient_id=None, ignore=None):
+        # The bookings clashing with one for provider from start (a datetime) for length minutes: the
+        # provider's overlapping bookings and, if patient_id is given, the patient's bookings elsewhere
+        start = to_minutes(start)
+        return self.clashes(provider, start, start + length, patient_id, ignore)
+
+    def clashes(self, provider, start, end, patient_id, ignore):
+        found = [booking for booking in self.schedule_of(provider).overlapping(start, end) if booking is not ignore]
+        for booking in self.patient_bookings.get(patient_id, ()):
+            if booking.start < end and start < booking.end and booking is not ignore and booking not in found:
+                found.append(booking)
+        return found
+
+    def book(self, provider, patient_id, start, length):
+        # Book patient_id with provider from start (a datetime) for length minutes; raises ValueError outside
+        # opening hours or on a clash with another booking of the provider or the patient
+        check_length(length)
+        start = to_minutes(start)
+        return self.place(Booking(next(self.booking_ids), provider, patient_id, start, start + length))
+
+    def check_free(self, booking, ignore=None):
+        # Raise ValueError unless the booking's time is open and clashes with nothing but ignore
+        if not self.is_open(booking.start, booking.end):
+            raise ValueError("That time is outside opening hours.")
+        if self.clashes(booking.provider, booking.start, booking.end, booking.patient_id, ignore):
+            raise ValueError("That time clashes with another booking.")
+
+    def place(self, booking):
+        check_length(booking.end - booking.start)
+        self.check_free(booking)
+        return self.insert(booking)
+
+    def insert(self, booking):
+        self.schedules[booking.provider].add(booking)
+        self.bookings[booking.booking_id] = booking
+        self.patient_bookings.setdefault(booking.patient_id, []).append(booking)
+        return booking
+
+    def cancel(self, booking_id):
+        # Cancel a booking; returns it, or None if there is no such booking
+        booking = self.bookings.pop(booking_id, None)
+        if booking is None:
+            return None
+        self.schedules[booking.provider].remove(booking)
+        patient_bookings = self.patient_bookings[booking.patient_id]
+        patient_bookings.remove(booking)
+        if not patient_bookings:
+            del self.patient_bookings[booking.patient_id]
+        return booking
+
+    def reschedule(self, booking_id, start, provider=None):
+        # Move a booking to a new start (a datetime), and provider if given, keeping its length; nothing
+        # changes if the new time is unavailable
+        booking = self.bookings.get(booking_id)
+        if booking is None:
+            raise ValueError(f"No booking {booking_id}.")
+        start = to_minutes(start)
+        moved = Booking(booking_id, provider or booking.provider, booking.patient_id, start,
+                        start + booking.end - booking.start)
+        self.check_free(moved, booking)
+        self.cancel(booking_id)
+        return self.insert(moved)
+
+    def earliest_free(self, length, after, providers=None):
+        # (provider, start datetime) of the earliest slot of length minutes at or after after, across the given
+        # providers (default: all), or None if none is free within SEARCH_DAYS
+        check_length(length)
+        found = self.earliest_start(length, to_minutes(after), providers or self.schedules)
+        return (found[0], from_minutes(found[1])) if found else None
+
+    def earliest_start(self, length, after, providers):
+        best = None
+        for provider in providers:
+            start = self.schedule_of(provider).next_free(after, length)
+            if start is not None and (best is None or start < best[1]):
+                best = (provider, start)
+        return best
+
+    def fill(self, patients, length, after, limit=None, providers=None):
+        # Book patients in the order given (e.g. the appointment queue's priority order) into the earliest free
+        # slots from after on, skipping anyone who already has an upcoming booking or has been deleted; returns the
+        # new bookings.
+        # Each provider's search carries on from its last booking, so filling n slots stays O(n log n)
+        check_length(length)
+        after = to_minutes(after)
+        cursors = dict.fromkeys(providers or self.schedules, after)
+        booked = []
+        for patient in patients:
+            if limit is not None and len(booked) >= limit:
+                break
+            patient_id = patient.patient_id
+            if patient_id is None or any(booking.end > after for booking in self.patient_bookings.get(patient_id, ())):
+                continue
+            found = None
+            for provider, cursor in cursors.items():
+                start = self.schedules[provider].next_free(cursor, length) if cursor is not None else None
+                cursors[provider] = start  # Nothing free before start, so the next search begins there
+                if start is not None and (found is None or start < found[1]):
+                    found = (provider, start)
+            if found is None:
+                break
+            booking = self.place(Booking(next(self.booking_ids), found[0], patient_id, found[1], found[1] + length))
+            booked.append(booking)
+        return booked
+
+    def day_bookings(self, provider, day):
+        # A provider's bookings on one day (a date), in start order
+        start = day.toordinal() * MINUTES_PER_DAY
+        return self.schedule_of(provider).between(start, start + MINUTES_PER_DAY)
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList; new patients are booked separately
+        pass
+
+    def patients_inserted(self, patients):
+        pass
+
+    def patient_updated(self, patient):
+        pass
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted; their bookings are cancelled
+        for booking in list(self.patient_bookings.get(patient.patient_id, ())):
+            self.cancel(booking.booking_id)
@@ -0,0 +1,84 @@
+from bisect import bisect_left
+
+from Patient import grow_slots, slot_value
+
+
+class SortedPatientIndex:
+    def __init__(self):
+        # Keep patients sorted by (last_name, first_name) as the linked list changes
+        self.keys = []  # Sorted (last_name, first_name, sequence) keys
+        self.patients = []  # Patients in the same order as keys
+        self.patient_keys = []  # Current key of each patient by patient_id, or None
+        self.sequence = 0  # Breaks ties between patients with the same name, oldest first
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self.patients)
+
+    def add_patient(self, patient):
+        # Insert a patient at its sorted position
+        key = (patient.last_name, patient.first_name, self.sequence)
+        self.sequence += 1
+        index = bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.patients.insert(index, patient)
+        grow_slots(self.patient_keys, patient.patient_id)
+        self.patient_keys[patient.patient_id] = key
+
+    def add_patients(self, patients):
+        # Insert many patients with one sort instead of one list insert each
+        patients = list(patients)
+        if len(patients) * 8 < len(self.keys):
+            for patient in patients:
+                self.add_patient(patient)
+            return
+        entries = [(key, self.patients[index]) for index, key in enumerate(self.keys)]
+        for patient in patients:
+            key = (patient.last_name, patient.first_name, self.sequence)
+            self.sequence += 1
+            grow_slots(self.patient_keys, patient.patient_id)
+            self.patient_keys[patient.patient_id] = key
+            entries.append((key, patient))
+        entries.sort(key=lambda entry: entry[0])
+        self.keys = [key for key, _ in entries]
+        self.patients = [patient for _, patient in entries]
+
+    def remove_patient(self, patient):
+        # Remove a patient from the index
+        key = slot_value(self.patient_keys, patient.patient_id)
+        if key is None:
+            return False
+        self.patient_keys[patient.patient_id] = None
+        index = bisect_left(self.keys, key)
+        del self.keys[index]
+        del self.patients[index]
+        return True
+
+    def get_patients(self, start, count):
+        # Return count patients in name order beginning at position start
+        return self.patients[start:start + count]
+
+    def position_of(self, last_name, first_name=""):
+        # Return the position of the first patient at or after the given name, for jumping to a page
+        return bisect_left(self.keys, (last_name, first_name))
+
+    def patient_inserted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is inserted
+        self.add_patient(patient)
+
+    def patients_inserted(self, patients):
+        # Listener hook called by PatientLinkedList when a batch of patients is inserted
+        self.add_patients(patients)
+
+    def patient_updated(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is edited; only renames move the patient
+        key = slot_value(self.patient_keys, patient.patient_id)
+        if key is not None and key[:2] != (patient.last_name, patient.first_name):
+            self.remove_patient(patient)
+            self.add_patient(patient)
+
+    def patient_deleted(self, patient):
+        # Listener hook called by PatientLinkedList when a patient is deleted
+        self.remove_patient(patient)
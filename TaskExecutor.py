@@ -0,0 +1,143 @@
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class Task:
+    def __init__(self, on_done=None, on_error=None, on_progress=None):
+        # Handle for one piece of background work; the callbacks always run on the Tk main thread
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.future = None
+        self.progress = queue.SimpleQueue()  # Values reported by the worker, waiting to be handed to the UI
+        self.cancel_event = threading.Event()
+
+    def report(self, value):
+        # Called from the worker to pass a progress value (or a partial result) to on_progress
+        self.progress.put(value)
+
+    def cancelled(self):
+        # Workers check this between steps and stop early once the task is cancelled
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        # Ask the task to stop; work that has not started yet is dropped, and no more callbacks run
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+
+class TaskExecutor:
+    def __init__(self, root, threads=4, processes=None, poll_interval=50):
+        # Run slow work off the Tk main loop: a thread pool for I/O and waiting, a process pool (started on
+        # first use) for CPU-heavy work, and results polled back onto the main thread with root.after()
+        self.root = root
+        self.threads = ThreadPoolExecutor(max_workers=threads)
+        self.process_count = processes
+        self.processes = None
+        self.poll_interval = poll_interval
+        self.tasks = []  # Tasks whose results have not been delivered yet
+        self.polling = False
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def process_pool(self):
+        if self.processes is None:
+            self.processes = ProcessPoolExecutor(max_workers=self.process_count)
+        return self.processes
+
+    def submit(self, function, *args, on_done=None, on_error=None, on_progress=None):
+        # Run function(task, *args) on a worker thread; it can call task.report() and should return early
+        # once task.cancelled() is true; on_done gets its return value and on_error the exception it raised
+        task = Task(on_done, on_error, on_progress)
+        task.future = self.threads.submit(function, task, *args)
+        return self.track(task)
+
+    def map_process(self, function, items, on_result=None, on_done=None, on_error=None, in_flight=None):
+        # Run function over items in the process pool, handing each result to on_result in item order as it
+        # arrives and the number of items to on_done; only a few items are queued at a time, so cancelling
+        # stops the rest from starting
+        limit = in_flight or 2 * (self.process_count or 4)
+        return self.submit(self.run_map, function, items, limit, on_done=on_done, on_error=on_error,
+                           on_progress=on_result)
+
+    def run_map(self, task, function, items, limit):
+        # Worker thread feeding map_process items to the process pool
+        pool = self.process_pool()
+        pending = deque()
+        count = 0
+        try:
+            for item in items:
+                if task.cancelled():
+                    return count
+                pending.append(pool.submit(function, item))
+                if len(pending) >= limit:
+                    task.report(pending.popleft().result())
+                    count += 1
+            while pending and not task.cancelled():
+                task.report(pending.popleft().result())
+                count += 1
+            return count
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def track(self, task):
+        # Start polling for the task's progress and result
+        self.tasks.append(task)
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_interval, self.poll)
+        return task
+
+    def poll(self):
+        # Deliver progress and finished results on the main thread, then check again while work is pending
+        # A callback that raises stops this round, but the tasks not delivered yet are kept and the next poll is
+        # still scheduled, so one bad callback does not strand every other task
+        tasks, self.tasks = deque(self.tasks), []  # Callbacks may submit new tasks while these are delivered
+        remaining = []
+        try:
+            while tasks:
+                task = tasks.popleft()
+                finished = task.future.done()  # Checked first, so progress reported before finishing is delivered
+                if not finished:
+                    remaining.append(task)
+                self.deliver_progress(task)
+                if finished and not task.cancelled() and not task.future.cancelled():
+                    error = task.future.exception()
+                    if error is not None:
+                        if task.on_error:
+                            task.on_error(error)
+                    elif task.on_done:
+                        task.on_done(task.future.result())
+        finally:
+            self.tasks = remaining + list(tasks) + self.tasks
+            if self.tasks:
+                self.root.after(self.poll_interval, self.poll)
+            else:
+                self.polling = False
+
+    @staticmethod
+    def deliver_progress(task):
+        while True:
+            try:
+                value = task.progress.get_nowait()
+            except queue.Empty:
+                return
+            if task.on_progress and not task.cancelled():
+                task.on_progress(value)
+
+    def shutdown(self):
+        # Cancel everything still running and stop the pools; called when the window closes
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        if self.processes is not None:
+            self.processes.shutdown(wait=False, cancel_futures=True)
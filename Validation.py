@@ -0,0 +1,156 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+# Patterns and translate tables are built once at import instead of on every call
+PHONE_PATTERN = re.compile(r"^\d{3}-\d{3}-\d{4}$")
+# Each table deletes the punctuation a field allows, so the rest only has to pass one str method
+NAME_PUNCTUATION = str.maketrans("", "", " '-")
+PRESCRIPTION_PUNCTUATION = str.maketrans("", "", " '-/")
+OPTIONAL_STRING_PUNCTUATION = NAME_PUNCTUATION
+DATE_MESSAGE = "{} must be a valid date string (MM-DD-YYYY) or 'N/A'."
+
+
+DATE_CACHE_SIZE = 8192  # Distinct MM-DD-YYYY strings kept parsed; a clinic's dates mostly fit
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_ordinal(date_str):
+    # Day ordinal of an MM-DD-YYYY string; strptime is slow and clinics repeat the same few thousand dates,
+    # so each string is parsed once while it stays in the cache
+    return datetime.strptime(date_str, "%m-%d-%Y").toordinal()
+
+
+def parse_date(date_str):
+    # An MM-DD-YYYY string as a date
+    return date.fromordinal(parse_ordinal(date_str))
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def format_ordinal(ordinal):
+    # The MM-DD-YYYY string for a day ordinal
+    day = date.fromordinal(ordinal)
+    return f"{day.month:02d}-{day.day:02d}-{day.year:04d}"
+
+
+def validate_name(name, field_name):
+    # Validate a name: non-empty, letters plus spaces, apostrophes and hyphens
+    if not name.strip():
+        raise ValueError(f"{field_name} must be a non-empty string.")
+    rest = name.translate(NAME_PUNCTUATION)
+    if rest and not rest.isalpha():
+        raise ValueError(f"{field_name} contains invalid characters.")
+    return name
+
+
+def validate_date(date_str, field_name):
+    # Validate an optional MM-DD-YYYY date, returning a date or None for blank and "N/A"
+    if not date_str or date_str.strip().upper() == "N/A":
+        return None
+    try:
+        return parse_date(date_str)
+    except ValueError:
+        raise ValueError(DATE_MESSAGE.format(field_name))
+
+
+def validate_dob(date_str, field_name):
+    # Validate a required MM-DD-YYYY date, returning the string unchanged
+    try:
+        parse_ordinal(date_str)
+    except ValueError:
+        raise ValueError(DATE_MESSAGE.format(field_name))
+    return date_str
+
+
+def validate_phone(phone):
+    if not PHONE_PATTERN.match(phone):
+        raise ValueError("Phone number must be in the format 555-555-5555.")
+    return phone
+
+
+def validate_address(address):
+    if not address.strip():
+        raise ValueError("Address must be a non-empty string.")
+    return address
+
+
+def validate_prescription(value):
+    # Validate a prescription: "N/A" (None) or letters, digits, spaces and ' - /
+    if value == "N/A":
+        return None
+    if not value.strip():
+        raise ValueError("Prescription must be entered or 'N/A'.")
+    rest = value.translate(PRESCRIPTION_PUNCTUATION)
+    if rest and not rest.isalnum():
+        raise ValueError("Prescription contains invalid characters.")
+    return value
+
+
+def validate_optional_string(value, field_name):
+    # Validate an optional insurance field: "N/A" (None) or letters, digits, spaces, apostrophes and hyphens
+    if value == "N/A":
+        return None
+    if not value.strip():
+        raise ValueError(f"{field_name} must be entered or 'N/A'.")
+    rest = value.translate(OPTIONAL_STRING_PUNCTUATION)
+    if rest and not rest.isalnum():
+        raise ValueError(f"{field_name} contains invalid characters.")
+    return value
+
+
+def validate_optional_int(value):
+    # Validate an optional copay: "N/A" (None) or an integer
+    if value == "N/A":
+        return None
+    if not value.strip():
+        raise ValueError("Copay must be entered or 'N/A'.")
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("Copay must be an integer or 'N/A'.")
+
+
+# Validator for each field validate_many knows, taking just the value
+FIELD_VALIDATORS = {
+    "first_name": lambda value: validate_name(value, "First Name"),
+    "last_name": lambda value: validate_name(value, "Last Name"),
+    "dob": lambda value: validate_dob(value, "Date of Birth"),
+    "phone": validate_phone,
+    "address": validate_address,
+    "last_exam": lambda value: validate_date(value, "Last Exam"),
+    "prescription": validate_prescription,
+    "provider_name": lambda value: validate_optional_string(value, "Provider Name"),
+    "policy_number": lambda value: validate_optional_string(value, "Policy Number"),
+    "copay": validate_optional_int,
+}
+
+
+def validate_many(records, fields=None):
+    # Validate a batch of records (dicts keyed by field name) one field at a time, returning
+    # {field: [error message or None for each record]}; fields defaults to every known field the first
+    # record has
+    records = records if isinstance(records, list) else list(records)
+    if fields is None:
+        fields = [field for field in FIELD_VALIDATORS if records and field in records[0]]
+    errors = {}
+    for field in fields:
+        validator = FIELD_VALIDATORS[field]
+        column_errors = errors[field] = [None] * len(records)
+        for index, record in enumerate(records):
+            try:
+                validator(record.get(field, ""))
+            except (ValueError, TypeError, AttributeError) as error:
+                column_errors[index] = str(error)
+    return errors
+
+
+def first_errors(errors, count):
+    # The first failing field's message for each of count records in an error vector from validate_many, or
+    # None for the records that passed every field
+    messages = [None] * count
+    for index in range(count):
+        for column_errors in errors.values():
+            if column_errors[index] is not None:
+                messages[index] = column_errors[index]
+                break
+    return messages